@@ -2,6 +2,7 @@
 # Copyright (c) 2020 FRC Team 3260
 #
 
+import os
 import yaml
 import numpy as np
 from geometry import Polygon
@@ -55,11 +56,38 @@ class Config:
             self.occupancy_grid_cell_resolution = 0.1
             self.occupancy_grid_origin = (0, 0)
             self.occupancy_grid_dilation_kernel_size = 13
+            self.occupancy_grid_clearance_radius = 0.5  # Meters from obstacles beyond which driving costs nothing extra
+            self.occupancy_grid_clearance_weight = 1.0  # Extra cost right next to an obstacle, 0 to disable
+
+            # Behavior planning
+            self.pickup_sequencing_max_candidates = 0  # Balls considered when ordering pickups, 0 to go to the cheapest
+
+            # Motion planning
+            self.motion_planner = 'a_star'  # One of the keys of planning.MOTION_PLANNERS
+            self.motion_planning_max_expansions = 0  # Cells anytime_a_star may expand per frame, 0 for no limit
+            self.motion_planning_time_budget = 0.02  # Seconds anytime_a_star may search per frame, 0 for no limit
+            self.lattice_turn_cost = 0.2  # Meters of driving that turning in place by one of 16 headings is worth
+            self.lattice_heuristic_weight = 1.5  # Inflation of the lattice planner's heuristic, 1 for optimal paths
+            self.hierarchical_planner_levels = 2  # Coarse levels above the grid, each at half the resolution
+            self.landmark_heuristic_num_landmarks = 8  # Landmarks for a_star's ALT heuristic, 0 to disable
+            self.landmark_heuristic_cache_dir = os.path.join(os.path.dirname(os.path.abspath(fname)), '.cache')
+            self.trajectory_reuse_max_deviation = 0.3  # Meters the robot can stray from its trajectory and keep it
+            self.shortcut_trajectories = True  # Collapse planned paths to the waypoints where they turn
+            self.trajectory_cache_size = 32  # Planned paths remembered by start and goal cell, 0 to disable
+
+            # Pipeline
+            self.pipeline = False  # Run perception and planning in processes of their own, overlapping frames
+            self.pipeline_ring_size = 3  # Frames that can be queued between two stages
+            self.pipeline_max_sweep_points = 8192  # Capacity of the shared memory for every LIDAR sweep
+            self.pipeline_max_obstacles = 64  # Capacity of the shared memory for balls and other obstacles, each
 
             # LIDAR
             self.lidar_deadzone_radius = 0.85
 
             # Controls
+            # Hz to run controls at in their own thread, 0 to run them once per perception frame. Off until the drive
+            # constants the pose is predicted with below are calibrated.
+            self.control_rate = 0
             self.drive_kp = 40
             self.drive_ki = 1
             self.drive_kd = 1
@@ -67,6 +95,18 @@ class Config:
             self.max_forward_speed = 100
             self.max_intake_speed = 512
             self.max_outtake_speed = 512
+            self.drive_controller = 'pid'  # 'pid' to turn in place and drive straight, 'dwa' or 'pure_pursuit'
+            self.drive_wheel_speed_per_unit = 0.01  # Approximate wheel speed in m/s of one unit of motor speed
+            self.drive_track_width = 0.6  # Meters between the left and right wheels
+            self.dwa_num_samples = 256  # Wheel speed pairs simulated every control period
+            self.dwa_max_speed_change = 40  # Units of motor speed each wheel can change by in one control period
+            self.dwa_horizon = 0.5  # Seconds every sample is simulated for
+            self.dwa_time_step = 0.05  # Seconds between simulated positions
+            self.dwa_path_weight = 1.0  # Cost per meter of average distance from the planned trajectory
+            self.dwa_clearance_weight = 0.5  # Cost per unit of average clearance cost of the occupancy grid
+            self.dwa_progress_weight = 2.0  # Cost per meter left to the end of the reachable part of the trajectory
+            self.pure_pursuit_lookahead = 0.5  # Meters along the trajectory of the point pure pursuit steers towards
+            self.pure_pursuit_slowdown_distance = 0.2  # Meters before the end of the trajectory to start slowing down
 
             # Game pieces
             self.ball_radius = IN_TO_M * config['sim']['gamePiece']['radius']
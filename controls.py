@@ -5,7 +5,9 @@
 import time
 import geometry as geom
 import numpy as np
+from collections import deque
 from math import atan2
+from threading import Lock, Thread
 
 
 class PID:
@@ -67,6 +69,241 @@ class PID:
         return total_gain
 
 
+class DynamicWindowController:
+    """
+    Dynamic window controller for a differential drive. Every call samples hundreds of (left, right) wheel speed pairs
+    within reach of the previous command, rolls each of them forward for a short horizon with a differential drive
+    model, and picks the one whose rollout stays closest to the planned trajectory, keeps clear of obstacles and makes
+    the most progress along the trajectory. All of the rollouts are simulated and scored at once.
+    """
+    def __init__(self, config, seed=None):
+        """
+        :param config: Contains various constants from the robot
+        :param seed: Seed of the wheel speed samples, or None for a random one
+        """
+        self.max_speed = config.max_forward_speed
+        self.max_speed_change = config.dwa_max_speed_change
+        self.num_samples = config.dwa_num_samples
+        self.horizon = config.dwa_horizon
+        self.time_step = config.dwa_time_step
+        self.speed_per_unit = config.drive_wheel_speed_per_unit
+        self.track_width = config.drive_track_width
+        self.path_weight = config.dwa_path_weight
+        self.clearance_weight = config.dwa_clearance_weight
+        self.progress_weight = config.dwa_progress_weight
+        self.collision_weight = 100
+
+        self.prev_command = np.zeros(2)  # Last (left, right) wheel speeds, the center of the next window
+        self.rng = np.random.default_rng(seed)
+
+    def reset(self):
+        """
+        Centers the next window on standing still, for when the robot was stopped without this controller
+        """
+        self.prev_command = np.zeros(2)
+
+    def sample(self):
+        """
+        Returns wheel speed pairs within the dynamic window around the previous command as an array of shape (N, 2).
+        The previous command itself and stopping as quickly as possible are always among them.
+        """
+        low = np.maximum(self.prev_command - self.max_speed_change, -self.max_speed)
+        high = np.minimum(self.prev_command + self.max_speed_change, self.max_speed)
+        samples = self.rng.uniform(low, high, size=(self.num_samples, 2))
+        samples[0] = np.clip(self.prev_command, low, high)
+        samples[1] = np.clip(0, low, high)
+        return samples
+
+    def rollout(self, pose, commands):
+        """
+        Simulates driving with each pair of wheel speeds for the length of the horizon
+        :param pose: Current pose as ((x, y), theta)
+        :param commands: Array of (left, right) wheel speeds of shape (N, 2)
+        :return: Array of positions of shape (N, num_steps, 2), one every time step
+        """
+        (x, y), theta = pose
+        left = commands[:, 0] * self.speed_per_unit
+        right = commands[:, 1] * self.speed_per_unit
+        speed = (left + right) / 2
+        turn_rate = (right - left) / self.track_width
+
+        # Integrate using the heading halfway through every time step
+        num_steps = max(int(round(self.horizon / self.time_step)), 1)
+        times = np.arange(num_steps) * self.time_step
+        headings = theta + turn_rate[:, np.newaxis] * (times + self.time_step / 2)
+        directions = np.stack([np.cos(headings), np.sin(headings)], axis=2)
+        steps = speed[:, np.newaxis, np.newaxis] * self.time_step * directions
+        return np.array([x, y]) + np.cumsum(steps, axis=1)
+
+    def run(self, pose, trajectory, direction, occupancy_grid=None):
+        """
+        Picks the wheel speeds to drive with for this control period
+        :param pose: Current pose as ((x, y), theta)
+        :param trajectory: List of trajectory points as list(tuple(x, y), ...) to follow
+        :param direction: 1 to drive forwards, -1 to drive backwards
+        :param occupancy_grid: Optional occupancy grid whose clearance cost rollouts are scored against
+        :return: Tuple of (left, right) wheel speeds
+        """
+        # 1. The part of the trajectory that can be reached within the horizon, ending in a point to make progress to
+        position = np.asarray(pose[0], dtype=float)
+        path, _ = geom.trim_trajectory(trajectory, position)
+        path = np.asarray(path, dtype=float)
+        lookahead = self.max_speed * self.speed_per_unit * self.horizon
+        lengths = np.concatenate([[0], np.cumsum(np.linalg.norm(np.diff(path, axis=0), axis=1))])
+        end = min(int(np.searchsorted(lengths, lookahead)), len(path) - 1)
+        path = path[:end + 1]
+        if lengths[end] > lookahead:
+            fraction = (lookahead - lengths[end - 1]) / (lengths[end] - lengths[end - 1])
+            path[-1] = path[-2] + fraction * (path[-1] - path[-2])
+
+        # 2. Simulate every sample
+        commands = self.sample()
+        positions = self.rollout(pose, commands)
+        points = positions.reshape(-1, 2)
+
+        # 3. Distance of every rollout point to the nearest segment of the path
+        if len(path) > 1:
+            segment_starts, segments = path[:-1], np.diff(path, axis=0)
+            lengths_squared = np.maximum(np.sum(segments ** 2, axis=1), 1e-12)
+            offsets = points[:, np.newaxis] - segment_starts
+            t = np.clip(np.sum(offsets * segments, axis=2) / lengths_squared, 0, 1)
+            distances = np.linalg.norm(offsets - t[:, :, np.newaxis] * segments, axis=2).min(axis=1)
+        else:
+            distances = np.linalg.norm(points - path[0], axis=1)
+        path_cost = distances.reshape(positions.shape[:2]).mean(axis=1)
+
+        # 4. Distance left from the end of every rollout to the end of the path
+        progress_cost = np.linalg.norm(positions[:, -1] - path[-1], axis=1)
+
+        # 5. Clearance from the obstacles, where leaving the grid counts as hitting one
+        clearance_cost = np.zeros(len(commands))
+        collision_cost = np.zeros(len(commands))
+        if occupancy_grid is not None:
+            cols, rows = occupancy_grid.get_cell_indices(points)
+            off_grid = cols < 0
+            occupied = off_grid | (occupancy_grid.occupancy[cols, rows] != 0)
+            cell_cost = np.where(off_grid, 0, occupancy_grid.clearance_cost[cols, rows])
+            clearance_cost = cell_cost.reshape(positions.shape[:2]).mean(axis=1)
+            collision_cost = occupied.reshape(positions.shape[:2]).mean(axis=1)
+
+        # 6. Driving the wrong way is never better than standing still
+        wrong_way = (commands[:, 0] + commands[:, 1]) * direction < 0
+
+        costs = self.path_weight * path_cost + self.progress_weight * progress_cost + \
+            self.clearance_weight * clearance_cost + self.collision_weight * (collision_cost + wrong_way)
+        self.prev_command = commands[int(np.argmin(costs))]
+        return int(self.prev_command[0]), int(self.prev_command[1])
+
+
+class PurePursuit:
+    """
+    Pure pursuit trajectory follower. The robot steers along the circular arc that passes through a point a fixed
+    distance further along the trajectory, so it follows the whole trajectory rather than only its next waypoint. The
+    cumulative arc length of the trajectory is computed once for every new trajectory, so every call only has to
+    project the robot onto the few segments around its last position and binary search for the lookahead point.
+    """
+    def __init__(self, config):
+        """
+        :param config: Contains various constants from the robot
+        """
+        self.max_speed = config.max_forward_speed
+        self.lookahead = config.pure_pursuit_lookahead
+        self.slowdown_distance = config.pure_pursuit_slowdown_distance
+        self.track_width = config.drive_track_width
+
+        self.trajectory = None  # Trajectory the arc lengths were computed for
+        self.points = None
+        self.arc_lengths = None  # Arc length from the start of the trajectory to every point
+        self.progress = 0  # Arc length of the robot's position projected onto the trajectory
+
+    def set_trajectory(self, trajectory):
+        """
+        Precomputes the arc lengths of a new trajectory. Does nothing if it's the same trajectory as last time.
+        :param trajectory: List of trajectory points as list(tuple(x, y), ...)
+        """
+        if trajectory is self.trajectory:
+            return
+        self.trajectory = trajectory
+        self.points = np.asarray(trajectory, dtype=float).reshape(-1, 2)
+        self.arc_lengths = np.concatenate([[0], np.cumsum(np.linalg.norm(np.diff(self.points, axis=0), axis=1))])
+        self.progress = 0
+
+    def point_at(self, arc_length):
+        """
+        Returns the point of the trajectory at the given arc length from its start, clamped to its ends
+        """
+        arc_length = min(max(arc_length, 0), self.arc_lengths[-1])
+        i = min(int(np.searchsorted(self.arc_lengths, arc_length, side='right')), len(self.points) - 1)
+        if i == 0 or self.arc_lengths[i] == self.arc_lengths[i - 1]:
+            return self.points[i]
+        fraction = (arc_length - self.arc_lengths[i - 1]) / (self.arc_lengths[i] - self.arc_lengths[i - 1])
+        return self.points[i - 1] + fraction * (self.points[i] - self.points[i - 1])
+
+    def project(self, position):
+        """
+        Returns the arc length of the point of the trajectory closest to the given position, only looking at the
+        segments between the robot's last projection and the lookahead distance past it
+        """
+        first = max(int(np.searchsorted(self.arc_lengths, self.progress, side='right')) - 1, 0)
+        last = max(int(np.searchsorted(self.arc_lengths, self.progress + self.lookahead, side='right')), first + 1)
+        last = min(last, len(self.points) - 1)
+        if last <= first:
+            return self.arc_lengths[-1]
+        starts, ends = self.points[first:last], self.points[first + 1:last + 1]
+
+        segments = ends - starts
+        lengths_squared = np.maximum(np.sum(segments ** 2, axis=1), 1e-12)
+        t = np.clip(np.sum((position - starts) * segments, axis=1) / lengths_squared, 0, 1)
+        distances = np.linalg.norm(starts + t[:, np.newaxis] * segments - position, axis=1)
+        closest = int(np.argmin(distances))
+        segment_lengths = self.arc_lengths[first + 1:last + 1] - self.arc_lengths[first:last]
+        return self.arc_lengths[first + closest] + t[closest] * segment_lengths[closest]
+
+    def run(self, pose, trajectory, direction):
+        """
+        Calculates the wheel speeds that steer towards the lookahead point
+        :param pose: Current pose as ((x, y), theta)
+        :param trajectory: List of trajectory points as list(tuple(x, y), ...) to follow
+        :param direction: 1 to drive forwards, -1 to drive backwards
+        :return: Tuple of (left, right) wheel speeds
+        """
+        self.set_trajectory(trajectory)
+        position = np.asarray(pose[0], dtype=float)
+
+        # 1. Find how far along the trajectory we are and the point to steer towards
+        self.progress = self.project(position)
+        target = self.point_at(self.progress + self.lookahead)
+        remaining = self.arc_lengths[-1] - self.progress + np.linalg.norm(self.point_at(self.progress) - position)
+
+        # 2. Express the target in the frame of the robot, turned around if we're driving backwards
+        heading = pose[1] + (np.pi if direction == -1 else 0)
+        offset = target - position
+        forward = np.cos(heading) * offset[0] + np.sin(heading) * offset[1]
+        left = -np.sin(heading) * offset[0] + np.cos(heading) * offset[1]
+
+        # 3. Slow down at the end of the trajectory
+        speed = self.max_speed * min(1, remaining / self.slowdown_distance) if self.slowdown_distance > 0 else \
+            self.max_speed
+        if forward <= 0:
+            # The target is behind us, so turn in place towards it
+            turn = speed if left >= 0 else -speed
+            left_speed, right_speed = -turn, turn
+        else:
+            # Curvature of the arc through the target, tangent to our heading
+            curvature = 2 * left / max(forward ** 2 + left ** 2, 1e-12)
+            left_speed = speed * (1 - curvature * self.track_width / 2)
+            right_speed = speed * (1 + curvature * self.track_width / 2)
+
+            # Keep the outer wheel within the speed limit
+            scale = min(1, self.max_speed / max(abs(left_speed), abs(right_speed), 1e-12))
+            left_speed, right_speed = left_speed * scale, right_speed * scale
+
+        # 4. Driving backwards turns the robot the same way with both wheels reversed and swapped
+        if direction == -1:
+            left_speed, right_speed = -right_speed, -left_speed
+        return int(left_speed), int(right_speed)
+
+
 class Controls:
     """
     This class generates motor values from the output of planning, including for the two drive motors, intakes, and
@@ -90,13 +327,19 @@ class Controls:
         self.left_drive_pid = PID(kp, ki, kd)
         self.right_drive_pid = PID(kp, ki, kd)
 
-    def run(self, plan_state):
+        if config.drive_controller not in ('pid', 'dwa', 'pure_pursuit'):
+            raise ValueError(f"Unknown drive controller '{config.drive_controller}'")
+        self.dynamic_window = DynamicWindowController(config) if config.drive_controller == 'dwa' else None
+        self.pure_pursuit = PurePursuit(config) if config.drive_controller == 'pure_pursuit' else None
+
+    def run(self, plan_state, now=None):
         """
         Calculates controls given the current plan state
         :param plan_state: Dict containing robot's current pose and some goal state
+        :param now: Current time in seconds, or None to read the clock
         :return: Dict containing motor speeds for each motor on the robot
         """
-        curr_time = time.time()
+        curr_time = time.time() if now is None else now
         vehicle_commands = {
             'leftDriveMotorSpeed': 0,  # Left drive motor speed (-512 - 512)
             'rightDriveMotorSpeed': 0,  # Right drive motor speed (-512 - 512)
@@ -111,6 +354,8 @@ class Controls:
         }
 
         if plan_state['trajectory'] is None:
+            if self.dynamic_window is not None:
+                self.dynamic_window.reset()
             return vehicle_commands # nothing new here
 
         pose = plan_state['pose']
@@ -138,6 +383,13 @@ class Controls:
         if direction == 0:
             left_drive_speed = 0
             right_drive_speed = 0
+            if self.dynamic_window is not None:
+                self.dynamic_window.reset()
+        elif self.dynamic_window is not None:
+            left_drive_speed, right_drive_speed = self.dynamic_window.run(pose, plan_state['trajectory'], direction,
+                                                                          plan_state.get('grid'))
+        elif self.pure_pursuit is not None:
+            left_drive_speed, right_drive_speed = self.pure_pursuit.run(pose, plan_state['trajectory'], direction)
         elif abs(heading_error) >= self.heading_error_threshold:
             left_drive_speed = -int(self.left_drive_pid.run(0, heading_error, curr_time))
             right_drive_speed = int(self.right_drive_pid.run(0, heading_error, curr_time))
@@ -159,3 +411,183 @@ class Controls:
         vehicle_commands['tubeMotorSpeed'] = outtake_speed
 
         return vehicle_commands
+
+
+class ControlThread(Thread):
+    """
+    Runs Controls at a fixed rate in the background against the latest plan, so drive commands keep up with comms
+    while perception and planning run at whatever rate they can. Between plans, the pose the plan was made from is
+    propagated forward with a differential drive model using the commands that have been sent since, and when the plan
+    comes with a navigation function, its next waypoint from that pose is looked up every loop.
+    """
+    def __init__(self, controls, config, comms, commands_mutex, clock=time.time, sleep=time.sleep):
+        """
+        :param controls: Controls to run
+        :param config: Contains various constants from the robot
+        :param comms: CommsThread whose vehicle_commands get updated
+        :param commands_mutex: Lock to hold while modifying the vehicle commands of comms
+        :param clock: Function returning the current time in seconds
+        :param sleep: Function sleeping for the given number of seconds
+        """
+        super(ControlThread, self).__init__()
+        self.daemon = True
+        self.controls = controls
+        self.comms = comms
+        self.commands_mutex = commands_mutex
+        self.period = 1 / config.control_rate
+        self.speed_per_unit = config.drive_wheel_speed_per_unit
+        self.track_width = config.drive_track_width
+        self.clock = clock
+        self.sleep = sleep
+        self.running = True
+
+        self.mutex = Lock()  # Held while touching anything below, which is shared with the main thread
+        self.plan_state = None
+        self.plan_time = None  # Time at which the plan's pose was measured
+        self.commands = deque()  # (time, left, right) of every drive command in effect since plan_time
+        self.max_commands = max(int(config.control_rate), 2)  # About a second's worth of commands
+        self.loops = deque()  # (time, jitter) of every loop over the last second
+        self.missed_deadlines = 0
+
+    def set_plan(self, plan_state, plan_time):
+        """
+        Replaces the plan to follow. Planning keeps updating its grid while this thread runs controls, so controls get
+        a snapshot of it.
+        :param plan_state: Output of planning
+        :param plan_time: Time at which the pose in plan_state was measured
+        """
+        plan_state = dict(plan_state)
+        if plan_state.get('grid') is not None:
+            plan_state['grid'] = plan_state['grid'].snapshot()
+        with self.mutex:
+            self.plan_state = plan_state
+            self.plan_time = plan_time
+            self.trim_commands()
+
+    def trim_commands(self):
+        """
+        Drops the commands that stopped being in effect before plan_time. While planning stalls, the oldest commands are
+        folded into the plan's pose once there are more than max_commands of them, so predicting the pose stays cheap.
+        Must be called while holding the mutex.
+        """
+        while len(self.commands) > 1 and self.commands[1][0] <= self.plan_time:
+            self.commands.popleft()
+
+        while len(self.commands) > self.max_commands:
+            (start, left, right), end = self.commands.popleft(), self.commands[0][0]
+            self.plan_state['pose'] = propagate_pose(self.plan_state['pose'], left * self.speed_per_unit,
+                                                     right * self.speed_per_unit, self.track_width,
+                                                     end - max(start, self.plan_time))
+            self.plan_time = end
+
+    def predict_pose(self, now):
+        """
+        Propagates the pose of the plan to the given time with the commands that were sent in between. Must be called
+        while holding the mutex.
+        """
+        (x, y), theta = self.plan_state['pose']
+        ends = [command[0] for command in self.commands][1:] + [now]
+        for (start, left, right), end in zip(self.commands, ends):
+            duration = end - max(start, self.plan_time)
+            if duration <= 0:
+                continue
+            (x, y), theta = propagate_pose(((x, y), theta), left * self.speed_per_unit, right * self.speed_per_unit,
+                                           self.track_width, duration)
+        return (x, y), theta
+
+    def step(self, now):
+        """
+        Runs controls once against the latest plan and the predicted pose, and hands the commands to comms
+        :param now: Current time
+        """
+        with self.mutex:
+            if self.plan_state is None:
+                return
+            plan_state = dict(self.plan_state)
+            plan_state['pose'] = self.predict_pose(now)
+
+        # Head for the next waypoint of the planner's navigation function from wherever the robot is by now, and rejoin
+        # the plan's trajectory from there
+        next_waypoint = plan_state.get('next_waypoint')
+        if next_waypoint is not None and plan_state['trajectory'] is not None:
+            position = plan_state['pose'][0]
+            waypoint = next_waypoint(position)
+            if waypoint is not None:
+                trajectory, _ = geom.trim_trajectory(plan_state['trajectory'], waypoint)
+                if len(trajectory) > 1 and geom.dist(trajectory[0], trajectory[1]) < 1e-9:
+                    del trajectory[1]  # The waypoint is usually one of the trajectory's cell centers
+                plan_state['trajectory'] = [position] + trajectory
+
+        vehicle_commands = self.controls.run(plan_state, now)
+        del vehicle_commands['draw']  # Drawing is left to the main thread
+        with self.mutex:
+            self.commands.append((now, vehicle_commands['leftDriveMotorSpeed'],
+                                  vehicle_commands['rightDriveMotorSpeed']))
+            self.trim_commands()
+        with self.commands_mutex:
+            self.comms.vehicle_commands.update(vehicle_commands)
+
+    def record_loop(self, now, deadline):
+        """
+        Records how late a loop started and returns when the next one should start. Loops that start more than a
+        period late have missed their deadline, and the schedule restarts from now rather than trying to catch up.
+        :param now: Time the loop started
+        :param deadline: Time the loop should have started
+        :return: Time the next loop should start
+        """
+        jitter = now - deadline
+        with self.mutex:
+            self.loops.append((now, jitter))
+            while now - self.loops[0][0] > 1:
+                self.loops.popleft()
+            if jitter > self.period:
+                self.missed_deadlines += 1
+                return now + self.period
+        return deadline + self.period
+
+    def metrics(self):
+        """
+        Returns a dict of the number of loops run over the last second, their mean and worst jitter in seconds, and
+        the number of deadlines missed since the thread started
+        """
+        with self.mutex:
+            jitters = [jitter for _, jitter in self.loops]
+            return {
+                'rate': len(jitters),
+                'mean_jitter': float(np.mean(jitters)) if jitters else 0.0,
+                'max_jitter': max(jitters, default=0.0),
+                'missed_deadlines': self.missed_deadlines
+            }
+
+    def run(self):
+        deadline = self.clock()
+        while self.running:
+            now = self.clock()
+            deadline = self.record_loop(now, deadline)
+            self.step(now)
+            self.sleep(max(deadline - self.clock(), 0))
+
+    def stop(self):
+        self.running = False
+
+
+def propagate_pose(pose, left_speed, right_speed, track_width, duration):
+    """
+    Drives a differential drive robot along the arc given by constant wheel speeds
+    :param pose: Starting pose as ((x, y), theta)
+    :param left_speed: Left wheel speed in m/s
+    :param right_speed: Right wheel speed in m/s
+    :param track_width: Meters between the left and right wheels
+    :param duration: Seconds to drive for
+    :return: Pose at the end as ((x, y), theta)
+    """
+    (x, y), theta = pose
+    speed = (left_speed + right_speed) / 2
+    turn_rate = (right_speed - left_speed) / track_width
+    end_theta = theta + turn_rate * duration
+
+    if abs(turn_rate) < 1e-9:
+        return (x + speed * duration * np.cos(theta), y + speed * duration * np.sin(theta)), end_theta
+    radius = speed / turn_rate
+    return (x + radius * (np.sin(end_theta) - np.sin(theta)), y - radius * (np.cos(end_theta) - np.cos(theta))), \
+        end_theta
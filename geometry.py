@@ -2,11 +2,28 @@
 # Copyright (c) 2020 FRC Team 3260
 #
 
+import copy
+import hashlib
+import os
 import numpy as np
-from collections import defaultdict
-from math import atan2
+from collections import defaultdict, OrderedDict
+from math import atan2, sqrt
+import heapq
+import threading
+import time
 import cv2 as cv
 
+SQRT_2 = sqrt(2)
+
+# 8-connected neighbors as (d_col, d_row, step length in cells)
+NEIGHBOR_OFFSETS = ((1, 0, 1), (-1, 0, 1), (0, 1, 1), (0, -1, 1),
+                    (1, 1, SQRT_2), (-1, 1, SQRT_2), (1, -1, SQRT_2), (-1, -1, SQRT_2))
+
+# Headings of the state lattice as (d_col, d_row), counterclockwise from +x. Pointing at the cells of a 16-connected
+# neighborhood lets every heading drive straight from cell center to cell center.
+LATTICE_HEADINGS = ((1, 0), (2, 1), (1, 1), (1, 2), (0, 1), (-1, 2), (-1, 1), (-2, 1),
+                    (-1, 0), (-2, -1), (-1, -1), (-1, -2), (0, -1), (1, -2), (1, -1), (2, -1))
+
 
 class Node:
     def __init__(self, position, indices):
@@ -51,6 +68,24 @@ class OccupancyGrid:
 
         self.occupancy = np.zeros(self.grid.shape, dtype=np.uint8)
 
+        # Occupancy is the union of a dilated static layer, built once, and a dilated dynamic layer, rebuilt every frame
+        self.static_occupancy = np.zeros(self.grid.shape, dtype=np.uint8)
+        self.dynamic_occupancy = np.zeros(self.grid.shape, dtype=np.uint8)
+        self.dynamic_boxes = np.zeros((0, 4))  # Obstacles of the dynamic layer as rows of (min_x, min_y, max_x, max_y)
+        self.dynamic_kernel_size = None  # Kernel the dynamic layer was last dilated by
+
+        # Connected regions of free cells and the occupancy array they were labeled from, see component_labels()
+        self.labels = None
+        self.labeled_occupancy = None
+
+        # Extra cost of driving through each cell, as a fraction of the normal cost, graded by the cell's clearance from
+        # the nearest occupied cell. Disabled until set_clearance_cost() is called.
+        self.clearance_radius = 0
+        self.clearance_weight = 0
+        self.static_clearance = self.distance_to_occupied(self.static_occupancy)
+        self.clearance = self.static_clearance
+        self.clearance_cost = np.zeros(self.grid.shape)
+
         # 1. Create all the nodes
         for col in range(self.num_cols):
             for row in range(self.num_rows):
@@ -113,6 +148,51 @@ class OccupancyGrid:
         else:
             return None
 
+    def get_cell_indices(self, points):
+        """
+        Vectorized version of get_cell() that returns the indices of the cells containing all of the given points at
+        once. Points that are out-of-bounds get indices of -1.
+        :param points: Points as list(tuple(x, y), ...) or an array of shape (N, 2)
+        :return: Tuple of (cols, rows) integer arrays
+        """
+        min_corner = np.array(self.origin) - np.array([self.width, self.height]) / 2
+        indices = np.floor((np.reshape(points, (-1, 2)) - min_corner) / self.cell_resolution).astype(int)
+        in_bounds = np.all((indices >= 0) & (indices < (self.num_cols, self.num_rows)), axis=1)
+        indices[~in_bounds] = -1
+        return indices[:, 0], indices[:, 1]
+
+    def component_labels(self):
+        """
+        Labels the connected regions of free cells, using the same 8-connectivity as the planners, so that two cells
+        can only be connected by a path if they have the same label. Occupied cells are labeled 0. The labels are
+        reused until the occupancy array is replaced, which setting the static or dynamic obstacles does whenever they
+        change.
+        :return: Array of labels shaped like the grid
+        """
+        if self.labels is None or self.labeled_occupancy is not self.occupancy:
+            _, self.labels = cv.connectedComponents((self.occupancy == 0).astype(np.uint8), connectivity=8)
+            self.labeled_occupancy = self.occupancy
+        return self.labels
+
+    def reachable(self, start, goals):
+        """
+        Tests which goals a planner could find a path to from start without searching, by comparing their labels
+        :param start: Starting position
+        :param goals: Goal positions as list(tuple(x, y), ...)
+        :return: Boolean array with an entry for every goal
+        """
+        cols, rows = self.get_cell_indices(goals)
+        start_node = self.get_cell(start)
+        if start_node is None:
+            return np.zeros(len(cols), dtype=bool)
+
+        # Planners fail when the start cell is occupied, so nothing can be reached from one
+        labels = self.component_labels()
+        start_label = labels[start_node.indices]
+        if start_label == 0:
+            return np.zeros(len(cols), dtype=bool)
+        return (cols >= 0) & (labels[cols, rows] == start_label)
+
     def get_region(self, bbox):
         """
         Returns the min/max column and row indices corresponding to the given bounding box
@@ -126,6 +206,18 @@ class OccupancyGrid:
         max_row = int((max_y + self.origin[1]) / self.cell_resolution + self.num_rows / 2)
         return min_col, min_row, max_col, max_row
 
+    def get_region_slices(self, bbox, padding=0):
+        """
+        Returns slices into the grid covering the given bounding box, grown by padding cells on every side and clipped to
+        the edges of the grid
+        :param bbox: Bounding box in the form ((min_x, min_y), (max_x, max_y))
+        :param padding: Number of extra cells to include on every side
+        :return: Slices as (col_slice, row_slice)
+        """
+        min_col, min_row, max_col, max_row = self.get_region(bbox)
+        return (slice(max(min_col - padding, 0), max(max_col + padding + 1, 0)),
+                slice(max(min_row - padding, 0), max(max_row + padding + 1, 0)))
+
     def get_occupancy(self, pos):
         cell = self.get_cell(pos)
         return self.occupancy[cell.indices]
@@ -135,51 +227,164 @@ class OccupancyGrid:
         Finds the grid cells corresponding to the given obstacle and marks them as occupied.
         :param obstacle: A rectangular obstacle in the form ((min_x, min_y), (max_x, max_y))
         """
-        min_col, min_row, max_col, max_row = self.get_region(obstacle)
-
-        for col in range(min_col, max_col+1):
-            for row in range(min_row, max_row+1):
-                self.occupancy[col][row] = 1
+        self.occupancy[self.get_region_slices(obstacle)] = 1
 
     def insert_convex_polygon(self, polygon):
         """
-        Find the grid cells corresponding to each obstacle and marks them as occupied.
+        Find the grid cells that overlap the given polygon and marks them as occupied. Every cell in the polygon's
+        bounding region is tested at once with the separating axis theorem: a cell overlaps a convex polygon unless the
+        cell lies entirely outside of the polygon's bounding box or entirely outside of one of its edges.
         :param polygon: A Polygon type
         """
-        # 1. Find the sub grid to iterate over
-        min_col, min_row, max_col, max_row = self.get_region(bounding_box(polygon.vertices))
-
-        # 2. Iterate over each column
-        for col in self.grid[min_col:max_col+1, min_row:max_row+1]:
-            col_x, _ = col[0].position
-            # 3. In the current col, find all the contact points where the current col intersects with the polygon
-            contact_cells = set()
-            for i in range(len(polygon.vertices)):
-                p1 = polygon.vertices[i - 1]
-                p2 = polygon.vertices[i]
-                if p1[0] <= col_x <= p2[0] or p2[0] <= col_x <= p1[0]:
-                    # go on to the next edge if this one's slope is undefined
-                    num = p2[1]-p1[1]
-                    den = p2[0]-p1[0]
-                    m = num / (den if den else 1e-5)
-                    x = col_x
-                    y = m*(x - p1[0]) + p1[1]
-                    cell = self.get_cell((x, y))
-                    if cell is not None:
-                        contact_cells.add(cell)
-
-            # 4. Iterate over the contact points marking each cell in this row as occupied/unoccupied
-            occupied_flag = 0
-
-            if len(contact_cells) != 1:
-                for cell in col:
-                    self.occupancy[cell.indices] = occupied_flag or self.occupancy[cell.indices]
-                    if cell in contact_cells:
-                        self.occupancy[cell.indices] = 1  # make sure contact cells are marked as occupied
-                        occupied_flag = not occupied_flag
+        # 1. Find the sub grid to test
+        poly_bbox = bounding_box(polygon.vertices)
+        col_slice, row_slice = self.get_region_slices(poly_bbox)
+        cols = np.arange(self.num_cols)[col_slice]
+        rows = np.arange(self.num_rows)[row_slice]
+        if len(cols) == 0 or len(rows) == 0:
+            return
+
+        # 2. Find the corners of every cell in the sub grid, as a column vector of x's and a row vector of y's
+        min_x = self.origin[0] - (self.width / 2) + cols[:, np.newaxis] * self.cell_resolution
+        min_y = self.origin[1] - (self.height / 2) + rows[np.newaxis, :] * self.cell_resolution
+        max_x = min_x + self.cell_resolution
+        max_y = min_y + self.cell_resolution
+
+        # 3. Test against the axes of the cells, i.e. the polygon's bounding box
+        (poly_min_x, poly_min_y), (poly_max_x, poly_max_y) = poly_bbox
+        overlaps = (min_x < poly_max_x) & (max_x > poly_min_x) & (min_y < poly_max_y) & (max_y > poly_min_y)
+
+        # 4. Test against the normal of each edge using the corner of each cell that is furthest inside that edge
+        vertices = np.asarray(polygon.vertices, dtype=float)
+        edges = np.roll(vertices, -1, axis=0) - vertices
+        orientation = np.sign(np.sum(vertices[:, 0] * edges[:, 1] - vertices[:, 1] * edges[:, 0]))  # +1 if ccw
+        for (x, y), (edge_x, edge_y) in zip(vertices, edges * orientation):
+            corner_x = max_x if edge_y < 0 else min_x
+            corner_y = max_y if edge_x > 0 else min_y
+            overlaps &= edge_x * (corner_y - y) - edge_y * (corner_x - x) > 0
+
+        self.occupancy[col_slice, row_slice] |= overlaps.astype(np.uint8)
+
+    def insert_obstacles(self, obstacles):
+        """
+        Marks the cells of every obstacle in the given list as occupied in one call.
+        :param obstacles: List of Polygon types and/or rectangular obstacles in the form ((min_x, min_y), (max_x, max_y))
+        """
+        for obstacle in obstacles:
+            if isinstance(obstacle, Polygon):
+                self.insert_convex_polygon(obstacle)
             else:
-                for cell in contact_cells:
-                    self.occupancy[cell.indices] = 1  # make sure contact cells are marked as occupied
+                self.insert_rectangular_obstacle(obstacle)
+
+    def set_static_obstacles(self, polygons, kernel_size):
+        """
+        Rasterizes and dilates the given convex polygons into the static layer of the grid. This only needs to happen
+        once, after which every call to set_dynamic_obstacles() reuses the result.
+        :param polygons: List of Polygon types
+        :param kernel_size: Odd integer to use for sliding window
+        """
+        self.occupancy = np.zeros(self.grid.shape, dtype=np.uint8)
+        self.insert_obstacles(polygons)
+        self.dilate(kernel_size)
+
+        self.static_occupancy = self.occupancy
+        self.static_clearance = self.distance_to_occupied(self.static_occupancy)
+        self.occupancy = self.static_occupancy | self.dynamic_occupancy
+        self.update_clearance_cost()
+
+    def set_dynamic_obstacles(self, obstacles, kernel_size):
+        """
+        Replaces the dynamic layer of the grid with the given rectangular obstacles, dilated by the given kernel, and
+        combines it with the static layer. Only the cells around each obstacle are touched, and nothing is done if the
+        obstacles are the same as last time.
+        :param obstacles: List of rectangular obstacles in the form ((min_x, min_y), (max_x, max_y))
+        :param kernel_size: Odd integer to use for sliding window
+        """
+        if kernel_size % 2 != 1:
+            raise ValueError("Kernel size must be an odd integer")
+
+        boxes = np.asarray(obstacles, dtype=float).reshape(-1, 4)
+        if self.dynamic_kernel_size == kernel_size and np.array_equal(self.dynamic_boxes, boxes):
+            return
+        self.dynamic_boxes = boxes
+        self.dynamic_kernel_size = kernel_size
+
+        # Dilating a rectangle by a square kernel is the same rectangle grown by the kernel's radius on every side
+        radius = kernel_size // 2
+        self.dynamic_occupancy = np.zeros(self.grid.shape, dtype=np.uint8)
+        for obstacle in obstacles:
+            self.dynamic_occupancy[self.get_region_slices(obstacle, padding=radius)] = 1
+
+        self.occupancy = self.static_occupancy | self.dynamic_occupancy
+        self.update_clearance_cost()
+
+    def set_clearance_cost(self, radius, weight):
+        """
+        Makes cells close to occupied cells more expensive to drive through, so planners keep their distance from
+        obstacles when there is room to. Right next to an occupied cell, driving costs (1 + weight) times as much as
+        normal, and the extra cost falls off linearly to nothing at the given clearance.
+        :param radius: Clearance in meters beyond which cells cost nothing extra
+        :param weight: Extra cost next to an occupied cell as a fraction of the normal cost, or 0 to disable
+        """
+        self.clearance_radius = radius
+        self.clearance_weight = weight
+        self.update_clearance_cost()
+
+    def update_clearance_cost(self):
+        """
+        Recomputes the clearance of every cell and its extra cost in one pass. The distance to the static layer only
+        changes with the static obstacles, so only the dynamic layer's distance field is recomputed here.
+        """
+        if not self.clearance_weight:
+            self.clearance_cost = np.zeros(self.grid.shape)
+            return
+
+        self.clearance = np.minimum(self.static_clearance, self.distance_to_occupied(self.dynamic_occupancy))
+        self.clearance_cost = self.clearance_to_cost(self.clearance)
+
+    def clearance_to_cost(self, clearance):
+        """
+        Converts clearances in meters into the extra cost of driving through cells with those clearances
+        """
+        if not self.clearance_weight:
+            return np.zeros(np.shape(clearance))
+        return self.clearance_weight * np.clip(1 - clearance / self.clearance_radius, 0, 1)
+
+    def snapshot(self):
+        """
+        Returns a copy of this grid whose occupancy and clearance cost stay the same while this grid is updated, e.g. for
+        reading it from another thread. The copy shares its nodes with this grid.
+        """
+        grid = copy.copy(self)
+        grid.occupancy = self.occupancy.copy()
+        grid.clearance_cost = self.clearance_cost.copy()
+        return grid
+
+    def static_layer(self):
+        """
+        Returns a copy of this grid containing only the static obstacles, e.g. for planning so far ahead that the
+        dynamic obstacles will have moved by the time we get there. The copy shares its nodes and static layer with
+        this grid, so it's cheap to make.
+        """
+        static_grid = copy.copy(self)
+        static_grid.occupancy = self.static_occupancy
+        static_grid.dynamic_occupancy = np.zeros(self.grid.shape, dtype=np.uint8)
+        static_grid.dynamic_boxes = np.zeros((0, 4))
+        static_grid.dynamic_kernel_size = None
+        static_grid.clearance = self.static_clearance
+        static_grid.clearance_cost = self.clearance_to_cost(self.static_clearance)
+        return static_grid
+
+    def distance_to_occupied(self, occupancy):
+        """
+        Returns the Euclidean distance in meters from the center of every cell to the center of the nearest occupied
+        cell in the given layer, or infinity everywhere if nothing is occupied.
+        :param occupancy: Occupancy layer shaped like the grid
+        """
+        if not occupancy.any():
+            return np.full(self.grid.shape, np.inf)
+        free = (occupancy == 0).astype(np.uint8)
+        return self.cell_resolution * cv.distanceTransform(free, cv.DIST_L2, cv.DIST_MASK_PRECISE).astype(float)
 
     def dilate(self, kernel_size):
         """
@@ -193,72 +398,1777 @@ class OccupancyGrid:
         self.occupancy = cv.dilate(self.occupancy, kernel)
 
 
-def a_star(occupancy_grid, start, goal):
+def a_star(occupancy_grid, start, goal, landmarks=None):
     """
     Returns a trajectory from start to goal as a list of Nodes or None if no path is found. The returned trajectory will
     start with the start node and end with the goal node and is guaranteed to have at least a length of 2.
+
+    The open list is a binary heap keyed on f(x) = g(x) + h(x), where g(x) is the accumulated octile path cost,
+    including the grid's clearance cost, and h(x) is the octile distance to the goal. Instead of a decrease-key
+    operation, an improved node is pushed again and the stale heap entry is skipped once the node has been closed.
+
+    Given landmarks, h(x) is the larger of the octile distance and their ALT bound, which steers the search around the
+    field elements instead of into them.
     :param occupancy_grid: Occupancy grid
     :param start: Starting position
     :param goal: Goal position
+    :param landmarks: Optional LandmarkHeuristic computed on the grid's static layer
     :return: List of trajectory points as list(tuple(x, y), ...)
     """
     start_node = occupancy_grid.get_cell(start)
     goal_node = occupancy_grid.get_cell(goal)
 
+    # Make sure start and goal are on the grid
+    if start_node is None or goal_node is None:
+        return None
+
     # Trivial case
     if start_node is goal_node:
         return [start, goal]
 
-    start_node.parent = start_node  # Just needs to be something other than None so we don't try to explore it
-    queue = [(0, start_node)]
-
     # Make sure start_node and/or goal are not obstructed
-    if occupancy_grid.occupancy[start_node.indices] or occupancy_grid.occupancy[goal_node.indices]:
+    occupancy = occupancy_grid.occupancy
+    if occupancy[start_node.indices] or occupancy[goal_node.indices]:
+        return None
+
+    goal_indices = goal_node.indices
+    landmark_bounds = landmarks.heuristic(goal_indices) if landmarks is not None else None
+    parents = grid_a_star(occupancy, occupancy_grid.clearance_cost, occupancy_grid.cell_resolution,
+                          start_node.indices, goal_indices, landmark_bounds)
+
+    # If no path was found, return none
+    if parents is None:
         return None
 
-    while len(queue) > 0 and goal_node.parent is None:
-        # Pop a node from the queue
-        _, curr_node = queue.pop(0)
+    return trajectory_from_parents(occupancy_grid, parents, start, goal)
+
+
+def grid_a_star(occupancy, clearance_cost, resolution, start_indices, goal_indices, landmark_bounds=None):
+    """
+    Runs the search behind a_star() directly on the layers of a grid, so it can also search grids that aren't an
+    OccupancyGrid, like the coarser levels of a GridPyramid.
+    :param occupancy: Occupancy layer
+    :param clearance_cost: Clearance cost layer shaped like occupancy
+    :param resolution: Width and height of a single cell in meters
+    :param start_indices: Indices of the start cell as tuple(col, row)
+    :param goal_indices: Indices of the goal cell as tuple(col, row)
+    :param landmark_bounds: Optional lower bounds on the cost from every cell to the goal, shaped like occupancy
+    :return: Array of shape (num_cols, num_rows, 2) holding each cell's parent indices, or None if no path is found
+    """
+    num_cols, num_rows = occupancy.shape
+
+    # Per-cell search state
+    g_costs = np.full(occupancy.shape, np.inf)
+    closed = np.zeros(occupancy.shape, dtype=bool)
+    parents = np.full(occupancy.shape + (2,), -1, dtype=np.int32)
+
+    g_costs[start_indices] = 0
+    queue = [(resolution * octile_dist(start_indices, goal_indices), 0, start_indices)]
+
+    while len(queue) > 0:
+        # Pop the most promising node, skipping stale entries of nodes we've already expanded
+        _, _, curr = heapq.heappop(queue)
+        if closed[curr]:
+            continue
+        closed[curr] = True
+
+        # If we reached the goal, break out
+        if curr == goal_indices:
+            break
 
         # Run through its neighbors
-        for neighbor in curr_node.neighbors:
-            # If we found the goal, break out
-            if neighbor == goal_node:
-                neighbor.parent = curr_node
-                break
+        col, row = curr
+        g = g_costs[curr]
+        for d_col, d_row, step in NEIGHBOR_OFFSETS:
+            neighbor = (col + d_col, row + d_row)
+            if not (0 <= neighbor[0] < num_cols and 0 <= neighbor[1] < num_rows):
+                continue
+            if closed[neighbor] or occupancy[neighbor]:
+                continue
+
+            # g(x) = How much does it cost to travel to this neighbor from start?
+            cost = g + resolution * step * (1 + (clearance_cost[curr] + clearance_cost[neighbor]) / 2)
+            if cost < g_costs[neighbor]:
+                g_costs[neighbor] = cost
+                parents[neighbor] = curr
+                heuristic = resolution * octile_dist(neighbor, goal_indices)  # h(x) = How close is it to the goal?
+                if landmark_bounds is not None:
+                    heuristic = max(heuristic, landmark_bounds[neighbor])
+                score = cost + heuristic  # f(x) = g(x) + h(x)
+                heapq.heappush(queue, (score, -cost, neighbor))
+
+    # If no path was found, return none
+    if not closed[goal_indices]:
+        return None
 
-            # If unvisited and not occupied, add it to the queue
-            if neighbor.parent is None and not occupancy_grid.occupancy[neighbor.indices]:
-                neighbor.parent = curr_node
-                cost = occupancy_grid.cell_resolution  # g(x) = How much does it cost to travel go to this neighbor from curr_node?
-                heuristic = dist(neighbor.position, goal_node.position)  # h(x) = How close is curr_node to the goal?
-                score = heuristic + cost  # f(x) = g(x) + h(x)
-                queue.append((score, neighbor))
-                queue.sort()
+    return parents
 
-    node_path = []
-    curr_node = goal_node
 
-    # If no node_path was found, return none
-    if goal_node.parent is None:
+def dijkstra(occupancy_grid, start, goals, max_goals=None, max_expansions=0, time_budget=0):
+    """
+    Runs a single Dijkstra search outwards from start that finds the cheapest path to every one of the goals at once,
+    stopping as soon as all of them have been reached. Paths are costed the same way as in a_star(), and any of them can
+    be turned into a trajectory with trajectory_from_parents().
+
+    Goals are reached in order of path cost, so when max_goals is given the search stops once that many have been
+    reached: every goal left over is known to cost at least as much as the ones found, and is reported as infinite. The
+    same goes for the goals left over when the search runs out of its budget.
+    :param occupancy_grid: Occupancy grid
+    :param start: Starting position
+    :param goals: List of goal positions
+    :param max_goals: Number of cheapest goals to find, or None to find all of them
+    :param max_expansions: Most cells to expand, 0 for no limit
+    :param time_budget: Most seconds to search, 0 for no limit
+    :return: Tuple of (list of path costs, one per goal and infinite if unreachable, array of parents)
+    """
+    occupancy = occupancy_grid.occupancy
+    parents = np.full(occupancy.shape + (2,), -1, dtype=np.int32)
+    costs = [np.inf] * len(goals)
+
+    # Make sure start is on the grid and not obstructed
+    start_node = occupancy_grid.get_cell(start)
+    if start_node is None or occupancy[start_node.indices]:
+        return costs, parents
+
+    # Group goals by cell, leaving out the ones that can never be reached
+    remaining_goals = defaultdict(list)
+    for i, goal in enumerate(goals):
+        goal_node = occupancy_grid.get_cell(goal)
+        if goal_node is not None and not occupancy[goal_node.indices]:
+            remaining_goals[goal_node.indices].append(i)
+
+    num_cols, num_rows = occupancy.shape
+    resolution = occupancy_grid.cell_resolution
+
+    # This search usually expands most of the grid, so its state lives in flat lists indexed by col * num_rows + row,
+    # which are much cheaper to index than numpy scalars
+    occupied = occupancy.ravel().tolist()
+    clearance_cost = occupancy_grid.clearance_cost.ravel().tolist()
+    g_costs = [np.inf] * occupancy.size
+    closed = [False] * occupancy.size
+    parent_indices = [-1] * occupancy.size
+    remaining_goals = {col * num_rows + row: goal_indices for (col, row), goal_indices in remaining_goals.items()}
+
+    start_index = start_node.indices[0] * num_rows + start_node.indices[1]
+    g_costs[start_index] = 0
+    queue = [(0, start_index)]
+    goals_to_find = len(goals) if max_goals is None else max_goals
+    deadline = time.perf_counter() + time_budget if time_budget > 0 else None
+    num_expansions = 0
+
+    while len(queue) > 0 and len(remaining_goals) > 0 and goals_to_find > 0:
+        if 0 < max_expansions <= num_expansions:
+            break
+        if deadline is not None and time.perf_counter() > deadline:
+            break
+
+        # Pop the closest node, skipping stale entries of nodes we've already expanded
+        g, curr = heapq.heappop(queue)
+        if closed[curr]:
+            continue
+        closed[curr] = True
+        num_expansions += 1
+
+        # Once a goal's cell is closed, its cost is final
+        for i in remaining_goals.pop(curr, []):
+            costs[i] = g
+            goals_to_find -= 1
+
+        # Run through its neighbors
+        col, row = divmod(curr, num_rows)
+        for d_col, d_row, step in NEIGHBOR_OFFSETS:
+            if not (0 <= col + d_col < num_cols and 0 <= row + d_row < num_rows):
+                continue
+            neighbor = curr + d_col * num_rows + d_row
+            if closed[neighbor] or occupied[neighbor]:
+                continue
+
+            cost = g + resolution * step * (1 + (clearance_cost[curr] + clearance_cost[neighbor]) / 2)
+            if cost < g_costs[neighbor]:
+                g_costs[neighbor] = cost
+                parent_indices[neighbor] = curr
+                heapq.heappush(queue, (cost, neighbor))
+
+    # Convert the flat parent indices into the parents array used by trajectory_from_parents()
+    parent_indices = np.array(parent_indices).reshape(occupancy.shape)
+    has_parent = parent_indices >= 0
+    parents[has_parent, 0], parents[has_parent, 1] = np.divmod(parent_indices[has_parent], num_rows)
+
+    return costs, parents
+
+
+def jump_point_search(occupancy_grid, start, goal):
+    """
+    Returns a trajectory from start to goal in the same format as a_star() or None if no path is found.
+
+    Jump Point Search is A* on a uniform-cost 8-connected grid where, instead of pushing every neighbor of a node onto
+    the open list, the search jumps along straight and diagonal lines and only stops at the goal or at cells with forced
+    neighbors. Symmetric paths are never expanded, so only a small fraction of the nodes A* touches are ever expanded.
+    Paths are just as short as the ones found by a_star(), but since JPS relies on every move costing the same, the
+    grid's clearance cost is ignored.
+    :param occupancy_grid: Occupancy grid
+    :param start: Starting position
+    :param goal: Goal position
+    :return: List of trajectory points as list(tuple(x, y), ...)
+    """
+    start_node = occupancy_grid.get_cell(start)
+    goal_node = occupancy_grid.get_cell(goal)
+
+    # Make sure start and goal are on the grid
+    if start_node is None or goal_node is None:
         return None
 
+    # Trivial case
+    if start_node is goal_node:
+        return [start, goal]
+
+    # Make sure start_node and/or goal are not obstructed
+    occupancy = occupancy_grid.occupancy
+    if occupancy[start_node.indices] or occupancy[goal_node.indices]:
+        return None
+
+    num_cols, num_rows = occupancy.shape
+    resolution = occupancy_grid.cell_resolution
+    goal_indices = goal_node.indices
+    occupied = occupancy.tolist()  # Nested lists are much cheaper to index than numpy scalars while jumping
+
+    def free(col, row):
+        return 0 <= col < num_cols and 0 <= row < num_rows and not occupied[col][row]
+
+    def jump(col, row, d_col, d_row):
+        # Step in one direction until we hit an obstacle, the goal, or a cell with a forced neighbor
+        while True:
+            col += d_col
+            row += d_row
+            if not free(col, row):
+                return None
+            if (col, row) == goal_indices:
+                return col, row
+            if d_col and d_row:
+                if (not free(col - d_col, row) and free(col - d_col, row + d_row)) or \
+                        (not free(col, row - d_row) and free(col + d_col, row - d_row)):
+                    return col, row
+                # A diagonal step is also a jump point if either of its straight components leads somewhere
+                if jump(col, row, d_col, 0) is not None or jump(col, row, 0, d_row) is not None:
+                    return col, row
+            elif d_col:
+                if (not free(col, row + 1) and free(col + d_col, row + 1)) or \
+                        (not free(col, row - 1) and free(col + d_col, row - 1)):
+                    return col, row
+            else:
+                if (not free(col + 1, row) and free(col + 1, row + d_row)) or \
+                        (not free(col - 1, row) and free(col - 1, row + d_row)):
+                    return col, row
+
+    def directions(col, row, parent):
+        # Prune the neighbors of a node based on the direction we arrived from
+        if parent[0] < 0:
+            return [(d_col, d_row) for d_col, d_row, _ in NEIGHBOR_OFFSETS]
+        d_col = int(np.sign(col - parent[0]))
+        d_row = int(np.sign(row - parent[1]))
+        if d_col and d_row:
+            result = [(d_col, 0), (0, d_row), (d_col, d_row)]
+            if not free(col - d_col, row):
+                result.append((-d_col, d_row))
+            if not free(col, row - d_row):
+                result.append((d_col, -d_row))
+        elif d_col:
+            result = [(d_col, 0)]
+            if not free(col, row + 1):
+                result.append((d_col, 1))
+            if not free(col, row - 1):
+                result.append((d_col, -1))
+        else:
+            result = [(0, d_row)]
+            if not free(col + 1, row):
+                result.append((1, d_row))
+            if not free(col - 1, row):
+                result.append((-1, d_row))
+        return result
+
+    # Per-cell search state
+    g_costs = np.full(occupancy.shape, np.inf)
+    closed = np.zeros(occupancy.shape, dtype=bool)
+    parents = np.full(occupancy.shape + (2,), -1, dtype=np.int32)
+
+    g_costs[start_node.indices] = 0
+    queue = [(resolution * octile_dist(start_node.indices, goal_indices), 0, start_node.indices)]
+
+    while len(queue) > 0:
+        _, _, curr = heapq.heappop(queue)
+        if closed[curr]:
+            continue
+        closed[curr] = True
+
+        if curr == goal_indices:
+            break
+
+        col, row = curr
+        g = g_costs[curr]
+        for d_col, d_row in directions(col, row, parents[curr]):
+            jump_point = jump(col, row, d_col, d_row)
+            if jump_point is None or closed[jump_point]:
+                continue
+
+            cost = g + resolution * octile_dist(curr, jump_point)
+            if cost < g_costs[jump_point]:
+                g_costs[jump_point] = cost
+                parents[jump_point] = curr
+                score = cost + resolution * octile_dist(jump_point, goal_indices)
+                heapq.heappush(queue, (score, -cost, jump_point))
+
+    # If no path was found, return none
+    if not closed[goal_indices]:
+        return None
+
+    # Walk backwards through the jump points, filling in the cells between each of them
+    cells = [goal_indices]
+    while cells[-1] != start_node.indices:
+        col, row = cells[-1]
+        parent_col, parent_row = (int(i) for i in parents[col, row])
+        d_col = int(np.sign(parent_col - col))
+        d_row = int(np.sign(parent_row - row))
+        while (col, row) != (parent_col, parent_row):
+            col += d_col if col != parent_col else 0
+            row += d_row if row != parent_row else 0
+            cells.append((col, row))
+    cells.reverse()
+
+    return trajectory_from_cells(occupancy_grid, cells, start, goal)
+
+
+class AnytimeAStar:
+    """
+    A* with a budget on how long every call may search, which puts a hard upper bound on planning latency. When the
+    budget runs out before the goal is reached, the path to the expanded cell closest to the goal is returned so the
+    robot can start driving, and the search picks up where it left off on the next call.
+
+    The search stays rooted where it started for as long as the goal and the grid don't change and the robot keeps
+    following the returned path, so expansions carry over between frames. If the goal can't be reached at all, the
+    path to the closest cell is returned as well.
+    """
+    def __init__(self, max_expansions=0, time_budget=0):
+        """
+        :param max_expansions: Most cells to expand per call, 0 for no limit
+        :param time_budget: Most seconds to search per call, 0 for no limit
+        """
+        self.max_expansions = max_expansions
+        self.time_budget = time_budget
+        self.goal_indices = None
+        self.occupancy = None
+        self.clearance_cost = None
+        self.g_costs = None
+        self.closed = None
+        self.parents = None
+        self.queue = None
+        self.closest = None  # Expanded cell closest to the goal
+        self.trajectory = None  # Last returned trajectory, from where the search started
+        self.num_expansions = 0  # Expansions made by the last call
+
+    def reset(self, occupancy_grid, start_indices, goal_indices):
+        """
+        Starts a new search from start_indices towards goal_indices
+        """
+        self.goal_indices = goal_indices
+        self.occupancy = occupancy_grid.occupancy.copy()
+        self.clearance_cost = occupancy_grid.clearance_cost.copy()
+        self.g_costs = np.full(self.occupancy.shape, np.inf)
+        self.closed = np.zeros(self.occupancy.shape, dtype=bool)
+        self.parents = np.full(self.occupancy.shape + (2,), -1, dtype=np.int32)
+        self.g_costs[start_indices] = 0
+        self.queue = [(occupancy_grid.cell_resolution * octile_dist(start_indices, goal_indices), 0, start_indices)]
+        self.closest = start_indices
+        self.trajectory = None
+
+    def is_following(self, occupancy_grid, start, goal_indices):
+        """
+        Returns True if the search can be resumed, i.e. the goal and grid are unchanged and the robot at start is still
+        on the last returned trajectory.
+        """
+        if self.trajectory is None or goal_indices != self.goal_indices:
+            return False
+        if not (np.array_equal(occupancy_grid.occupancy, self.occupancy) and
+                np.array_equal(occupancy_grid.clearance_cost, self.clearance_cost)):
+            return False
+
+        trajectory, deviation = trim_trajectory(self.trajectory, start)
+        return deviation <= SQRT_2 * occupancy_grid.cell_resolution and \
+            trajectory_is_free(occupancy_grid, trajectory[:2])
+
+    def plan(self, occupancy_grid, start, goal):
+        """
+        Returns a trajectory from start towards goal in the same format as a_star(). It ends at goal if the search got
+        there within the budget, or at the center of the cell closest to the goal that it did get to otherwise.
+        :param occupancy_grid: Occupancy grid
+        :param start: Starting position
+        :param goal: Goal position
+        :return: List of trajectory points as list(tuple(x, y), ...), or None if start is obstructed or off the grid
+        """
+        start_node = occupancy_grid.get_cell(start)
+        goal_node = occupancy_grid.get_cell(goal)
+
+        # Make sure start and goal are on the grid
+        if start_node is None or goal_node is None:
+            return None
+
+        # Trivial case
+        if start_node is goal_node:
+            return [start, goal]
+
+        # Make sure start_node is not obstructed
+        if occupancy_grid.occupancy[start_node.indices]:
+            return None
+
+        # 1. Continue the previous search if we can, otherwise start over from here
+        if not self.is_following(occupancy_grid, start, goal_node.indices):
+            self.reset(occupancy_grid, start_node.indices, goal_node.indices)
+
+        # 2. Search until the goal is reached or the budget runs out
+        self.search(occupancy_grid.cell_resolution)
+
+        # 3. Trace the path back from the goal, or from the closest cell we got to
+        reached_goal = self.closed[self.goal_indices]
+        curr = self.goal_indices if reached_goal else self.closest
+        cells = [curr]
+        while self.parents[curr][0] >= 0:
+            curr = tuple(int(i) for i in self.parents[curr])
+            cells.append(curr)
+        cells.reverse()
+
+        # 4. Only keep the part of the path that the robot hasn't driven past yet
+        end = goal if reached_goal else occupancy_grid.grid[cells[-1]].position
+        if len(cells) == 1:
+            self.trajectory = [start, end]
+        elif self.trajectory is None:
+            self.trajectory = trajectory_from_cells(occupancy_grid, cells, start, end)
+        else:
+            self.trajectory = trajectory_from_cells(occupancy_grid, cells, self.trajectory[0], end)
+        trajectory, _ = trim_trajectory(self.trajectory, start)
+        return trajectory
+
+    def search(self, resolution):
+        """
+        Expands cells until the goal is closed, the queue runs dry, or the budget is used up
+        """
+        num_cols, num_rows = self.occupancy.shape
+        goal_indices = self.goal_indices
+        occupancy = self.occupancy
+        clearance_cost = self.clearance_cost
+        deadline = time.perf_counter() + self.time_budget if self.time_budget > 0 else None
+        closest_dist = octile_dist(self.closest, goal_indices)
+
+        self.num_expansions = 0
+        while len(self.queue) > 0 and not self.closed[goal_indices]:
+            if 0 < self.max_expansions <= self.num_expansions:
+                break
+            if deadline is not None and time.perf_counter() > deadline:
+                break
+
+            # Pop the most promising node, skipping stale entries of nodes we've already expanded
+            _, _, curr = heapq.heappop(self.queue)
+            if self.closed[curr]:
+                continue
+            self.closed[curr] = True
+            self.num_expansions += 1
+
+            curr_dist = octile_dist(curr, goal_indices)
+            if curr_dist < closest_dist:
+                self.closest, closest_dist = curr, curr_dist
+
+            # Run through its neighbors
+            col, row = curr
+            g = self.g_costs[curr]
+            for d_col, d_row, step in NEIGHBOR_OFFSETS:
+                neighbor = (col + d_col, row + d_row)
+                if not (0 <= neighbor[0] < num_cols and 0 <= neighbor[1] < num_rows):
+                    continue
+                if self.closed[neighbor] or occupancy[neighbor]:
+                    continue
+
+                cost = g + resolution * step * (1 + (clearance_cost[curr] + clearance_cost[neighbor]) / 2)
+                if cost < self.g_costs[neighbor]:
+                    self.g_costs[neighbor] = cost
+                    self.parents[neighbor] = curr
+                    score = cost + resolution * octile_dist(neighbor, goal_indices)
+                    heapq.heappush(self.queue, (score, -cost, neighbor))
+
+
+class DStarLite:
+    """
+    Incremental planner that keeps its search state between calls to plan(). The search runs backwards from the goal,
+    so when only a few cells of the occupancy grid change or the robot moves a little, only the affected part of the
+    search is repaired instead of planning from scratch. A new goal falls back to a full search.
+
+    Reference: S. Koenig and M. Likhachev, "D* Lite", AAAI 2002
+    """
+    def __init__(self):
+        self.goal_indices = None
+        self.last_start_indices = None
+        self.occupancy = None
+        self.clearance_cost = None
+        self.resolution = None
+        self.km = 0
+        self.g_costs = None
+        self.rhs = None
+        self.queue = []
+        self.open = dict()  # Current key of every cell in the queue, used to skip stale heap entries
+        self.num_expansions = 0
+
+    def reset(self, occupancy_grid, goal_indices, start_indices):
+        """
+        Throws away all search state and starts a new search towards the given goal.
+        """
+        self.goal_indices = goal_indices
+        self.last_start_indices = start_indices
+        self.occupancy = occupancy_grid.occupancy.copy()
+        self.clearance_cost = occupancy_grid.clearance_cost.copy()
+        self.resolution = occupancy_grid.cell_resolution
+        self.km = 0
+        self.g_costs = np.full(self.occupancy.shape, np.inf)
+        self.rhs = np.full(self.occupancy.shape, np.inf)
+        self.queue = []
+        self.open = dict()
+
+        self.rhs[goal_indices] = 0
+        self.push(goal_indices, start_indices)
+
+    def plan(self, occupancy_grid, start, goal):
+        """
+        Returns a trajectory from start to goal in the same format as a_star() or None if no path is found.
+        :param occupancy_grid: Occupancy grid
+        :param start: Starting position
+        :param goal: Goal position
+        :return: List of trajectory points as list(tuple(x, y), ...)
+        """
+        self.num_expansions = 0
+        start_node = occupancy_grid.get_cell(start)
+        goal_node = occupancy_grid.get_cell(goal)
+
+        # Make sure start and goal are on the grid
+        if start_node is None or goal_node is None:
+            return None
+
+        # Trivial case
+        if start_node is goal_node:
+            return [start, goal]
+
+        # Make sure start_node and/or goal are not obstructed
+        occupancy = occupancy_grid.occupancy
+        if occupancy[start_node.indices] or occupancy[goal_node.indices]:
+            return None
+
+        start_indices = start_node.indices
+        if (goal_node.indices != self.goal_indices or occupancy.shape != self.occupancy.shape or
+                occupancy_grid.cell_resolution != self.resolution):
+            # New goal, so none of our previous search is useful
+            self.reset(occupancy_grid, goal_node.indices, start_indices)
+        else:
+            # Re-root the search at our new position
+            self.km += self.resolution * octile_dist(self.last_start_indices, start_indices)
+            self.last_start_indices = start_indices
+
+            # Repair the cells whose occupancy or cost changed, along with their neighbors, whose edge costs changed
+            clearance_cost = occupancy_grid.clearance_cost
+            changed_cells = np.argwhere((occupancy != self.occupancy) | (clearance_cost != self.clearance_cost))
+            self.occupancy = occupancy.copy()
+            self.clearance_cost = clearance_cost.copy()
+            for col, row in changed_cells:
+                cell = (int(col), int(row))
+                self.update_vertex(cell, start_indices)
+                for neighbor, _ in self.neighbors(cell):
+                    self.update_vertex(neighbor, start_indices)
+
+        self.compute_shortest_path(start_indices)
+
+        if self.g_costs[start_indices] == np.inf:
+            return None
+
+        # Descend the cost-to-goal from start to goal
+        cells = [start_indices]
+        while cells[-1] != self.goal_indices:
+            best_cell, best_cost = min(((neighbor, cost + self.g_costs[neighbor])
+                                        for neighbor, cost in self.neighbors(cells[-1])), key=lambda n: n[1])
+            if best_cost == np.inf or len(cells) > self.occupancy.size:
+                return None
+            cells.append(best_cell)
+
+        return trajectory_from_cells(occupancy_grid, cells, start, goal)
+
+    def neighbors(self, cell):
+        """
+        Returns the neighbors of a cell along with the cost of the edge between them, which is infinite if either one
+        of them is occupied. Edge costs are the same in both directions.
+        """
+        num_cols, num_rows = self.occupancy.shape
+        col, row = cell
+        cell_occupied = self.occupancy[cell]
+        cell_cost = self.clearance_cost[cell]
+        result = []
+        for d_col, d_row, step in NEIGHBOR_OFFSETS:
+            neighbor = (col + d_col, row + d_row)
+            if 0 <= neighbor[0] < num_cols and 0 <= neighbor[1] < num_rows:
+                if cell_occupied or self.occupancy[neighbor]:
+                    result.append((neighbor, np.inf))
+                else:
+                    step_cost = self.resolution * step * (1 + (cell_cost + self.clearance_cost[neighbor]) / 2)
+                    result.append((neighbor, step_cost))
+        return result
+
+    def key(self, cell, start_indices):
+        # Round so that keys summed up in a different order (e.g. through km) still compare as equal
+        g = min(self.g_costs[cell], self.rhs[cell])
+        return round(g + self.resolution * octile_dist(start_indices, cell) + self.km, 9), round(g, 9)
+
+    def push(self, cell, start_indices):
+        key = self.key(cell, start_indices)
+        self.open[cell] = key
+        heapq.heappush(self.queue, (key, cell))
+
+    def top_key(self):
+        # Drop any stale entries sitting at the top of the heap
+        while len(self.queue) > 0 and self.open.get(self.queue[0][1]) != self.queue[0][0]:
+            heapq.heappop(self.queue)
+        return self.queue[0][0] if len(self.queue) > 0 else (np.inf, np.inf)
+
+    def update_vertex(self, cell, start_indices):
+        """
+        Recomputes a cell's one-step lookahead cost from its neighbors and puts it in the queue if it's inconsistent.
+        """
+        if cell != self.goal_indices:
+            self.rhs[cell] = min(cost + self.g_costs[neighbor] for neighbor, cost in self.neighbors(cell))
+        self.update_queue(cell, start_indices)
+
+    def update_queue(self, cell, start_indices):
+        self.open.pop(cell, None)
+        if self.g_costs[cell] != self.rhs[cell]:
+            self.push(cell, start_indices)
+
+    def compute_shortest_path(self, start_indices):
+        while (self.top_key() < self.key(start_indices, start_indices) or
+               self.rhs[start_indices] != self.g_costs[start_indices]):
+            if len(self.queue) == 0:
+                break
+            old_key, cell = heapq.heappop(self.queue)
+            del self.open[cell]
+            self.num_expansions += 1
+
+            new_key = self.key(cell, start_indices)
+            if old_key < new_key:
+                self.push(cell, start_indices)
+            elif self.g_costs[cell] > self.rhs[cell]:
+                # Overconsistent, so the cell's cost can only lower its neighbors' lookahead costs
+                g = self.g_costs[cell] = self.rhs[cell]
+                for neighbor, cost in self.neighbors(cell):
+                    if neighbor != self.goal_indices and cost + g < self.rhs[neighbor]:
+                        self.rhs[neighbor] = cost + g
+                        self.update_queue(neighbor, start_indices)
+            else:
+                # Underconsistent, so every neighbor that depended on this cell needs to be recomputed
+                old_g = self.g_costs[cell]
+                self.g_costs[cell] = np.inf
+                self.update_vertex(cell, start_indices)
+                for neighbor, cost in self.neighbors(cell):
+                    if self.rhs[neighbor] == cost + old_g:
+                        self.update_vertex(neighbor, start_indices)
+
+
+class NavigationFunction:
+    """
+    Cost-to-goal field over the whole grid, rooted at the goal. Once computed, the next waypoint from any cell is found
+    with a single lookup of the steepest descent of the field, so controls can query it as often as they like between
+    plans, and planning from wherever the robot ended up doesn't search again. The field is only recomputed when the
+    goal or the grid changes.
+    """
+    def __init__(self):
+        self.goal_indices = None
+        self.occupancy = None
+        self.clearance_cost = None
+        self.cost_to_goal = None
+        self.next_cells = None  # Index into NEIGHBOR_OFFSETS of the best next step from every cell, or -1 if none
+
+    def update(self, occupancy_grid, goal):
+        """
+        Recomputes the field towards the given goal if the goal or the grid has changed since the last update.
+        :param occupancy_grid: Occupancy grid
+        :param goal: Goal position
+        :return: True if the field was recomputed
+        """
+        if self.is_current(occupancy_grid, goal):
+            return False
+
+        goal_node = occupancy_grid.get_cell(goal)
+        goal_indices = goal_node.indices if goal_node is not None else None
+        self.goal_indices = goal_indices
+        self.occupancy = occupancy_grid.occupancy.copy()
+        self.clearance_cost = occupancy_grid.clearance_cost.copy()
+
+        # The field is built in arrays of its own and swapped in at the end, so next_waypoint() can be called from
+        # another thread while it's being recomputed
+        cost_to_goal = np.full(self.occupancy.shape, np.inf)
+        next_cells = np.full(self.occupancy.shape, -1, dtype=np.int8)
+        if goal_indices is None or self.occupancy[goal_indices]:
+            self.cost_to_goal, self.next_cells = cost_to_goal, next_cells
+            return True
+
+        # Cost of the edge from every cell to its neighbor in each direction, infinite if either end is occupied
+        num_cols, num_rows = self.occupancy.shape
+        occupied = self.occupancy.astype(bool)
+        edges = []
+        for d_col, d_row, step in NEIGHBOR_OFFSETS:
+            (cols, neighbor_cols), (rows, neighbor_rows) = shift_slices(d_col, num_cols), shift_slices(d_row, num_rows)
+            cost = occupancy_grid.cell_resolution * step * \
+                (1 + (self.clearance_cost[cols, rows] + self.clearance_cost[neighbor_cols, neighbor_rows]) / 2)
+            cost[occupied[cols, rows] | occupied[neighbor_cols, neighbor_rows]] = np.inf
+            edges.append(((cols, rows), (neighbor_cols, neighbor_rows), cost))
+
+        # Relax every edge of the grid at once until nothing improves. Updating the field in place lets improvements
+        # ripple through several directions within a single pass.
+        cost_to_goal[goal_indices] = 0
+        changed = True
+        while changed:
+            changed = False
+            for cells, neighbors, cost in edges:
+                candidate = cost_to_goal[neighbors] + cost
+                current = cost_to_goal[cells]
+                better = candidate < current
+                if better.any():
+                    current[better] = candidate[better]
+                    changed = True
+
+        # Store the direction of steepest descent from every cell
+        candidates = np.full((len(NEIGHBOR_OFFSETS),) + self.occupancy.shape, np.inf)
+        for i, (cells, neighbors, cost) in enumerate(edges):
+            candidates[i][cells] = cost_to_goal[neighbors] + cost
+        reachable = np.isfinite(cost_to_goal)
+        reachable[goal_indices] = False
+        next_cells[reachable] = np.argmin(candidates, axis=0)[reachable]
+        self.cost_to_goal, self.next_cells = cost_to_goal, next_cells
+        return True
+
+    def is_current(self, occupancy_grid, goal):
+        """
+        Returns True if the field was computed towards the cell of the given goal on a grid like the given one
+        """
+        goal_node = occupancy_grid.get_cell(goal)
+        goal_indices = goal_node.indices if goal_node is not None else None
+        return (goal_indices == self.goal_indices and self.occupancy is not None and
+                np.array_equal(occupancy_grid.occupancy, self.occupancy) and
+                np.array_equal(occupancy_grid.clearance_cost, self.clearance_cost))
+
+    def next_cell(self, indices):
+        """
+        Returns the indices of the next cell on the way to the goal from the given cell, or None if there isn't one.
+        """
+        direction = self.next_cells[indices]
+        if direction < 0:
+            return None
+        d_col, d_row, _ = NEIGHBOR_OFFSETS[direction]
+        return indices[0] + d_col, indices[1] + d_row
+
+    def next_waypoint(self, occupancy_grid, position):
+        """
+        Returns the center of the next cell on the way to the goal from the given position with a single lookup, or None
+        if the goal can't be reached from there or the position is already in the goal cell. Controls can call this as
+        often as they like in between plans.
+        :param occupancy_grid: Occupancy grid the field was computed on
+        :param position: Current position as tuple(x, y)
+        """
+        cell = occupancy_grid.get_cell(position)
+        if cell is None or self.next_cells is None:
+            return None
+        next_cell = self.next_cell(cell.indices)
+        return occupancy_grid.grid[next_cell].position if next_cell is not None else None
+
+    def plan(self, occupancy_grid, start, goal):
+        """
+        Returns a trajectory from start to goal in the same format as a_star() or None if no path is found.
+        :param occupancy_grid: Occupancy grid
+        :param start: Starting position
+        :param goal: Goal position
+        :return: List of trajectory points as list(tuple(x, y), ...)
+        """
+        start_node = occupancy_grid.get_cell(start)
+        goal_node = occupancy_grid.get_cell(goal)
+
+        # Make sure start and goal are on the grid
+        if start_node is None or goal_node is None:
+            return None
+
+        # Trivial case
+        if start_node is goal_node:
+            return [start, goal]
+
+        # Make sure start_node is not obstructed
+        if occupancy_grid.occupancy[start_node.indices]:
+            return None
+
+        self.update(occupancy_grid, goal)
+        if not np.isfinite(self.cost_to_goal[start_node.indices]):
+            return None
+
+        # Descend the field from start to goal
+        cells = [start_node.indices]
+        while cells[-1] != goal_node.indices:
+            cells.append(self.next_cell(cells[-1]))
+
+        return trajectory_from_cells(occupancy_grid, cells, start, goal)
+
+
+class MotionPrimitive:
+    """
+    A short motion of the differential drive robot between two states of the state lattice, either a smooth curve from
+    one heading to the same or a neighboring heading, or a turn in place. All offsets are measured in cells relative to
+    the center of the cell the motion starts from.
+    """
+    def __init__(self, start_heading, end_heading, end, turn_cost=0):
+        """
+        :param start_heading: Index into LATTICE_HEADINGS of the heading the motion starts with
+        :param end_heading: Index into LATTICE_HEADINGS of the heading the motion ends with
+        :param end: Offset of the cell the motion ends in as tuple(d_col, d_row)
+        :param turn_cost: Cost in meters of the motion if it's a turn in place
+        """
+        self.start_heading = start_heading
+        self.end_heading = end_heading
+        self.end = end
+        self.turn_cost = turn_cost
+
+        if end == (0, 0):
+            self.length = 0
+            self.footprint = np.zeros((0, 2), dtype=int)
+            self.footprint_fractions = np.zeros(0)
+            self.waypoints = np.zeros((0, 2))
+            self.waypoint_fractions = np.zeros(0)
+            self.footprint_indices = {}
+            return
+
+        # 1. Sample a cubic Hermite curve that leaves along the start heading and arrives along the end heading
+        chord = np.array(end, dtype=float)
+        tangents = [np.linalg.norm(chord) * np.array(LATTICE_HEADINGS[heading]) / np.hypot(*LATTICE_HEADINGS[heading])
+                    for heading in (start_heading, end_heading)]
+        t = np.linspace(0, 1, 16 * int(np.ceil(np.linalg.norm(chord))) + 1)[:, np.newaxis]
+        samples = (3 * t ** 2 - 2 * t ** 3) * chord + (t ** 3 - 2 * t ** 2 + t) * tangents[0] + \
+            (t ** 3 - t ** 2) * tangents[1]
+        arc_lengths = np.concatenate([[0], np.cumsum(np.linalg.norm(np.diff(samples, axis=0), axis=1))])
+        self.length = arc_lengths[-1]
+        fractions = arc_lengths / self.length
+
+        # 2. The footprint is every cell the curve sweeps through after leaving its first cell, in order
+        cells = np.round(samples).astype(int)
+        first = np.concatenate([[True], np.any(cells[1:] != cells[:-1], axis=1)])
+        first[0] = False
+        self.footprint = cells[first]
+        self.footprint_fractions = fractions[first]
+        self.footprint_indices = {(int(d_col), int(d_row)): i for i, (d_col, d_row) in enumerate(self.footprint)}
+
+        # 3. Keep about one waypoint per cell of travel to follow the curve by
+        num_waypoints = int(np.ceil(self.length))
+        self.waypoint_fractions = np.arange(1, num_waypoints + 1) / num_waypoints
+        self.waypoints = np.stack([np.interp(self.waypoint_fractions, fractions, samples[:, axis]) for axis in (0, 1)],
+                                  axis=1)
+
+
+class LatticePlanner:
+    """
+    State lattice planner over (col, row, heading) for a differential drive robot. Instead of moving between
+    neighboring cells, it chains together motion primitives that respect the robot's heading, so the trajectories it
+    returns can mostly be followed without stopping to turn in place.
+
+    The primitives and the cells they sweep through are computed once. Whether a primitive collides with anything is
+    then found for every cell of the grid at once by a vectorized gather over the occupancy layer, the first time the
+    primitive is needed after the grid changes.
+    """
+    def __init__(self, turn_cost=0.2, heuristic_weight=1.0):
+        """
+        :param turn_cost: Cost in meters of turning in place by one heading
+        :param heuristic_weight: Factor to inflate the Euclidean heuristic by, trading path cost for search speed
+        """
+        self.heuristic_weight = heuristic_weight
+        self.primitives = [[] for _ in LATTICE_HEADINGS]
+        num_headings = len(LATTICE_HEADINGS)
+        for heading, (d_col, d_row) in enumerate(LATTICE_HEADINGS):
+            # Drive straight for about four cells, or curve onto either of the neighboring headings over about as far
+            scales = [max(1, round(4 / np.hypot(*direction))) for direction in LATTICE_HEADINGS]
+            self.primitives[heading].append(MotionPrimitive(heading, heading, (scales[heading] * d_col,
+                                                                               scales[heading] * d_row)))
+            for turn in (-1, 1):
+                end_heading = (heading + turn) % num_headings
+                end = np.multiply(max(1, scales[heading] // 2), LATTICE_HEADINGS[heading]) + \
+                    np.multiply(max(1, scales[end_heading] // 2), LATTICE_HEADINGS[end_heading])
+                self.primitives[heading].append(MotionPrimitive(heading, end_heading, (int(end[0]), int(end[1]))))
+                self.primitives[heading].append(MotionPrimitive(heading, end_heading, (0, 0), turn_cost))
+
+        self.occupancy = None
+        self.padded_occupancy = None
+        self.padding = max(int(np.max(np.abs(primitive.footprint), initial=0))
+                           for primitives in self.primitives for primitive in primitives)
+        self.collisions = {}  # Per primitive, whether it collides with something when started from each cell
+        self.num_expansions = 0
+
+    def collides(self, primitive):
+        """
+        Returns a boolean array that's True for every cell the given primitive can't be started from because it would
+        sweep through an occupied cell or leave the grid
+        """
+        if primitive not in self.collisions:
+            num_cols, num_rows = self.occupancy.shape
+            collides = np.zeros(self.occupancy.shape, dtype=bool)
+            for d_col, d_row in self.padding + primitive.footprint:
+                collides |= self.padded_occupancy[d_col:d_col + num_cols, d_row:d_row + num_rows]
+            self.collisions[primitive] = collides
+        return self.collisions[primitive]
+
+    def plan(self, occupancy_grid, start, goal, heading=None):
+        """
+        Returns a trajectory from start to goal in the same format as a_star() or None if no path is found. The goal can
+        be reached with any heading.
+        :param occupancy_grid: Occupancy grid
+        :param start: Starting position
+        :param goal: Goal position
+        :param heading: Heading of the robot at start in radians, or None if it can start with any heading
+        :return: List of trajectory points as list(tuple(x, y), ...)
+        """
+        start_node = occupancy_grid.get_cell(start)
+        goal_node = occupancy_grid.get_cell(goal)
+
+        # Make sure start and goal are on the grid
+        if start_node is None or goal_node is None:
+            return None
+
+        # Trivial case
+        if start_node is goal_node:
+            return [start, goal]
+
+        # Make sure start_node and/or goal are not obstructed
+        occupancy = occupancy_grid.occupancy
+        if occupancy[start_node.indices] or occupancy[goal_node.indices]:
+            return None
+
+        # 1. Forget the collisions found on the previous grid if it has changed
+        if self.occupancy is None or not np.array_equal(occupancy, self.occupancy):
+            self.occupancy = occupancy.copy()
+            self.padded_occupancy = np.pad(occupancy.astype(bool), self.padding, constant_values=True)
+            self.collisions = {}
+
+        # 2. Search over (col, row, heading) states. The goal is reached as soon as a primitive sweeps through it.
+        resolution = occupancy_grid.cell_resolution
+        clearance_cost = occupancy_grid.clearance_cost
+        goal_col, goal_row = goal_node.indices
+        goal_state = (goal_col, goal_row, -1)
+        if heading is None:
+            start_states = [start_node.indices + (i,) for i in range(len(LATTICE_HEADINGS))]
+        else:
+            angles = np.array([atan2(d_row, d_col) for d_col, d_row in LATTICE_HEADINGS])
+            start_states = [start_node.indices + (int(np.argmin(np.abs(np.angle(np.exp(1j * (angles - heading)))))),)]
+
+        g_costs = {state: 0 for state in start_states}
+        parents = {}  # State -> (previous state, primitive, fraction of the primitive driven)
+        closed = set()
+        queue = [(0, 0, state) for state in start_states]
+        self.num_expansions = 0
+        while len(queue) > 0:
+            _, _, curr = heapq.heappop(queue)
+            if curr in closed:
+                continue
+            closed.add(curr)
+            if curr == goal_state:
+                break
+            self.num_expansions += 1
+
+            col, row, curr_heading = curr
+            g = g_costs[curr]
+            for primitive in self.primitives[curr_heading]:
+                if self.collides(primitive)[col, row]:
+                    continue
+
+                # Stop partway through the primitive if it passes through the goal
+                goal_index = primitive.footprint_indices.get((goal_col - col, goal_row - row))
+                if goal_index is not None:
+                    fraction = primitive.footprint_fractions[goal_index]
+                    neighbor = goal_state
+                else:
+                    fraction = 1
+                    neighbor = (col + primitive.end[0], row + primitive.end[1], primitive.end_heading)
+                if neighbor in closed:
+                    continue
+
+                end_indices = neighbor[:2]
+                cost = g + primitive.turn_cost + resolution * fraction * primitive.length * \
+                    (1 + (clearance_cost[col, row] + clearance_cost[end_indices]) / 2)
+                if cost < g_costs.get(neighbor, np.inf):
+                    g_costs[neighbor] = cost
+                    parents[neighbor] = (curr, primitive, fraction)
+                    heuristic = self.heuristic_weight * resolution * np.hypot(goal_col - end_indices[0],
+                                                                              goal_row - end_indices[1])
+                    heapq.heappush(queue, (cost + heuristic, -cost, neighbor))
+
+        # If no path was found, return none
+        if goal_state not in closed:
+            return None
+
+        # 3. Follow the waypoints of every primitive from start to goal
+        motions = []
+        curr = goal_state
+        while curr in parents:
+            curr, primitive, fraction = parents[curr]
+            motions.append((curr, primitive, fraction))
+
+        trajectory = [start]
+        for (col, row, _), primitive, fraction in reversed(motions):
+            center = np.array(occupancy_grid.grid[col, row].position)
+            for waypoint in primitive.waypoints[primitive.waypoint_fractions <= fraction]:
+                trajectory.append(tuple((center + resolution * waypoint).tolist()))
+        trajectory.append(goal)
+
+        return trajectory
+
+
+class GridPyramid:
+    """
+    Coarser and coarser copies of a grid layer, where every cell of a level is the max of the 2x2 block of cells below
+    it, so a coarse cell is occupied if any of the fine cells it covers is. Only the blocks over cells that changed are
+    pooled again when the layer is updated.
+    """
+    def __init__(self, num_levels):
+        """
+        :param num_levels: Number of coarse levels to build on top of the layer itself
+        """
+        self.num_levels = num_levels
+        self.levels = None
+
+    def update(self, layer):
+        """
+        Brings every level up to date with the given layer
+        :param layer: Layer shaped like the grid
+        :return: True if anything changed
+        """
+        if self.levels is None or self.levels[0].shape != layer.shape:
+            self.levels = [layer.copy()]
+            for _ in range(self.num_levels):
+                below = self.levels[-1]
+                padded = np.pad(below, ((0, below.shape[0] % 2), (0, below.shape[1] % 2)), mode='edge')
+                self.levels.append(padded.reshape(padded.shape[0] // 2, 2, padded.shape[1] // 2, 2).max(axis=(1, 3)))
+            return True
+
+        changed = np.argwhere(layer != self.levels[0])
+        if len(changed) == 0:
+            return False
+        self.levels[0][changed[:, 0], changed[:, 1]] = layer[changed[:, 0], changed[:, 1]]
+
+        # Re-pool the blocks over the changed cells, level by level, for as long as the pooled values keep changing
+        block_offsets = np.array([(0, 0), (0, 1), (1, 0), (1, 1)])
+        for below, level in zip(self.levels, self.levels[1:]):
+            blocks = np.unique(changed // 2, axis=0)
+            children = np.minimum(2 * blocks[:, np.newaxis] + block_offsets, np.array(below.shape) - 1)
+            pooled = below[children[..., 0], children[..., 1]].max(axis=1)
+            different = pooled != level[blocks[:, 0], blocks[:, 1]]
+            changed = blocks[different]
+            level[changed[:, 0], changed[:, 1]] = pooled[different]
+            if len(changed) == 0:
+                break
+        return True
+
+
+class HierarchicalPlanner:
+    """
+    Plans on a pyramid of ever coarser grids, made by max-pooling the occupancy grid. A path found on the coarsest
+    level is refined one level at a time, searching only a corridor around the path from the level above, so the fine
+    grid is only ever searched near the final path. If the corridor has no path, e.g. because pooling closed off a
+    narrow gap, the full grid is searched instead.
+
+    This is a heuristic: pooling can block a coarse cell that the shortest path only clips, so the corridor may steer
+    around it and the refined path can be longer than the one a_star() finds on the full grid.
+    """
+    def __init__(self, num_levels=2):
+        """
+        :param num_levels: Number of coarse levels, each of which halves the resolution of the one below
+        """
+        self.occupancy = GridPyramid(num_levels)
+        self.clearance_cost = GridPyramid(num_levels)
+
+    def plan(self, occupancy_grid, start, goal):
+        """
+        Returns a trajectory from start to goal in the same format as a_star() or None if no path is found.
+        :param occupancy_grid: Occupancy grid
+        :param start: Starting position
+        :param goal: Goal position
+        :return: List of trajectory points as list(tuple(x, y), ...)
+        """
+        start_node = occupancy_grid.get_cell(start)
+        goal_node = occupancy_grid.get_cell(goal)
+
+        # Make sure start and goal are on the grid
+        if start_node is None or goal_node is None:
+            return None
+
+        # Trivial case
+        if start_node is goal_node:
+            return [start, goal]
+
+        # Make sure start_node and/or goal are not obstructed
+        if occupancy_grid.occupancy[start_node.indices] or occupancy_grid.occupancy[goal_node.indices]:
+            return None
+
+        self.occupancy.update(occupancy_grid.occupancy)
+        self.clearance_cost.update(occupancy_grid.clearance_cost)
+
+        # Refine the path from the coarsest level down, each time only searching around the path from the level above
+        corridor = None
+        parents = None
+        for level in reversed(range(self.occupancy.num_levels + 1)):
+            occupancy = self.occupancy.levels[level].copy()
+            start_indices = (start_node.indices[0] >> level, start_node.indices[1] >> level)
+            goal_indices = (goal_node.indices[0] >> level, goal_node.indices[1] >> level)
+
+            # Coarse cells around start and goal can be partly occupied, but we know there's room for the robot
+            occupancy[start_indices] = 0
+            occupancy[goal_indices] = 0
+            if corridor is not None:
+                corridor = np.repeat(np.repeat(corridor, 2, axis=0), 2, axis=1)
+                corridor = corridor[:occupancy.shape[0], :occupancy.shape[1]]
+                occupancy[corridor == 0] = 1
+
+            parents = grid_a_star(occupancy, self.clearance_cost.levels[level],
+                                  occupancy_grid.cell_resolution * 2 ** level, start_indices, goal_indices)
+            if parents is None:
+                break
+
+            # The corridor for the next level is every cell along the path plus its neighbors
+            corridor = np.zeros(occupancy.shape, dtype=np.uint8)
+            curr = goal_indices
+            corridor[curr] = 1
+            while curr != start_indices:
+                curr = tuple(int(i) for i in parents[curr])
+                corridor[curr] = 1
+            corridor = cv.dilate(corridor, np.ones((3, 3), dtype=np.uint8))
+
+        # Fall back to searching the whole grid
+        if parents is None:
+            parents = grid_a_star(occupancy_grid.occupancy, occupancy_grid.clearance_cost,
+                                  occupancy_grid.cell_resolution, start_node.indices, goal_node.indices)
+            if parents is None:
+                return None
+
+        return trajectory_from_parents(occupancy_grid, parents, start, goal)
+
+
+class VisibilityGraph:
+    """
+    Plans exact shortest paths among the convex field elements, independent of the grid's resolution. Every obstacle is
+    grown by the robot's clearance into a convex polygon, and the shortest path from start to goal then runs along
+    straight lines between the corners of those polygons.
+
+    The corners of the static field elements and which of them can see each other are found once. Every query only
+    adds the start, the goal and the grid's current dynamic obstacles, and all of the lines they add are tested against
+    all of the polygons at once.
+    """
+    def __init__(self, polygons, margin):
+        """
+        :param polygons: Static obstacles as a list of convex Polygon types
+        :param margin: Distance in meters to keep from every obstacle
+        """
+        self.margin = margin
+        self.static_polygons = [self.grow(polygon.vertices, margin) for polygon in polygons]
+        self.static_vertices = np.concatenate(self.static_polygons) if polygons else np.zeros((0, 2))
+        static_edges, static_axes = pack_polygons(self.static_polygons)
+        self.static_edges = static_edges
+        self.static_axes = static_axes
+
+        # Corners inside another polygon can't be driven to
+        self.static_usable = ~np.any(points_in_polygons(self.static_vertices, static_edges, static_axes), axis=1)
+
+        # Every pair of usable corners whose line doesn't pass through any polygon
+        num_vertices = len(self.static_vertices)
+        first, second = np.triu_indices(num_vertices, k=1)
+        blocked = np.any(segments_intersect_polygons(self.static_vertices[first], self.static_vertices[second],
+                                                     static_edges, static_axes), axis=1)
+        visible = ~blocked & self.static_usable[first] & self.static_usable[second]
+        self.static_pairs = np.stack([first[visible], second[visible]], axis=1)
+
+    @staticmethod
+    def grow(vertices, margin):
+        """
+        Returns the convex hull of the given vertices grown by margin, matching the dilation of the grid by a square
+        kernel
+        """
+        corners = np.array([(-margin, -margin), (-margin, margin), (margin, margin), (margin, -margin)])
+        points = (np.asarray(vertices, dtype=float)[:, np.newaxis] + corners).reshape(-1, 2)
+        return points[cv.convexHull(points.astype(np.float32), returnPoints=False).ravel()]
+
+    def plan(self, occupancy_grid, start, goal):
+        """
+        Returns a trajectory from start to goal in the same format as a_star() or None if no path is found. The grid's
+        dynamic obstacles are avoided as well, and corners off the grid aren't used.
+        :param occupancy_grid: Occupancy grid
+        :param start: Starting position
+        :param goal: Goal position
+        :return: List of trajectory points as list(tuple(x, y), ...)
+        """
+        # Make sure start and goal are on the grid
+        if occupancy_grid.get_cell(start) is None or occupancy_grid.get_cell(goal) is None:
+            return None
+
+        # 1. Grow the dynamic obstacles of the grid the same way as the static ones
+        dynamic_polygons = [self.grow([(min_x, min_y), (max_x, max_y), (min_x, max_y), (max_x, min_y)], self.margin)
+                            for min_x, min_y, max_x, max_y in occupancy_grid.dynamic_boxes]
+        dynamic_edges, dynamic_axes = pack_polygons(dynamic_polygons)
+        edges, axes = pack_polygons(self.static_polygons + dynamic_polygons)
+
+        # 2. Gather the points the path can go through: start, goal and every corner on the grid outside all polygons
+        dynamic_vertices = np.concatenate(dynamic_polygons) if dynamic_polygons else np.zeros((0, 2))
+        points = np.concatenate([[start, goal], self.static_vertices, dynamic_vertices])
+        inside = points_in_polygons(points, edges, axes)
+        cols, rows = occupancy_grid.get_cell_indices(points)
+        usable = (cols >= 0) & ~np.any(inside, axis=1)
+        usable[:2] = True
+
+        # 3. Lines between static corners only need to be checked against the dynamic obstacles, the rest against all of
+        # them. Start and goal can see out of the polygons they're inside of, e.g. when the robot is within a margin.
+        static_pairs = 2 + self.static_pairs
+        first, second = np.triu_indices(len(points), k=1)
+        new = (first < 2) | (second >= 2 + len(self.static_vertices))
+        new_pairs = np.stack([first[new], second[new]], axis=1)
+
+        blocked = segments_intersect_polygons(points[static_pairs[:, 0]], points[static_pairs[:, 1]], dynamic_edges,
+                                              dynamic_axes)
+        static_pairs = static_pairs[~np.any(blocked, axis=1)]
+        blocked = segments_intersect_polygons(points[new_pairs[:, 0]], points[new_pairs[:, 1]], edges, axes)
+        blocked &= ~inside[new_pairs[:, 0]] & ~inside[new_pairs[:, 1]]
+        new_pairs = new_pairs[~np.any(blocked, axis=1)]
+
+        # Lines leaving a polygon aren't kept clear by its margin, so they can only be taken where the grid is free
+        for endpoint in [0, 1]:
+            if np.any(inside[endpoint]):
+                leaving = np.any(new_pairs == endpoint, axis=1)
+                others = new_pairs[leaving].sum(axis=1) - endpoint
+                in_sight = line_of_sight(occupancy_grid, (cols[endpoint], rows[endpoint]), cols[others], rows[others])
+                new_pairs = np.concatenate([new_pairs[~leaving], new_pairs[leaving][in_sight]])
+
+        visible = np.concatenate([static_pairs, new_pairs])
+        visible = visible[usable[visible[:, 0]] & usable[visible[:, 1]]]
+
+        # 4. Dijkstra over the visible lines
+        lengths = np.linalg.norm(points[visible[:, 0]] - points[visible[:, 1]], axis=1)
+        neighbors = defaultdict(list)
+        for (a, b), length in zip(visible.tolist(), lengths.tolist()):
+            neighbors[a].append((b, length))
+            neighbors[b].append((a, length))
+
+        costs = {0: 0}
+        parents = {}
+        closed = set()
+        queue = [(0, 0)]
+        while len(queue) > 0:
+            cost, curr = heapq.heappop(queue)
+            if curr in closed:
+                continue
+            closed.add(curr)
+            if curr == 1:
+                break
+            for neighbor, length in neighbors[curr]:
+                if cost + length < costs.get(neighbor, np.inf):
+                    costs[neighbor] = cost + length
+                    parents[neighbor] = curr
+                    heapq.heappush(queue, (cost + length, neighbor))
+
+        # If no path was found, return none
+        if 1 not in closed:
+            return None
+
+        path = [1]
+        while path[-1] != 0:
+            path.append(parents[path[-1]])
+        path.reverse()
+        return [start] + [tuple(points[i].tolist()) for i in path[1:-1]] + [goal]
+
+
+class LandmarkHeuristic:
+    """
+    ALT (A*, landmarks and triangle inequality) heuristic. Cost-to-go fields from a handful of landmark cells spread
+    over the static field are computed once, and the triangle inequality turns them into a lower bound on the cost
+    between any two cells that accounts for the walls and columns in the way, unlike the straight-line distance.
+
+    Dynamic obstacles only ever remove cells or make them more expensive, so bounds computed on the static layer stay
+    admissible for the full grid. The fields only depend on the static layer, so they're cached on disk keyed by it.
+    """
+    def __init__(self, occupancy_grid, num_landmarks, cache_dir=None):
+        """
+        :param occupancy_grid: Occupancy grid whose static obstacles have been set
+        :param num_landmarks: Number of landmark cells to place
+        :param cache_dir: Directory to cache the fields in, or None to always compute them
+        """
+        static_grid = occupancy_grid.static_layer()
+        key = hashlib.sha1()
+        for array in (static_grid.occupancy, static_grid.clearance_cost, np.array(static_grid.occupancy.shape),
+                      np.array([static_grid.cell_resolution, num_landmarks])):
+            key.update(np.ascontiguousarray(array).tobytes())
+        self.cache_path = os.path.join(cache_dir, f'landmarks_{key.hexdigest()}.npz') if cache_dir else None
+
+        if self.cache_path is not None and os.path.exists(self.cache_path):
+            cached = np.load(self.cache_path)
+            self.landmarks, self.distances = cached['landmarks'], cached['distances']
+        else:
+            self.landmarks, self.distances = self.place_landmarks(static_grid, num_landmarks)
+            if self.cache_path is not None:
+                os.makedirs(cache_dir, exist_ok=True)
+                np.savez_compressed(self.cache_path, landmarks=self.landmarks, distances=self.distances)
+
+    @staticmethod
+    def place_landmarks(static_grid, num_landmarks):
+        """
+        Places landmarks one at a time on the free cell farthest from the ones placed so far, which puts them around
+        the edges of the field where they give the tightest bounds.
+        :return: Tuple of (landmark indices as an array of shape (num_landmarks, 2), float32 array of cost-to-go fields
+                 of shape (num_landmarks, num_cols, num_rows))
+        """
+        free = np.argwhere(static_grid.occupancy == 0)
+        if num_landmarks <= 0 or len(free) == 0:
+            return np.zeros((0, 2), dtype=np.int32), np.zeros((0,) + static_grid.occupancy.shape, dtype=np.float32)
+
+        # Start from the free cell nearest the middle of the grid, which is only used to find the first landmark
+        center = np.array(static_grid.occupancy.shape) / 2
+        seed = tuple(free[np.argmin(np.sum((free - center) ** 2, axis=1))])
+        navigation = NavigationFunction()
+        navigation.update(static_grid, static_grid.grid[seed].position)
+        closest = navigation.cost_to_goal
+
+        landmarks = []
+        distances = []
+        for _ in range(num_landmarks):
+            # Landmarks only bound costs within their own connected region, so pick within the seed's region
+            candidates = np.where(np.isfinite(closest), closest, -1)
+            landmark = np.unravel_index(np.argmax(candidates), candidates.shape)
+            if candidates[landmark] <= 0:
+                break
+            navigation.update(static_grid, static_grid.grid[landmark].position)
+            landmarks.append(landmark)
+            distances.append(navigation.cost_to_goal.astype(np.float32))
+            closest = navigation.cost_to_goal if len(landmarks) == 1 else np.minimum(closest, navigation.cost_to_goal)
+
+        return np.array(landmarks, dtype=np.int32).reshape(-1, 2), np.array(distances, dtype=np.float32)
+
+    def heuristic(self, goal_indices):
+        """
+        Returns a lower bound on the cost from every cell to the goal cell, infinite for cells that can't reach it.
+        :param goal_indices: Indices of the goal cell
+        """
+        if len(self.landmarks) == 0:
+            return np.zeros(self.distances.shape[1:])
+
+        # |d(L, goal) - d(L, x)| <= d(x, goal) for every landmark L. Cells that share no region with L give no bound.
+        to_goal = self.distances[(slice(None),) + tuple(goal_indices)].astype(float).reshape(-1, 1, 1)
+        with np.errstate(invalid='ignore'):
+            bounds = np.abs(to_goal - self.distances)
+        bounds[np.isnan(bounds)] = 0
+
+        # Shave off the rounding of the float32 fields so the bound never overestimates
+        return np.maximum(np.max(bounds, axis=0) - 1e-4, 0)
+
+
+class TrajectoryCache:
+    """
+    Bounded least recently used cache of planned trajectories, keyed by the cells of their start and goal. Every entry
+    remembers a fingerprint of the occupancy around the trajectory, so it's evicted as soon as an obstacle appears or
+    disappears in that region.
+
+    The fingerprint of a region is the sum of a random weight for every occupied cell in it. A summed-area table of the
+    weighted occupancy is rebuilt once whenever the grid changes, after which any region is fingerprinted from four of
+    its entries.
+    """
+    def __init__(self, max_size):
+        """
+        :param max_size: Maximum number of trajectories to keep
+        """
+        self.max_size = max_size
+        self.entries = OrderedDict()  # (start indices, goal indices) -> (trajectory, region, fingerprint)
+        self.hits = 0
+        self.misses = 0
+        self.occupancy = None  # Occupancy array the summed-area table was built from
+        self.weights = None
+        self.summed_area = None
+
+    def update(self, occupancy_grid):
+        """
+        Rebuilds the summed-area table if the grid's occupancy changed, and evicts every entry whose region changed
+        :param occupancy_grid: Occupancy grid
+        """
+        if occupancy_grid.occupancy is self.occupancy:
+            return
+        self.occupancy = occupancy_grid.occupancy
+
+        # 1. Give every cell a random weight, fixed for the lifetime of the cache so fingerprints stay comparable
+        if self.weights is None or self.weights.shape != self.occupancy.shape:
+            rng = np.random.default_rng(3260)
+            self.weights = rng.integers(1, 2 ** 31, size=self.occupancy.shape, dtype=np.int64)
+            self.entries.clear()
+
+        # 2. Summed-area table with a row and column of zeros in front, so region sums need no special cases
+        self.summed_area = np.zeros((self.occupancy.shape[0] + 1, self.occupancy.shape[1] + 1), dtype=np.int64)
+        self.summed_area[1:, 1:] = np.cumsum(np.cumsum(self.weights * (self.occupancy != 0), axis=0), axis=1)
+
+        # 3. Evict the entries whose regions changed
+        for key, (_, region, fingerprint) in list(self.entries.items()):
+            if self.fingerprint(region) != fingerprint:
+                del self.entries[key]
+
+    def fingerprint(self, region):
+        """
+        Returns the fingerprint of the occupancy in the given region
+        :param region: Tuple of (min_col, max_col, min_row, max_row), exclusive of the max
+        """
+        min_col, max_col, min_row, max_row = region
+        table = self.summed_area
+        return int(table[max_col, max_row] - table[min_col, max_row] - table[max_col, min_row] + table[min_col, min_row])
+
+    def get(self, occupancy_grid, start, goal):
+        """
+        Returns a copy of the cached trajectory between the cells of start and goal, or None if there isn't one. The
+        first and last points are replaced by the exact start and goal positions.
+        :param occupancy_grid: Occupancy grid
+        :param start: Starting position
+        :param goal: Goal position
+        """
+        self.update(occupancy_grid)
+        key = self.key(occupancy_grid, start, goal)
+        if key not in self.entries:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.entries.move_to_end(key)
+        trajectory = list(self.entries[key][0])
+        trajectory[0] = start
+        trajectory[-1] = goal
+        return trajectory
+
+    def put(self, occupancy_grid, start, goal, trajectory):
+        """
+        Caches a trajectory between the cells of start and goal, evicting the least recently used one if full. Partial
+        trajectories that stop short of the goal cell, like the ones AnytimeAStar returns when its budget runs out, are
+        not cached since get() would connect their end to the goal in a straight line.
+        :param occupancy_grid: Occupancy grid the trajectory was planned on
+        :param start: Starting position
+        :param goal: Goal position
+        :param trajectory: List of trajectory points as list(tuple(x, y), ...)
+        """
+        key = self.key(occupancy_grid, start, goal)
+        if key is None or self.max_size <= 0:
+            return
+        end_node = occupancy_grid.get_cell(trajectory[-1])
+        if end_node is None or end_node.indices != key[1]:
+            return
+        self.update(occupancy_grid)
+
+        # Obstacles around the trajectory change its cost as far away as the clearance cost reaches
+        padding = 0
+        if occupancy_grid.clearance_weight:
+            padding = int(np.ceil(occupancy_grid.clearance_radius / occupancy_grid.cell_resolution))
+        col_slice, row_slice = occupancy_grid.get_region_slices(bounding_box(trajectory), padding=padding)
+        region = (col_slice.start, min(col_slice.stop, occupancy_grid.num_cols),
+                  row_slice.start, min(row_slice.stop, occupancy_grid.num_rows))
+
+        self.entries[key] = (list(trajectory), region, self.fingerprint(region))
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    @staticmethod
+    def key(occupancy_grid, start, goal):
+        """
+        Returns the key of the cells of start and goal, or None if either is off the grid
+        """
+        start_node = occupancy_grid.get_cell(start)
+        goal_node = occupancy_grid.get_cell(goal)
+        if start_node is None or goal_node is None:
+            return None
+        return start_node.indices, goal_node.indices
+
+
+def trajectory_from_parents(occupancy_grid, parents, start, goal):
+    """
+    Walks an array of parent indices backwards from the goal cell to the start cell and converts the cells along the way
+    into a trajectory. The first and last points are replaced by the exact start and goal positions.
+    :param occupancy_grid: Occupancy grid the parents were computed on
+    :param parents: Array of shape (num_cols, num_rows, 2) holding each cell's parent indices, or -1 if it has none
+    :param start: Starting position
+    :param goal: Goal position
+    :return: List of trajectory points as list(tuple(x, y), ...)
+    """
+    start_indices = occupancy_grid.get_cell(start).indices
+    curr = occupancy_grid.get_cell(goal).indices
+
+    # Trivial case
+    if curr == start_indices:
+        return [start, goal]
+
     # Iterate backwards from goal
-    while curr_node != start_node:
-        node_path.insert(0, curr_node)
-        curr_node = curr_node.parent
+    cells = [curr]
+    while curr != start_indices:
+        curr = tuple(int(i) for i in parents[curr])
+        cells.append(curr)
+    cells.reverse()
+
+    return trajectory_from_cells(occupancy_grid, cells, start, goal)
 
-    # Add starting node to node_path
-    node_path.insert(0, start_node)
 
-    # Convert list of nodes to a trajectory
-    path = [node.position for node in node_path]
+def trajectory_from_cells(occupancy_grid, cells, start, goal):
+    """
+    Converts a list of cell indices into a trajectory of cell centers, with the first and last points replaced by the
+    exact start and goal positions.
+    :param occupancy_grid: Occupancy grid the cells belong to
+    :param cells: List of cell indices as list(tuple(col, row), ...)
+    :param start: Starting position
+    :param goal: Goal position
+    :return: List of trajectory points as list(tuple(x, y), ...)
+    """
+    path = [occupancy_grid.grid[cell].position for cell in cells]
     path[0] = start
     path[-1] = goal
 
     return path
 
 
+def segment_cells(start_cols, start_rows, end_cols, end_rows):
+    """
+    Returns the cells along many Bresenham line segments at once. Each segment steps one cell at a time along its
+    longer axis and rounds its position along the shorter one, covering its cells up to, but not including, its end.
+    :param start_cols: Column indices of the cells the segments start at
+    :param start_rows: Row indices of the cells the segments start at
+    :param end_cols: Column indices of the cells the segments end at
+    :param end_rows: Row indices of the cells the segments end at
+    :return: Tuple of (index of the segment each cell belongs to, cols, rows) integer arrays, in order
+    """
+    start_cols, start_rows = np.asarray(start_cols, dtype=int), np.asarray(start_rows, dtype=int)
+    d_cols, d_rows = np.asarray(end_cols) - start_cols, np.asarray(end_rows) - start_rows
+    steps = np.maximum(np.abs(d_cols), np.abs(d_rows))
+
+    segments = np.repeat(np.arange(len(steps)), steps)
+    fractions = (np.arange(len(segments)) - np.repeat(np.cumsum(steps) - steps, steps)) / steps[segments]
+    cols = start_cols[segments] + np.round(d_cols[segments] * fractions).astype(int)
+    rows = start_rows[segments] + np.round(d_rows[segments] * fractions).astype(int)
+    return segments, cols, rows
+
+
+def line_cells(cols, rows):
+    """
+    Returns every cell along the Bresenham lines joining consecutive cells of a polyline, all at once.
+    :param cols: Column indices of the polyline's cells
+    :param rows: Row indices of the polyline's cells
+    :return: Tuple of (cols, rows) integer arrays of the cells along the polyline, in order
+    """
+    cols, rows = np.asarray(cols, dtype=int), np.asarray(rows, dtype=int)
+    _, line_cols, line_rows = segment_cells(cols[:-1], rows[:-1], cols[1:], rows[1:])
+    return np.append(line_cols, cols[-1:]), np.append(line_rows, rows[-1:])
+
+
+def line_of_sight(occupancy_grid, origin, cols, rows):
+    """
+    Checks which of the given cells can be seen from the origin cell, i.e. have no occupied cell on the Bresenham line
+    between them, for all of them at once.
+    :param occupancy_grid: Occupancy grid
+    :param origin: Indices of the origin cell as tuple(col, row)
+    :param cols: Column indices of the target cells
+    :param rows: Row indices of the target cells
+    :return: Boolean array that's True for every target cell in sight of the origin
+    """
+    cols, rows = np.asarray(cols, dtype=int), np.asarray(rows, dtype=int)
+    origin_cols, origin_rows = np.full(len(cols), origin[0]), np.full(len(rows), origin[1])
+    segments, line_cols, line_rows = segment_cells(origin_cols, origin_rows, cols, rows)
+
+    # Count the occupied cells along each line, including the target cell itself
+    occupancy = occupancy_grid.occupancy
+    blocked = np.bincount(segments, weights=occupancy[line_cols, line_rows], minlength=len(cols))
+    return (blocked == 0) & (occupancy[cols, rows] == 0)
+
+
+def mean_clearance_cost(occupancy_grid, origin, cols, rows):
+    """
+    Averages the grid's clearance cost over the cells of the Bresenham line from the origin cell to each of the given
+    cells, including both ends, for all of them at once.
+    :param occupancy_grid: Occupancy grid
+    :param origin: Indices of the origin cell as tuple(col, row)
+    :param cols: Column indices of the target cells
+    :param rows: Row indices of the target cells
+    :return: Array with the mean clearance cost along the line to every target cell
+    """
+    cols, rows = np.asarray(cols, dtype=int), np.asarray(rows, dtype=int)
+    origin_cols, origin_rows = np.full(len(cols), origin[0]), np.full(len(rows), origin[1])
+    segments, line_cols, line_rows = segment_cells(origin_cols, origin_rows, cols, rows)
+
+    clearance_cost = occupancy_grid.clearance_cost
+    totals = np.bincount(segments, weights=clearance_cost[line_cols, line_rows], minlength=len(cols))
+    counts = np.bincount(segments, minlength=len(cols))
+    return (totals + clearance_cost[cols, rows]) / (counts + 1)
+
+
+def trajectory_is_free(occupancy_grid, trajectory):
+    """
+    Checks whether a trajectory only passes through free cells of the grid, including the cells between its waypoints,
+    with a single gather from the occupancy array.
+    :param occupancy_grid: Occupancy grid
+    :param trajectory: List of trajectory points as list(tuple(x, y), ...)
+    :return: True if the trajectory stays on the grid and never enters an occupied cell
+    """
+    cols, rows = occupancy_grid.get_cell_indices(trajectory)
+    if np.any(cols < 0):
+        return False
+    cols, rows = line_cells(cols, rows)
+    return not occupancy_grid.occupancy[cols, rows].any()
+
+
+def trim_trajectory(trajectory, position):
+    """
+    Cuts off the part of a trajectory that lies behind the given position, so that it starts at the position and
+    continues from the closest point of the trajectory.
+    :param trajectory: List of trajectory points as list(tuple(x, y), ...) with at least two points
+    :param position: Current position as tuple(x, y)
+    :return: Tuple of (trimmed trajectory, distance from the position to the closest point of the trajectory)
+    """
+    # Project the position onto every segment at once
+    points = np.asarray(trajectory, dtype=float)
+    segment_starts, segments = points[:-1], np.diff(points, axis=0)
+    lengths_squared = np.sum(segments ** 2, axis=1)
+    t = np.sum((np.asarray(position) - segment_starts) * segments, axis=1) / np.maximum(lengths_squared, 1e-12)
+    closest_points = segment_starts + np.clip(t, 0, 1)[:, np.newaxis] * segments
+    distances = np.linalg.norm(closest_points - position, axis=1)
+
+    closest = int(np.argmin(distances))
+    return [position] + list(trajectory[closest + 1:]), distances[closest]
+
+
+def pack_polygons(polygons):
+    """
+    Packs convex polygons with different numbers of vertices into arrays for testing against all of them at once.
+    Shorter polygons are padded by repeating their last vertex and their first edge.
+    :param polygons: List of convex polygons as arrays of vertices of shape (num_vertices, 2)
+    :return: Tuple of (vertices of shape (num_polygons, max_vertices, 2), unit normals of every edge of the same shape)
+    """
+    max_vertices = max([len(polygon) for polygon in polygons], default=1)
+    vertices = np.zeros((len(polygons), max_vertices, 2))
+    axes = np.zeros((len(polygons), max_vertices, 2))
+    for i, polygon in enumerate(polygons):
+        edges = np.roll(polygon, -1, axis=0) - polygon
+        normals = np.stack([-edges[:, 1], edges[:, 0]], axis=1) / np.linalg.norm(edges, axis=1)[:, np.newaxis]
+        vertices[i] = np.concatenate([polygon, np.repeat(polygon[-1:], max_vertices - len(polygon), axis=0)])
+        axes[i] = np.concatenate([normals, np.repeat(normals[:1], max_vertices - len(polygon), axis=0)])
+    return vertices, axes
+
+
+def points_in_polygons(points, vertices, axes, tolerance=1e-9):
+    """
+    Tests which points lie strictly inside which convex polygons, all at once
+    :param points: Array of points of shape (num_points, 2)
+    :param vertices: Polygon vertices as packed by pack_polygons()
+    :param axes: Polygon edge normals as packed by pack_polygons()
+    :return: Boolean array of shape (num_points, num_polygons)
+    """
+    # A point is inside a convex polygon if it's within the polygon's extent along every edge normal
+    polygon_projections = np.einsum('mvd,mkd->mkv', vertices, axes)
+    point_projections = np.einsum('nd,mkd->nmk', np.reshape(points, (-1, 2)), axes)
+    return np.all((point_projections > polygon_projections.min(axis=2) + tolerance) &
+                  (point_projections < polygon_projections.max(axis=2) - tolerance), axis=2)
+
+
+def segments_intersect_polygons(starts, ends, vertices, axes, tolerance=1e-9):
+    """
+    Tests which line segments pass through the inside of which convex polygons, all at once, with the separating axis
+    theorem. Segments that only touch a polygon's boundary don't count.
+    :param starts: Array of segment start points of shape (num_segments, 2)
+    :param ends: Array of segment end points of shape (num_segments, 2)
+    :param vertices: Polygon vertices as packed by pack_polygons()
+    :param axes: Polygon edge normals as packed by pack_polygons()
+    :return: Boolean array of shape (num_segments, num_polygons)
+    """
+    starts, ends = np.reshape(starts, (-1, 2)), np.reshape(ends, (-1, 2))
+
+    # 1. Overlap along every edge normal of the polygons
+    polygon_projections = np.einsum('mvd,mkd->mkv', vertices, axes)
+    start_projections = np.einsum('nd,mkd->nmk', starts, axes)
+    end_projections = np.einsum('nd,mkd->nmk', ends, axes)
+    intersect = np.all((np.maximum(start_projections, end_projections) > polygon_projections.min(axis=2) + tolerance) &
+                       (np.minimum(start_projections, end_projections) < polygon_projections.max(axis=2) - tolerance),
+                       axis=2)
+
+    # 2. Overlap along the normal of the segments, which the segments project onto as a single point
+    directions = ends - starts
+    lengths = np.linalg.norm(directions, axis=1)
+    normals = np.stack([-directions[:, 1], directions[:, 0]], axis=1) / np.maximum(lengths, tolerance)[:, np.newaxis]
+    offsets = np.sum(starts * normals, axis=1)[:, np.newaxis]
+    vertex_projections = np.einsum('mvd,nd->nmv', vertices, normals)
+    intersect &= (vertex_projections.min(axis=2) < offsets - tolerance) & \
+        (vertex_projections.max(axis=2) > offsets + tolerance)
+    return intersect
+
+
+def shift_slices(offset, length):
+    """
+    Returns a pair of slices along one axis of length cells such that the cells in the second slice are offset cells
+    away from the matching cells in the first one.
+    """
+    if offset > 0:
+        return slice(0, length - offset), slice(offset, length)
+    if offset < 0:
+        return slice(-offset, length), slice(0, length + offset)
+    return slice(None), slice(None)
+
+
+def octile_dist(a, b):
+    """
+    Returns the length of the shortest 8-connected path between two cells on an empty grid, measured in cells.
+    :param a: Cell indices as tuple(col, row)
+    :param b: Cell indices as tuple(col, row)
+    """
+    d_col = abs(a[0] - b[0])
+    d_row = abs(a[1] - b[1])
+    return max(d_col, d_row) + (SQRT_2 - 1) * min(d_col, d_row)
+
+
+def shortcut_trajectory(occupancy_grid, trajectory):
+    """
+    Any-angle post-processing in the spirit of Theta*. Collapses a grid trajectory down to the waypoints where it has to
+    turn around an obstacle by jumping from every kept waypoint straight to the farthest later waypoint still in line of
+    sight. The straight segments never enter an occupied cell, and are only taken when they cost no more than the part
+    of the trajectory they replace under the grid's clearance cost, so trajectories keep their distance from obstacles.
+
+    E.g. [(0.5, 0.5), (1.5, 0.5), (2.5, 1.5), (3.5, 1.5)] -> [(0.5, 0.5), (3.5, 1.5)] on an empty grid
+
+    :param occupancy_grid: Occupancy grid the trajectory was planned on
+    :param trajectory: List of trajectory points as list(tuple(x, y), ...)
+    :return: List of the trajectory points that were kept
+    """
+    # Nothing to do if less than 3 points
+    if len(trajectory) < 3:
+        return trajectory
+
+    cols, rows = occupancy_grid.get_cell_indices(trajectory)
+    if np.any(cols < 0):
+        return trajectory
+
+    # Cost of the trajectory up to every waypoint, the same way the planners cost it
+    clearance_cost = occupancy_grid.clearance_cost
+    points = np.asarray(trajectory, dtype=float)
+    step_costs = np.hypot(*np.diff(points, axis=0).T) * \
+        (1 + (clearance_cost[cols[:-1], rows[:-1]] + clearance_cost[cols[1:], rows[1:]]) / 2)
+    path_costs = np.concatenate(([0], np.cumsum(step_costs)))
+
+    shortcut = [trajectory[0]]
+    curr = 0
+    while curr < len(trajectory) - 1:
+        # Check the line of sight to all of the later waypoints at once and jump to the farthest visible one that isn't
+        # more expensive than following the trajectory. The next waypoint is always reachable, since the planner moved
+        # there directly.
+        origin = (cols[curr], rows[curr])
+        visible = line_of_sight(occupancy_grid, origin, cols[curr + 1:], rows[curr + 1:])
+        if np.any(clearance_cost):
+            lengths = np.hypot(*(points[curr + 1:] - points[curr]).T)
+            costs = lengths * (1 + mean_clearance_cost(occupancy_grid, origin, cols[curr + 1:], rows[curr + 1:]))
+            visible &= costs <= path_costs[curr + 1:] - path_costs[curr] + 1e-9
+        visible[0] = True
+        curr += int(np.flatnonzero(visible)[-1]) + 1
+        shortcut.append(trajectory[curr])
+
+    return shortcut
+
+
 def smooth_trajectory(trajectory):
     """
     Smooths out the kinks in the given trajectory. Any turn in the path that is more than 45 degrees is a "real" turn,
@@ -375,6 +2285,115 @@ def connected_components(buckets):
     return new_clusters
 
 
+class SpatialHash:
+    """
+    Uniform grid hash over circular objects like balls, stored as columnar arrays of positions and radii so they can be
+    handed to vectorized code all at once. Objects are bucketed by the square cell their center falls in, so queries
+    only measure the distance to objects in cells that overlap the query.
+    """
+    def __init__(self, positions=None, radii=None, cell_size=0.5):
+        """
+        :param positions: Optional array of object centers of shape (N, 2)
+        :param radii: Optional array of object radii of shape (N,)
+        :param cell_size: Side length of the cells in meters
+        """
+        self.cell_size = cell_size
+        self.positions = np.zeros((0, 2))
+        self.radii = np.zeros(0)
+        self.buckets = defaultdict(list)  # (col, row) -> list of indices into positions and radii
+        if positions is not None:
+            self.insert(positions, radii)
+
+    @staticmethod
+    def from_circles(circles, cell_size=0.5):
+        """
+        Builds a hash from a list of circles in the form list(tuple((x, y), radius), ...), as perception finds balls
+        """
+        positions = np.array([position for position, _ in circles], dtype=float).reshape(-1, 2)
+        radii = np.array([radius for _, radius in circles], dtype=float)
+        return SpatialHash(positions, radii, cell_size)
+
+    def __len__(self):
+        return len(self.positions)
+
+    def circles(self, indices=None):
+        """
+        Returns the objects at the given indices, or all of them, as a list of circles in the form
+        list(tuple((x, y), radius), ...)
+        """
+        if indices is None:
+            indices = range(len(self))
+        return [(tuple(self.positions[i].tolist()), float(self.radii[i])) for i in indices]
+
+    def insert(self, positions, radii=None):
+        """
+        Adds objects without touching the ones already in the hash
+        :param positions: Array of object centers of shape (N, 2)
+        :param radii: Array of object radii of shape (N,), zero if not given
+        :return: Indices of the new objects
+        """
+        positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+        radii = np.zeros(len(positions)) if radii is None else np.asarray(radii, dtype=float).reshape(-1)
+        indices = np.arange(len(self.positions), len(self.positions) + len(positions))
+
+        self.positions = np.concatenate([self.positions, positions])
+        self.radii = np.concatenate([self.radii, radii])
+        for index, cell in zip(indices.tolist(), np.floor(positions / self.cell_size).astype(int).tolist()):
+            self.buckets[tuple(cell)].append(index)
+        return indices
+
+    def candidates(self, center, radius):
+        """
+        Returns the indices of the objects in every cell that overlaps the square around center, as an array
+        """
+        min_col, min_row = np.floor((np.asarray(center) - radius) / self.cell_size).astype(int)
+        max_col, max_row = np.floor((np.asarray(center) + radius) / self.cell_size).astype(int)
+
+        # Large queries visit fewer cells by going through the buckets that exist instead
+        if (max_col - min_col + 1) * (max_row - min_row + 1) > len(self.buckets):
+            cells = [cell for cell in self.buckets if min_col <= cell[0] <= max_col and min_row <= cell[1] <= max_row]
+        else:
+            cells = [(col, row) for col in range(min_col, max_col + 1) for row in range(min_row, max_row + 1)]
+        indices = [index for cell in cells for index in self.buckets.get(cell, [])]
+        return np.array(indices, dtype=int)
+
+    def query_annulus(self, center, min_radius, max_radius):
+        """
+        Returns the indices of the objects whose centers are farther than min_radius from center and no farther than
+        max_radius, sorted by distance
+        """
+        indices = self.candidates(center, max_radius)
+        distances = np.linalg.norm(self.positions[indices] - center, axis=1)
+        keep = (distances > min_radius) & (distances <= max_radius)
+        return indices[keep][np.argsort(distances[keep], kind='stable')]
+
+    def query_radius(self, center, radius):
+        """
+        Returns the indices of the objects whose centers are within radius of center, sorted by distance
+        """
+        return self.query_annulus(center, -1, radius)
+
+    def nearest(self, center, k=1):
+        """
+        Returns the indices of the k objects whose centers are closest to center, sorted by distance. The search
+        radius doubles until it holds k objects, which are then the closest ones.
+        """
+        k = min(k, len(self))
+        if k == 0:
+            return np.zeros(0, dtype=int)
+
+        radius = self.cell_size
+        max_radius = np.max(np.linalg.norm(self.positions - center, axis=1))
+        while True:
+            indices = self.query_radius(center, min(radius, max_radius))
+            if len(indices) >= k:
+                return indices[:k]
+            radius *= 2
+
+
+RANSAC_RANDOM = threading.local()  # Random state of ransac_circle_fit() for every thread
+
+
 def ransac_circle_fit(points, desired_radius, consensus, tolerance, iterations):
     """
     Takes N points as an Nx2 array and returns the best-fit circle or None.
@@ -390,10 +2409,16 @@ def ransac_circle_fit(points, desired_radius, consensus, tolerance, iterations):
     if len(points) < 3:
         return None
 
-    np.random.seed(10)
+    # Every thread reseeds a generator of its own rather than NumPy's global one, so fits stay repeatable and don't
+    # disturb other users of the global random state
+    if not hasattr(RANSAC_RANDOM, 'state'):
+        RANSAC_RANDOM.state = np.random.RandomState()
+    rng = RANSAC_RANDOM.state
+    rng.seed(10)
+    points = np.asarray(points, dtype=float)
     for _ in range(iterations):
         # 1. Take a random sample of 3 points from this cluster
-        random_sample = np.random.choice(len(points), 3, replace=False)
+        random_sample = rng.choice(len(points), 3, replace=False)
 
         # 2. Fit a circle to those points
         fit_circle = make_circle(points[random_sample[0:3]])
@@ -406,10 +2431,8 @@ def ransac_circle_fit(points, desired_radius, consensus, tolerance, iterations):
         if not abs(fit_circle_radius - desired_radius) <= ball_radius_tolerance:
             continue
 
-        num_inliers = 0
-        for point in points:
-            if abs(dist(point, fit_circle_center) - fit_circle_radius) <= tolerance:
-                num_inliers += 1
+        distances = np.linalg.norm(points - fit_circle_center, axis=1)
+        num_inliers = np.count_nonzero(np.abs(distances - fit_circle_radius) <= tolerance)
 
         # 4. If we've reached a consensus, then return the circle we've found
         if num_inliers / len(points) >= consensus:
@@ -10,7 +10,8 @@ from comms import *
 from config import Config
 from perception import Perception
 from planning import Planning
-from controls import Controls
+from controls import Controls, ControlThread
+from pipeline import Pipeline
 from visualize import Visualize
 import time
 
@@ -40,12 +41,24 @@ def main():
     comms.daemon = True
     comms.start()
 
-    # Launch perception, motion planning, and controls in main thread
-    perception = Perception(config)
-    planning = Planning(config)
+    # Launch controls in main thread
     controls = Controls(config)
     visualize = Visualize()
 
+    # Launch controls in their own thread so drive commands keep up with comms
+    control_thread = None
+    if config.control_rate > 0:
+        control_thread = ControlThread(controls, config, comms, commands_mutex)
+        control_thread.start()
+
+    if config.pipeline:
+        run_pipeline(config, comms, commands_mutex, controls, control_thread, visualize)
+        return
+
+    # The pipeline builds perception and planning in its own processes, so only the serial path needs them here
+    perception = Perception(config)
+    planning = Planning(config)
+
     try:
         while True:
             if len(comms.vehicle_state['lidarSweep']) > 0:
@@ -53,11 +66,23 @@ def main():
                 world_state = perception.run(comms.vehicle_state)
                 plan_state = planning.run(world_state)
 
-                new_commands = controls.run(plan_state)
+                if control_thread is not None:
+                    control_thread.set_plan(plan_state, t1)
+                    new_commands = {}
+                else:
+                    new_commands = controls.run(plan_state)
                 # Unlock
                 t2 = time .time()
                 freq = 1 / (t2 - t1)
-                print(f"Running at {freq} Hz")
+                replans_avoided = planning.replans_avoided_per_second()
+                cache_hits, cache_misses = planning.trajectory_cache_stats()
+                print(f"Running at {freq} Hz, avoided {replans_avoided} replans in the last second, "
+                      f"{cache_hits} trajectory cache hits and {cache_misses} misses")
+                if control_thread is not None:
+                    metrics = control_thread.metrics()
+                    print(f"Controls running at {metrics['rate']} Hz with {metrics['mean_jitter'] * 1000:.2f} ms mean "
+                          f"and {metrics['max_jitter'] * 1000:.2f} ms worst jitter, "
+                          f"{metrics['missed_deadlines']} missed deadlines")
 
                 new_commands['draw'] = visualize.run(world_state, plan_state)
                 with commands_mutex:
@@ -68,5 +93,59 @@ def main():
         pass
 
 
+def run_pipeline(config, comms, commands_mutex, controls, control_thread, visualize):
+    """
+    Feeds every new sweep to perception and planning running in processes of their own, and runs controls on the
+    plans that come out of them
+    """
+    pipeline = Pipeline(config)
+    pipeline.start()
+    prev_vehicle_state = None
+    prev_print_time = time.time()
+
+    try:
+        while True:
+            # Comms replaces the vehicle state whenever a new one arrives
+            vehicle_state = comms.vehicle_state
+            if vehicle_state is not prev_vehicle_state and len(vehicle_state['lidarSweep']) > 0:
+                pipeline.submit(vehicle_state, time.time())
+                prev_vehicle_state = vehicle_state
+
+            result = pipeline.poll()
+            if result is None:
+                time.sleep(0.001)
+                continue
+            world_state, plan_state, capture_time = result
+
+            if control_thread is not None:
+                control_thread.set_plan(plan_state, capture_time)
+                new_commands = {}
+            else:
+                new_commands = controls.run(plan_state)
+
+            if time.time() - prev_print_time >= 1:
+                prev_print_time = time.time()
+                stage_metrics = pipeline.metrics()
+                for name, metrics in stage_metrics.items():
+                    print(f"{name.capitalize()} running at {metrics['rate']:.1f} Hz, busy {metrics['utilization']:.0%} "
+                          f"of the time with {metrics['queue_depth']} frames waiting")
+                metrics = stage_metrics['planning']
+                print(f"Avoided {metrics['replans_avoided']} replans in the last second, "
+                      f"{metrics['cache_hits']} trajectory cache hits and {metrics['cache_misses']} misses")
+                if control_thread is not None:
+                    metrics = control_thread.metrics()
+                    print(f"Controls running at {metrics['rate']} Hz with {metrics['mean_jitter'] * 1000:.2f} ms mean "
+                          f"and {metrics['max_jitter'] * 1000:.2f} ms worst jitter, "
+                          f"{metrics['missed_deadlines']} missed deadlines")
+
+            new_commands['draw'] = visualize.run(world_state, plan_state)
+            with commands_mutex:
+                comms.vehicle_commands.update(new_commands)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pipeline.stop()
+
+
 if __name__ == '__main__':
     main()
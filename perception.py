@@ -45,7 +45,8 @@ class Perception:
         Return obstacles as
         {
             'balls': list(),
-            'others': list()
+            'others': list(),
+            'ball_index': geom.SpatialHash
         }
         """
         world_state = {
@@ -181,5 +182,6 @@ class Perception:
 
         vehicle_state['classes'] = {
             'balls': balls,
-            'others': others
+            'others': others,
+            'ball_index': geom.SpatialHash.from_circles(balls)
         }
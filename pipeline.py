@@ -0,0 +1,422 @@
+#
+# Copyright (c) 2020 FRC Team 3260
+#
+
+import multiprocessing as mp
+import queue
+import signal
+import time
+import traceback
+import numpy as np
+from multiprocessing import shared_memory
+import geometry as geom
+from perception import Perception
+from planning import Planning
+
+TUBE_MODES = ['NONE', 'INTAKE', 'OUTTAKE']
+STAGES = ['perception', 'planning']
+PLANNING_COUNTERS = ['replans_avoided', 'cache_hits', 'cache_misses']  # Published after the stats of every stage
+
+
+class FrameRing:
+    """
+    Ring of frames in shared memory for passing arrays between processes without pickling them. Each slot holds one
+    frame as a fixed set of arrays, each with room for a maximum number of rows and a count of the rows in use. Only
+    slot numbers travel through the queues: a writer takes a free slot, fills it and queues it as full, and a reader
+    takes the oldest full slot and frees it again once it's done with it.
+    """
+    def __init__(self, fields, num_slots, context=None):
+        """
+        :param fields: Dict of name -> tuple(max_shape, dtype) of every array in a frame, where the first dimension of
+        max_shape is the maximum number of rows
+        :param num_slots: Number of frames the ring can hold
+        :param context: multiprocessing context to create the queues with, or None for the default one
+        """
+        context = context or mp.get_context()
+        self.fields = {name: (tuple(shape), np.dtype(dtype)) for name, (shape, dtype) in fields.items()}
+        self.num_slots = num_slots
+        self.free = context.Queue()
+        self.full = context.Queue()
+        for slot in range(num_slots):
+            self.free.put(slot)
+
+        self.shm = shared_memory.SharedMemory(create=True, size=self.layout()[-1])
+        self.owner = True  # The process that created the shared memory removes it
+        self.stopped = False  # Set once a reader is told that no more frames are coming
+        self.map_arrays()
+
+    def layout(self):
+        """
+        Returns the byte offset of the row counts, of every field's arrays for all slots, and the total size
+        """
+        offsets = [0]
+        size = self.num_slots * len(self.fields) * 8
+        for shape, dtype in self.fields.values():
+            offsets.append(size)
+            # Keep every field 8-byte aligned
+            size += -(-self.num_slots * int(np.prod(shape)) * dtype.itemsize // 8) * 8
+        return offsets + [max(size, 1)]
+
+    def map_arrays(self):
+        """
+        Creates the NumPy views of the shared memory
+        """
+        offsets = self.layout()
+        self.counts = np.ndarray((self.num_slots, len(self.fields)), dtype=np.int64, buffer=self.shm.buf)
+        self.arrays = {name: np.ndarray((self.num_slots,) + shape, dtype=dtype, buffer=self.shm.buf, offset=offset)
+                       for (name, (shape, dtype)), offset in zip(self.fields.items(), offsets[1:-1])}
+
+    def __getstate__(self):
+        return {'fields': self.fields, 'num_slots': self.num_slots, 'name': self.shm.name, 'free': self.free,
+                'full': self.full}
+
+    def __setstate__(self, state):
+        self.fields = state['fields']
+        self.num_slots = state['num_slots']
+        self.free = state['free']
+        self.full = state['full']
+        self.shm = shared_memory.SharedMemory(name=state['name'])
+        self.owner = False
+        self.stopped = False
+        self.map_arrays()
+
+    def write(self, frame, timeout=None):
+        """
+        Copies a frame into a free slot and queues it. If every slot is full, the oldest queued frame is dropped in
+        favor of this one, since it's out of date anyway. Rows beyond the capacity of a field are dropped.
+        :param frame: Dict of name -> array for every field, missing fields have no rows
+        :param timeout: Seconds to wait for a slot while readers hold all of them, or None to wait forever
+        :return: True if the frame was queued, False if no slot freed up in time
+        """
+        # Slots can be in flight between the queues, so keep checking both of them
+        slot = None
+        start = time.time()
+        while slot is None:
+            try:
+                slot = self.free.get(timeout=0.001)
+            except queue.Empty:
+                try:
+                    slot = self.full.get_nowait()
+                except queue.Empty:
+                    if timeout is not None and time.time() - start > timeout:
+                        return False
+
+        for i, (name, (shape, dtype)) in enumerate(self.fields.items()):
+            data = np.asarray(frame.get(name, np.zeros((0,) + shape[1:])), dtype=dtype)
+            rows = min(len(data), shape[0])
+            self.arrays[name][slot, :rows] = data[:rows]
+            self.counts[slot, i] = rows
+        self.full.put(slot)
+        return True
+
+    def read(self, timeout=None):
+        """
+        Takes the oldest queued frame. Its arrays are views of the shared memory that stay valid until release() is
+        called with its slot.
+        :param timeout: Seconds to wait for a frame, or None to wait forever
+        :return: Tuple of (slot, dict of name -> array), or None if no frame came in time or the ring was stopped
+        """
+        if self.stopped:
+            return None
+        try:
+            slot = self.full.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        if slot < 0:
+            self.stopped = True
+            return None
+        return slot, {name: self.arrays[name][slot, :self.counts[slot, i]] for i, name in enumerate(self.fields)}
+
+    def release(self, slot):
+        """
+        Hands a slot taken with read() back to the writer
+        """
+        self.free.put(slot)
+
+    def depth(self):
+        """
+        Returns the number of frames waiting to be read
+        """
+        return self.full.qsize()
+
+    def stop(self):
+        """
+        Tells the reader that no more frames are coming
+        """
+        self.full.put(-1)
+
+    def close(self):
+        """
+        Detaches from the shared memory, and removes it if this process created it
+        """
+        del self.counts
+        del self.arrays
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def sweep_fields(config):
+    """
+    Returns the fields of the frames going into perception
+    """
+    return {
+        'state': ((5,), np.float64),  # x, y, theta, ingested balls, time
+        'sweep': ((config.pipeline_max_sweep_points, 3), np.float64)
+    }
+
+
+def world_fields(config):
+    """
+    Returns the fields of the frames going from perception into planning
+    """
+    return {
+        'state': ((5,), np.float64),  # x, y, theta, ingested balls, time
+        'balls': ((config.pipeline_max_obstacles, 3), np.float64),  # x, y, radius
+        'others': ((config.pipeline_max_obstacles, 4), np.float64)  # min_x, min_y, max_x, max_y
+    }
+
+
+def plan_fields(config):
+    """
+    Returns the fields of the frames going from planning into controls
+    """
+    num_cols = int(config.occupancy_grid_width / config.occupancy_grid_cell_resolution)
+    num_rows = int(config.occupancy_grid_height / config.occupancy_grid_cell_resolution)
+    return dict(world_fields(config), **{
+        'plan': ((5,), np.float64),  # goal x, goal y, whether there's a goal, direction, tube mode
+        'trajectory': ((num_cols * num_rows, 2), np.float64),
+        'occupancy': ((num_cols, num_rows), np.uint8),
+        'clearance_cost': ((num_cols, num_rows), np.float64)
+    })
+
+
+def encode_world_state(world_state, capture_time):
+    """
+    Flattens the output of perception into the arrays of a world frame
+    """
+    (x, y), theta = world_state['pose']
+    obstacles = world_state['obstacles']
+    return {
+        'state': np.array([x, y, theta, world_state['ingestedBalls'], capture_time], dtype=float),
+        'balls': np.reshape([(ball_x, ball_y, radius) for (ball_x, ball_y), radius in obstacles['balls']], (-1, 3)),
+        'others': np.reshape([(min_x, min_y, max_x, max_y) for (min_x, min_y), (max_x, max_y) in obstacles['others']],
+                             (-1, 4))
+    }
+
+
+def decode_world_state(frame):
+    """
+    Rebuilds the output of perception from a world frame, along with the time its sweep was captured
+    """
+    x, y, theta, ingested_balls, capture_time = frame['state'].tolist()
+    world_state = {
+        'pose': ((x, y), theta),
+        'ingestedBalls': int(ingested_balls),
+        'obstacles': {
+            'balls': [((ball_x, ball_y), radius) for ball_x, ball_y, radius in frame['balls'].tolist()],
+            'others': [((min_x, min_y), (max_x, max_y)) for min_x, min_y, max_x, max_y in frame['others'].tolist()]
+        }
+    }
+    return world_state, capture_time
+
+
+def perception_stage(config, inputs, outputs, stats, index):
+    """
+    Runs perception on every sweep from the inputs ring and writes the results to the outputs ring
+    """
+    perception = Perception(config)
+
+    def process(frame):
+        x, y, theta, ingested_balls, capture_time = frame['state'].tolist()
+        vehicle_state = {
+            'x': x,
+            'y': y,
+            'theta': theta,
+            'ingestedBalls': int(ingested_balls),
+            'lidarSweep': frame['sweep'].tolist()
+        }
+        return encode_world_state(perception.run(vehicle_state), capture_time)
+
+    run_stage(process, inputs, outputs, stats, index)
+
+
+def planning_stage(config, inputs, outputs, stats, index):
+    """
+    Runs planning on every world frame from the inputs ring and writes the plans to the outputs ring
+    """
+    planning = Planning(config)
+
+    def process(frame):
+        world_state, capture_time = decode_world_state(frame)
+        plan_state = planning.run(world_state)
+
+        plan_frame = encode_world_state(world_state, capture_time)
+        goal = plan_state['goal']
+        plan_frame['plan'] = [goal[0] if goal is not None else 0, goal[1] if goal is not None else 0,
+                              goal is not None, plan_state['direction'], TUBE_MODES.index(plan_state['tube_mode'])]
+        plan_frame['trajectory'] = np.reshape(plan_state['trajectory'] or [], (-1, 2))
+        plan_frame['occupancy'] = plan_state['grid'].occupancy
+        plan_frame['clearance_cost'] = plan_state['grid'].clearance_cost
+
+        # Nothing else can ask this process's planning for its counters
+        counters = [planning.replans_avoided_per_second(), *planning.trajectory_cache_stats()]
+        stats[2 * len(STAGES):] = counters
+        return plan_frame
+
+    run_stage(process, inputs, outputs, stats, index)
+
+
+def run_stage(process, inputs, outputs, stats, index):
+    """
+    Processes frames from the inputs ring into the outputs ring until the inputs are stopped, and publishes the
+    stage's utilization and frame rate into stats once a second. The outputs are always stopped when the stage ends, so
+    the next stage shuts down too, and a stage that fails exits with an error code that Pipeline.poll() reports.
+    :param process: Function that turns the arrays of an input frame into a dict of the arrays of an output frame
+    :param inputs: FrameRing to read from
+    :param outputs: FrameRing to write to
+    :param stats: Shared array of floats holding the utilization and frame rate of every stage
+    :param index: Index of this stage
+    """
+    # Ctrl-C reaches every process in the group, but stages shut down in order once the main process stops the inputs
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    window_start = time.time()
+    busy = 0
+    num_frames = 0
+    failed = False
+    try:
+        while not inputs.stopped:
+            result = inputs.read(timeout=0.1)
+            if result is not None:
+                start = time.time()
+                slot, frame = result
+                output = process(frame)
+                inputs.release(slot)
+                outputs.write(output)
+                busy += time.time() - start
+                num_frames += 1
+                del result, frame  # The views of the slot have to be gone before the ring can be closed
+
+            elapsed = time.time() - window_start
+            if elapsed >= 1:
+                stats[2 * index] = busy / elapsed
+                stats[2 * index + 1] = num_frames / elapsed
+                window_start, busy, num_frames = time.time(), 0, 0
+    except Exception:
+        traceback.print_exc()
+        failed = True
+    finally:
+        result = frame = None
+        outputs.stop()
+        inputs.close()
+        outputs.close()
+
+    if failed:
+        raise SystemExit(1)
+
+
+class Pipeline:
+    """
+    Runs perception and planning in processes of their own, so perception of one sweep overlaps planning of the
+    previous one, and neither of them holds up controls in the main process. Frames are passed between the stages
+    through shared memory rings. When a stage falls behind, the frames waiting for it are replaced by newer ones.
+    """
+    def __init__(self, config):
+        """
+        :param config: Contains various constants from the robot
+        """
+        context = mp.get_context('spawn')
+        self.sweeps = FrameRing(sweep_fields(config), config.pipeline_ring_size, context)
+        self.worlds = FrameRing(world_fields(config), config.pipeline_ring_size, context)
+        self.plans = FrameRing(plan_fields(config), config.pipeline_ring_size, context)
+        self.stats = context.Array('d', 2 * len(STAGES) + len(PLANNING_COUNTERS), lock=False)
+        self.processes = [
+            context.Process(target=perception_stage, args=(config, self.sweeps, self.worlds, self.stats, 0),
+                            daemon=True),
+            context.Process(target=planning_stage, args=(config, self.worlds, self.plans, self.stats, 1), daemon=True)
+        ]
+
+        # Planning's grid is rebuilt here from the arrays that come through the ring
+        self.occupancy_grid = geom.OccupancyGrid(config.occupancy_grid_width,
+                                                 config.occupancy_grid_height,
+                                                 config.occupancy_grid_cell_resolution,
+                                                 config.occupancy_grid_origin)
+
+    def start(self):
+        for process in self.processes:
+            process.start()
+
+    def stop(self):
+        """
+        Stops every stage and removes the rings
+        """
+        self.sweeps.stop()
+        for process in self.processes:
+            process.join()
+        while self.plans.read(timeout=0) is not None:
+            pass
+        self.sweeps.close()
+        self.worlds.close()
+        self.plans.close()
+
+    def submit(self, vehicle_state, capture_time):
+        """
+        Queues a new sweep for perception
+        :param vehicle_state: Current state of all sensors on the vehicle
+        :param capture_time: Time the sweep was captured
+        """
+        state = [vehicle_state['x'], vehicle_state['y'], vehicle_state['theta'], vehicle_state['ingestedBalls'],
+                 capture_time]
+        self.sweeps.write({'state': state, 'sweep': np.reshape(vehicle_state['lidarSweep'], (-1, 3))})
+
+    def poll(self):
+        """
+        Returns the newest plan that came out of planning since the last call, skipping older ones
+        :return: Tuple of (world state, plan state, time the sweep was captured), or None if there's no new plan
+        :raises RuntimeError: If a stage failed, since no more plans will come
+        """
+        result = None
+        while True:
+            newer = self.plans.read(timeout=0)
+            if newer is None:
+                break
+            if result is not None:
+                self.plans.release(result[0])
+            result = newer
+        if result is None:
+            for name, process in zip(STAGES, self.processes):
+                if process.exitcode:
+                    raise RuntimeError(f"Pipeline {name} stage failed with exit code {process.exitcode}")
+            return None
+
+        slot, frame = result
+        world_state, capture_time = decode_world_state(frame)
+        goal_x, goal_y, has_goal, direction, tube_mode = frame['plan'].tolist()
+        trajectory = [tuple(point) for point in frame['trajectory'].tolist()]
+        self.occupancy_grid.occupancy = frame['occupancy'].copy()
+        self.occupancy_grid.clearance_cost = frame['clearance_cost'].copy()
+        self.plans.release(slot)
+
+        plan_state = {
+            'pose': world_state['pose'],
+            'trajectory': trajectory if len(trajectory) > 0 else None,
+            'grid': self.occupancy_grid,
+            'goal': (goal_x, goal_y) if has_goal else None,
+            'direction': int(direction),
+            'tube_mode': TUBE_MODES[int(tube_mode)]
+        }
+        return world_state, plan_state, capture_time
+
+    def metrics(self):
+        """
+        Returns a dict of stage name -> dict of the fraction of the time the stage was busy and the frames it processed
+        per second over the last second, and the frames waiting for it. Planning's also holds the replans it avoided
+        over the last second and its trajectory cache hits and misses.
+        """
+        depths = [self.sweeps.depth(), self.worlds.depth()]
+        metrics = {name: {'utilization': self.stats[2 * i], 'rate': self.stats[2 * i + 1], 'queue_depth': depths[i]}
+                   for i, name in enumerate(STAGES)}
+        for i, name in enumerate(PLANNING_COUNTERS):
+            metrics['planning'][name] = int(self.stats[2 * len(STAGES) + i])
+        return metrics
@@ -2,8 +2,25 @@
 # Copyright (c) 2020 FRC Team 3260
 #
 
+import functools
+import time
 import numpy as np
+from collections import deque
 import geometry as geom
+from sequencing import PickupSequencer
+
+# Grid planners that can be selected with config.motion_planner. Planners that keep their search state between frames
+# are classes, so each Planning gets its own instance of them.
+MOTION_PLANNERS = {
+    'a_star': geom.a_star,
+    'jps': geom.jump_point_search,
+    'd_star_lite': geom.DStarLite,
+    'wavefront': geom.NavigationFunction,
+    'anytime_a_star': geom.AnytimeAStar,
+    'lattice': geom.LatticePlanner,
+    'hierarchical': geom.HierarchicalPlanner,
+    'visibility': geom.VisibilityGraph
+}
 
 
 class Planning:
@@ -15,15 +32,59 @@ class Planning:
         self.scoring_zone = self.blue_goal_region.center + np.array([0, 1])
         self.blue_player_station_pos = config.blue_player_station_pos - np.array([0, 0.5])
 
-        self.prev_obstacles = None  # Used to remember balls that were nearby but are now in LIDAR deadzone
+        self.prev_ball_index = None  # Used to remember balls that were nearby but are now in LIDAR deadzone
         self.prev_goal = None  # Used to prevent flip-flopping between two equidistant goals
+        self.prev_trajectory = None  # Kept so it can be followed again while it's still collision-free
+        self.trajectory_reuse_max_deviation = config.trajectory_reuse_max_deviation
+        self.shortcut_trajectories = config.shortcut_trajectories
+        self.plans_with_heading = config.motion_planner == 'lattice'
+        self.plans_to_closest_cell = config.motion_planner == 'anytime_a_star'  # Even when the goal can't be reached
+        # The anytime planner bounds planning latency, so the search for a ball is held to the same budget
+        self.behavior_planning_budget = (config.motion_planning_max_expansions, config.motion_planning_time_budget) \
+            if self.plans_to_closest_cell else (0, 0)
+        # Behavior planning's Dijkstra search finds the same paths as A*, but the other planners should plan their own
+        self.reuses_goal_trajectory = config.motion_planner == 'a_star'
+        self.replans_avoided = deque()  # Times at which the previous trajectory was reused over the last second
+        self.trajectory_cache = geom.TrajectoryCache(config.trajectory_cache_size) \
+            if config.trajectory_cache_size > 0 and not self.plans_with_heading else None
         self.occupancy_grid_dilation_kernel_size = config.occupancy_grid_dilation_kernel_size
         self.occupancy_grid = geom.OccupancyGrid(config.occupancy_grid_width,
                                                  config.occupancy_grid_height,
                                                  config.occupancy_grid_cell_resolution,
                                                  config.occupancy_grid_origin)
+        self.occupancy_grid.set_clearance_cost(config.occupancy_grid_clearance_radius,
+                                               config.occupancy_grid_clearance_weight)
+        self.occupancy_grid.set_static_obstacles(self.field_elements, self.occupancy_grid_dilation_kernel_size)
 
         self.deadzone_radius = config.lidar_deadzone_radius
+        self.pickup_sequencer = PickupSequencer(config) if config.pickup_sequencing_max_candidates > 0 else None
+
+        if config.motion_planner not in MOTION_PLANNERS:
+            raise ValueError(f"Unknown motion planner '{config.motion_planner}'")
+        motion_planner = MOTION_PLANNERS[config.motion_planner]
+        if motion_planner is geom.AnytimeAStar:
+            # Bound how long motion planning can search every frame
+            self.planner = geom.AnytimeAStar(config.motion_planning_max_expansions, config.motion_planning_time_budget)
+        elif motion_planner is geom.LatticePlanner:
+            self.planner = geom.LatticePlanner(config.lattice_turn_cost, config.lattice_heuristic_weight)
+        elif motion_planner is geom.HierarchicalPlanner:
+            self.planner = geom.HierarchicalPlanner(config.hierarchical_planner_levels)
+        elif motion_planner is geom.VisibilityGraph:
+            # Keep as far from the field elements as the grid's dilation does, plus the cell an obstacle's edge is in and
+            # half a cell diagonal, so the lines between corners don't graze dilated cells once they're rasterized
+            margin = (self.occupancy_grid_dilation_kernel_size // 2 + 1 + geom.SQRT_2 / 2) * \
+                config.occupancy_grid_cell_resolution
+            self.planner = geom.VisibilityGraph(self.field_elements, margin)
+        elif isinstance(motion_planner, type):
+            self.planner = motion_planner()
+        else:
+            self.planner = None  # Planner instance, or None if the planner is a plain function
+        self.motion_planner = self.planner.plan if self.planner is not None else motion_planner
+        if motion_planner is geom.a_star and config.landmark_heuristic_num_landmarks > 0:
+            # The landmark fields only depend on the static field, so they're computed once and cached on disk
+            landmarks = geom.LandmarkHeuristic(self.occupancy_grid, config.landmark_heuristic_num_landmarks,
+                                               config.landmark_heuristic_cache_dir)
+            self.motion_planner = functools.partial(geom.a_star, landmarks=landmarks)
 
     def run(self, world_state):
         """
@@ -31,10 +92,13 @@ class Planning:
         :param world_state: Output of perception
         :return: Dict containing the robot's current pose and a goal state as the input of controls
         """
-        # 1. Identify the goal
+        # 1. Insert this frame's obstacles so behavior planning can reason about what's reachable
+        self.update_occupancy_grid(world_state)
+
+        # 2. Identify the goal
         self.behavior_planning(world_state)
 
-        # 2. Move towards it if there is a nearest ball (using A*)
+        # 3. Move towards it if there is a reachable ball
         self.motion_planning(world_state)
 
         plan_state = {
@@ -43,7 +107,8 @@ class Planning:
             'grid': world_state['grid'],
             'goal': world_state['goal'],
             'direction': world_state['direction'],
-            'tube_mode': world_state['tube_mode']
+            'tube_mode': world_state['tube_mode'],
+            'next_waypoint': world_state['next_waypoint']
         }
         return plan_state
 
@@ -55,9 +120,13 @@ class Planning:
         one of 'INTAKE', 'OUTTAKE', 'NONE'.
 
         Also identifies which direction to drive in, one of '1', '-1', or '0'
+
+        When the goal is a ball, the trajectory to it found while choosing it is placed into
+        world_state['goal_trajectory'], otherwise that is None.
         """
         start = world_state['pose'][0]  # Our current (x,y)
         goal = None
+        goal_trajectory = None
         direction = None
         tube_mode = None
 
@@ -78,20 +147,42 @@ class Planning:
             tube_mode = 'INTAKE'
             direction = 1
             # 1. Add some object persistence so balls inside the LIDAR deadzone don't keep going out of view
-            if self.prev_obstacles is not None:
-                # Run through and recover any balls within the deadzone and place them into world_state
-                for ball in self.prev_obstacles:
-                    if 0.5 < geom.dist(start, ball[0]) <= self.deadzone_radius:
-                        world_state['obstacles']['balls'].append(ball)
-            self.prev_obstacles = world_state['obstacles']['balls']
-
-            # 2. Find the closest ball
-            min_dist = np.inf
-            for ball_pos, ball_radius in world_state['obstacles']['balls']:
-                curr_dist = geom.dist(ball_pos, start)
-                if curr_dist < min_dist and not self.occupancy_grid.get_occupancy(ball_pos):
-                    min_dist = curr_dist
-                    goal = ball_pos
+            ball_index = world_state['obstacles'].get('ball_index')
+            if ball_index is None:
+                ball_index = geom.SpatialHash.from_circles(world_state['obstacles']['balls'])
+            if self.prev_ball_index is not None:
+                # Recover any balls within the deadzone and place them into world_state
+                recovered = self.prev_ball_index.query_annulus(start, 0.5, self.deadzone_radius)
+                ball_index.insert(self.prev_ball_index.positions[recovered], self.prev_ball_index.radii[recovered])
+                world_state['obstacles']['balls'].extend(self.prev_ball_index.circles(recovered))
+            world_state['obstacles']['ball_index'] = ball_index
+            self.prev_ball_index = ball_index
+
+            # 2. Drop the balls that are sealed off from us, then find the path costs to the balls we might pick with one
+            # search, and keep the path to our goal for motion planning. The search stops as soon as the rest of the
+            # balls are known to cost more than the ones found, or when it runs out of budget.
+            reachable = self.occupancy_grid.reachable(start, ball_index.positions)
+            balls = [tuple(ball) for ball in ball_index.positions[reachable].tolist()]
+            if len(balls) > 0:
+                max_goals = self.pickup_sequencer.max_candidates if self.pickup_sequencer is not None else 1
+                max_expansions, time_budget = self.behavior_planning_budget
+                costs, parents = geom.dijkstra(self.occupancy_grid, start, balls, max_goals=max_goals,
+                                               max_expansions=max_expansions, time_budget=time_budget)
+                if np.min(costs) == np.inf:
+                    # 3. The budget ran out before any ball was reached, so head for the closest one in a straight line
+                    # and leave finding the way there to the anytime motion planner
+                    goal = balls[int(np.argmin(np.linalg.norm(np.subtract(balls, start), axis=1)))]
+            if len(balls) > 0 and np.min(costs) < np.inf:
+                if self.pickup_sequencer is not None:
+                    # 3. Go to the first ball of the cheapest trip that fills us up (we score with more than 4 balls)
+                    num_pickups = 5 - world_state['ingestedBalls']
+                    sequence = self.pickup_sequencer.run(self.occupancy_grid, costs, balls, num_pickups,
+                                                         self.scoring_zone)
+                    goal = balls[sequence[0]]
+                else:
+                    # 3. Go to the ball that's cheapest to drive to
+                    goal = balls[int(np.argmin(costs))]
+                goal_trajectory = geom.trajectory_from_parents(self.occupancy_grid, parents, start, goal)
 
         # Last resort!
         if goal is None:
@@ -101,38 +192,116 @@ class Planning:
             goal = self.blue_player_station_pos
 
         world_state['goal'] = goal
+        world_state['goal_trajectory'] = goal_trajectory
         world_state['direction'] = direction
         world_state['tube_mode'] = tube_mode
 
+    def update_occupancy_grid(self, world_state):
+        """
+        Inserts the dynamic obstacles of this frame into the occupancy grid and places the grid into
+        world_state['grid']. Does nothing if they were already inserted.
+        :param world_state: Output of perception
+        """
+        # Replace the dynamic obstacles because they may have changed. Static obstacles were inserted once at startup.
+        dynamic_obstacles = world_state['obstacles']['others']
+        self.occupancy_grid.set_dynamic_obstacles(dynamic_obstacles, kernel_size=self.occupancy_grid_dilation_kernel_size)
+        world_state['grid'] = self.occupancy_grid
+
     def motion_planning(self, world_state):
         """
         Calculates a trajectory for driving from the current position to the goal contained in world_state['goal']. The
-        result is placed into world_state['trajectory']
+        result is placed into world_state['trajectory']. If behavior planning already found a trajectory to the goal, it
+        is reused when the motion planner is A*. With the wavefront planner, a function returning the next waypoint from
+        any position is placed into world_state['next_waypoint'], which is None otherwise.
         :param world_state: Outputs of perception and behavior planning
         """
-        # clear the positions previously marked as obstacles because they may have changed
-        self.occupancy_grid.clear()
+        self.update_occupancy_grid(world_state)
 
-        # Insert static obstacles
-        for static_obstacle in self.field_elements:
-            self.occupancy_grid.insert_convex_polygon(static_obstacle)
-
-        # Insert dynamic obstacles
-        dynamic_obstacles = world_state['obstacles']['others']
-        for dynamic_obstacle in dynamic_obstacles:
-            self.occupancy_grid.insert_rectangular_obstacle(dynamic_obstacle)
+        trajectory = None
+        start = world_state['pose'][0]
+        goal = world_state['goal']
 
-        self.occupancy_grid.dilate(kernel_size=self.occupancy_grid_dilation_kernel_size)
+        # Don't launch a search that can't succeed, unless the planner drives to the closest cell it can reach instead
+        if goal is not None and (self.plans_to_closest_cell or self.occupancy_grid.reachable(start, [goal])[0]):
 
-        # Call A* to generate a path to goal
-        trajectory = None
-        if world_state['goal'] is not None:
-            start = world_state['pose'][0]
-            goal = world_state['goal']
-            trajectory = geom.a_star(self.occupancy_grid, start, goal)
+            # Keep following the previous trajectory if nothing relevant has changed. Otherwise use the one behavior
+            # planning found on the way to the goal, or call the configured grid planner to generate a path to goal.
+            trajectory = self.reuse_trajectory(start, goal)
+            if trajectory is not None:
+                self.replans_avoided.append(time.time())
+                self.prune_replans_avoided()
+            elif self.plans_with_heading:
+                # Plan from the way the robot is facing, or the opposite way when it's driving backwards
+                heading = world_state['pose'][1] + (np.pi if world_state.get('direction') == -1 else 0)
+                trajectory = self.motion_planner(self.occupancy_grid, start, goal, heading=heading)
+            else:
+                # Robots oscillating around the same spot keep asking for the same path, so look it up first
+                if self.trajectory_cache is not None:
+                    trajectory = self.trajectory_cache.get(self.occupancy_grid, start, goal)
+                if trajectory is None:
+                    if self.reuses_goal_trajectory:
+                        trajectory = world_state.get('goal_trajectory')
+                    if trajectory is None:
+                        trajectory = self.motion_planner(self.occupancy_grid, start, goal)
 
-        # if trajectory:
-        #     trajectory = geom.smooth_trajectory(trajectory)
+                    # Cut straight across the grid wherever there's line of sight, leaving fewer turns to make
+                    if trajectory is not None and self.shortcut_trajectories:
+                        trajectory = geom.shortcut_trajectory(self.occupancy_grid, trajectory)
+                    if trajectory is not None and self.trajectory_cache is not None:
+                        self.trajectory_cache.put(self.occupancy_grid, start, goal, trajectory)
 
+        self.prev_trajectory = trajectory
         world_state['trajectory'] = trajectory
-        world_state['grid'] = self.occupancy_grid
+
+        # The wavefront planner's field gives the next waypoint from anywhere, so controls can keep following it from
+        # wherever the robot gets to before the next plan
+        world_state['next_waypoint'] = None
+        if isinstance(self.planner, geom.NavigationFunction) and trajectory is not None and \
+                self.planner.is_current(self.occupancy_grid, goal):
+            world_state['next_waypoint'] = functools.partial(self.planner.next_waypoint, self.occupancy_grid)
+
+    def reuse_trajectory(self, start, goal):
+        """
+        Trims the previous trajectory to start at the current position, as long as it leads to the same goal cell, the
+        robot hasn't strayed from it and it's still collision-free in the current occupancy grid.
+        :param start: Current position
+        :param goal: Goal position
+        :return: The trimmed trajectory, or None if it has to be replanned
+        """
+        if self.prev_trajectory is None:
+            return None
+        goal_node = self.occupancy_grid.get_cell(goal)
+        if goal_node is None or goal_node is not self.occupancy_grid.get_cell(self.prev_trajectory[-1]):
+            return None
+
+        trajectory, deviation = geom.trim_trajectory(self.prev_trajectory, start)
+        if deviation > self.trajectory_reuse_max_deviation:
+            return None
+        trajectory[-1] = goal
+        if not geom.trajectory_is_free(self.occupancy_grid, trajectory):
+            return None
+
+        return trajectory
+
+    def replans_avoided_per_second(self):
+        """
+        Returns how many times motion planning reused the previous trajectory instead of replanning over the last second
+        """
+        self.prune_replans_avoided()
+        return len(self.replans_avoided)
+
+    def prune_replans_avoided(self):
+        """
+        Forgets the reused trajectories from more than a second ago
+        """
+        now = time.time()
+        while len(self.replans_avoided) > 0 and now - self.replans_avoided[0] > 1:
+            self.replans_avoided.popleft()
+
+    def trajectory_cache_stats(self):
+        """
+        Returns how many trajectories were looked up in the trajectory cache and found as tuple(hits, misses)
+        """
+        if self.trajectory_cache is None:
+            return 0, 0
+        return self.trajectory_cache.hits, self.trajectory_cache.misses
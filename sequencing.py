@@ -0,0 +1,135 @@
+#
+# Copyright (c) 2020 FRC Team 3260
+#
+
+import numpy as np
+import geometry as geom
+
+
+class PickupSequencer:
+    """
+    Chooses the order in which to pick up the next few balls before driving to the scoring zone, so that the whole trip
+    is as short as possible rather than just the next leg of it.
+
+    Path costs between balls are computed on the static layer of the occupancy grid, since other robots will have moved
+    by the time we drive those legs. That way they stay valid for as long as the balls stay put, so they are cached and
+    only a ball that just appeared needs a new search. Path costs are the same in both directions, so one search from
+    the new ball fills in its costs to and from every other ball.
+    """
+    def __init__(self, config):
+        """
+        Constructor
+        :param config: Contains the maximum number of balls to consider when ordering pickups
+        """
+        self.max_candidates = config.pickup_sequencing_max_candidates
+        self.static_occupancy = None  # Static layer the cached costs were computed on
+        self.leg_costs = dict()  # Cached path costs between cells as {cell: {other_cell: cost}}
+        self.num_searches = 0  # Number of searches run by the last call to run()
+
+    def run(self, occupancy_grid, robot_costs, balls, num_pickups, scoring_zone):
+        """
+        Returns the order in which to pick up balls that minimizes the total path cost of picking up num_pickups balls
+        (or as many as are reachable) and then driving to the scoring zone. Only the balls that are cheapest to reach
+        from the robot are considered, and the best order among those is found exactly.
+        :param occupancy_grid: Occupancy grid
+        :param robot_costs: Path cost from the robot to each ball, e.g. from geom.dijkstra()
+        :param balls: List of ball positions as list(tuple(x, y), ...)
+        :param num_pickups: Number of balls to pick up before scoring
+        :param scoring_zone: Position to drive to after the last pickup
+        :return: Indices into balls in the order they should be picked up, or an empty list if none are reachable
+        """
+        self.num_searches = 0
+
+        # 1. Keep the reachable balls that are cheapest to get to
+        candidates = [i for i in np.argsort(robot_costs, kind='stable') if robot_costs[i] < np.inf]
+        candidates = [int(i) for i in candidates[:self.max_candidates]]
+        num_pickups = min(num_pickups, len(candidates))
+        if num_pickups <= 0:
+            return []
+
+        # 2. Make sure we know the path costs between every pair of candidates and the scoring zone
+        cells = [occupancy_grid.get_cell(balls[i]).indices for i in candidates]
+        scoring_node = occupancy_grid.get_cell(scoring_zone)
+        scoring_cell = scoring_node.indices if scoring_node is not None else None
+        self.update_leg_costs(occupancy_grid, cells + ([scoring_cell] if scoring_cell is not None else []))
+
+        # 3. Find the cheapest order
+        sequence = self.best_sequence([robot_costs[i] for i in candidates], cells, scoring_cell, num_pickups)
+        return [candidates[i] for i in sequence]
+
+    def update_leg_costs(self, occupancy_grid, cells):
+        """
+        Makes sure the path cost between every pair of the given cells is cached, searching only from cells that aren't
+        cached yet, and forgets about cells that are no longer needed.
+        :param occupancy_grid: Occupancy grid
+        :param cells: List of cell indices as list(tuple(col, row), ...)
+        """
+        # Everything we know is stale if the static obstacles have changed
+        if occupancy_grid.static_occupancy is not self.static_occupancy:
+            self.static_occupancy = occupancy_grid.static_occupancy
+            self.leg_costs = dict()
+
+        unique_cells = list(dict.fromkeys(cells))
+        for cell in list(self.leg_costs):
+            if cell not in unique_cells:
+                del self.leg_costs[cell]
+
+        static_grid = None
+        positions = [occupancy_grid.grid[cell].position for cell in unique_cells]
+        for cell in unique_cells:
+            if cell in self.leg_costs:
+                continue
+            if static_grid is None:
+                static_grid = occupancy_grid.static_layer()
+
+            costs, _ = geom.dijkstra(static_grid, occupancy_grid.grid[cell].position, positions)
+            self.num_searches += 1
+            self.leg_costs[cell] = dict()
+            for other_cell, cost in zip(unique_cells, costs):
+                self.leg_costs[cell][other_cell] = cost
+                if other_cell in self.leg_costs:
+                    self.leg_costs[other_cell][cell] = cost
+
+    def best_sequence(self, robot_costs, cells, scoring_cell, num_pickups):
+        """
+        Finds the cheapest order in which to visit num_pickups of the given cells, starting from the robot and ending at
+        the scoring cell, with dynamic programming over the sets of cells visited so far.
+        :param robot_costs: Path cost from the robot to each cell
+        :param cells: List of cell indices as list(tuple(col, row), ...)
+        :param scoring_cell: Indices of the scoring zone's cell, or None to ignore the final leg
+        :param num_pickups: Number of cells to visit
+        :return: Indices into cells in the order they should be visited
+        """
+        # best[(visited, last)] = (cost, previous state), where visited is a bitmask of visited cells
+        best = {(1 << i, i): (robot_costs[i], None) for i in range(len(cells))}
+        layer = list(best)
+        for _ in range(num_pickups - 1):
+            next_layer = dict()
+            for state in layer:
+                visited, last = state
+                cost = best[state][0]
+                for i in range(len(cells)):
+                    if visited & (1 << i):
+                        continue
+                    next_state = (visited | (1 << i), i)
+                    next_cost = cost + self.leg_costs[cells[last]][cells[i]]
+                    if next_cost < best.get(next_state, (np.inf,))[0]:
+                        best[next_state] = (next_cost, state)
+                        next_layer[next_state] = True
+            layer = list(next_layer) if len(next_layer) > 0 else layer
+
+        # Add on the final leg to the scoring zone. If it can't be reached, just minimize the pickups.
+        def total_cost(state):
+            final_leg = self.leg_costs[cells[state[1]]][scoring_cell] if scoring_cell is not None else 0
+            return best[state][0] + final_leg if final_leg < np.inf else np.inf
+        state = min(layer, key=total_cost)
+        if total_cost(state) == np.inf:
+            state = min(layer, key=lambda s: best[s][0])
+
+        # Walk backwards to recover the order
+        sequence = []
+        while state is not None:
+            sequence.append(state[1])
+            state = best[state][1]
+        sequence.reverse()
+        return sequence
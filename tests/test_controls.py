@@ -3,8 +3,10 @@
 #
 
 import unittest
+from threading import Lock
 from unittest.mock import Mock
-from controls import Controls, PID
+from controls import ControlThread, Controls, DynamicWindowController, PID, PurePursuit, propagate_pose
+from geometry import OccupancyGrid
 import numpy as np
 
 
@@ -36,6 +38,7 @@ class TestControls(unittest.TestCase):
         config.max_intake_speed = 512
         config.max_outtake_speed = 512
         config.blue_player_station_pos = np.array([10, 10])
+        config.drive_controller = 'pid'
 
         self.controls = Controls(config)
 
@@ -147,3 +150,273 @@ class TestControls(unittest.TestCase):
         self.assertEqual(self.vehicle_commands['intakeLeftMotorSpeed'], 0)
         self.assertEqual(self.vehicle_commands['intakeRightMotorSpeed'], 0)
         self.assertEqual(self.vehicle_commands['tubeMotorSpeed'], self.controls.max_outtake_speed)
+
+
+class TestDynamicWindowController(unittest.TestCase):
+    def setUp(self):
+        self.config = Mock()
+        self.config.max_forward_speed = 100
+        self.config.dwa_max_speed_change = 40
+        self.config.dwa_num_samples = 256
+        self.config.dwa_horizon = 0.5
+        self.config.dwa_time_step = 0.05
+        self.config.drive_wheel_speed_per_unit = 0.01
+        self.config.drive_track_width = 0.6
+        self.config.dwa_path_weight = 1
+        self.config.dwa_clearance_weight = 0.5
+        self.config.dwa_progress_weight = 2
+        self.controller = DynamicWindowController(self.config, seed=3260)
+        self.pose = ((0, 0), 0)
+
+    def drive(self, trajectory, direction, num_steps):
+        """
+        Follows the trajectory with the controller's own model for the given number of control periods
+        """
+        pose = self.pose
+        for _ in range(num_steps):
+            command = np.array([self.controller.run(pose, trajectory, direction)], dtype=float)
+            position = self.controller.rollout(pose, command)[0, 0]
+            turn_rate = (command[0, 1] - command[0, 0]) * self.config.drive_wheel_speed_per_unit / \
+                self.config.drive_track_width
+            pose = (tuple(position), pose[1] + turn_rate * self.config.dwa_time_step)
+        return pose
+
+    def test_rollout_of_equal_wheel_speeds_drives_straight(self):
+        positions = self.controller.rollout(self.pose, np.array([[100, 100]]))
+        np.testing.assert_allclose((0.5, 0), positions[0, -1], atol=1e-9)
+
+    def test_commands_stay_within_dynamic_window(self):
+        left, right = self.controller.run(self.pose, [(0, 0), (2.5, 0)], direction=1)
+
+        self.assertTrue(0 < left <= 40)
+        self.assertTrue(0 < right <= 40)
+
+    def test_turns_left_towards_trajectory_on_the_left(self):
+        self.drive([(0, 0), (0, 2.5)], direction=1, num_steps=3)
+        left, right = self.controller.prev_command
+        self.assertGreater(right, left)
+
+    def test_reaches_end_of_trajectory_forwards(self):
+        (x, y), _ = self.drive([(0, 0), (2, 0), (2, 2)], direction=1, num_steps=100)
+        self.assertLess(np.hypot(x - 2, y - 2), 0.2)
+
+    def test_reaches_end_of_trajectory_backwards(self):
+        (x, y), _ = self.drive([(0, 0), (-2, 0)], direction=-1, num_steps=60)
+        self.assertLess(np.hypot(x + 2, y), 0.2)
+        self.assertTrue(np.all(self.controller.prev_command <= 0))
+
+
+    def test_window_restarts_from_standstill_after_stop(self):
+        self.config.drive_kp = 40
+        self.config.drive_ki = 1
+        self.config.drive_kd = 1
+        self.config.heading_error_threshold = 0.2
+        self.config.max_intake_speed = 512
+        self.config.max_outtake_speed = 512
+        self.config.drive_controller = 'dwa'
+        controls = Controls(self.config)
+        plan_state = {'pose': self.pose, 'trajectory': [(0, 0), (2.5, 0)], 'direction': 1, 'tube_mode': 'INTAKE'}
+        for _ in range(5):
+            controls.run(plan_state)
+
+        controls.run(dict(plan_state, direction=0))
+        vehicle_commands = controls.run(plan_state)
+
+        self.assertTrue(0 < vehicle_commands['leftDriveMotorSpeed'] <= 40)
+        self.assertTrue(0 < vehicle_commands['rightDriveMotorSpeed'] <= 40)
+
+
+class TestPurePursuit(unittest.TestCase):
+    def setUp(self):
+        self.config = Mock()
+        self.config.max_forward_speed = 100
+        self.config.pure_pursuit_lookahead = 0.5
+        self.config.pure_pursuit_slowdown_distance = 0.2
+        self.config.drive_track_width = 0.6
+        self.pure_pursuit = PurePursuit(self.config)
+        self.pose = ((0, 0), 0)
+
+    def drive(self, trajectory, direction, num_steps):
+        """
+        Follows the trajectory with a differential drive model for the given number of control periods
+        """
+        (x, y), theta = self.pose
+        for _ in range(num_steps):
+            left, right = self.pure_pursuit.run(((x, y), theta), trajectory, direction)
+            speed = 0.01 * (left + right) / 2
+            x += speed * np.cos(theta) * 0.05
+            y += speed * np.sin(theta) * 0.05
+            theta += 0.01 * (right - left) / self.config.drive_track_width * 0.05
+        return (x, y), theta
+
+    def test_point_at_interpolates_by_arc_length(self):
+        self.pure_pursuit.set_trajectory([(0, 0), (2, 0), (2, 2)])
+
+        np.testing.assert_allclose((1.5, 0), self.pure_pursuit.point_at(1.5))
+        np.testing.assert_allclose((2, 0.5), self.pure_pursuit.point_at(2.5))
+        np.testing.assert_allclose((2, 2), self.pure_pursuit.point_at(10))
+
+    def test_arc_lengths_are_only_computed_for_new_trajectories(self):
+        trajectory = [(0, 0), (2, 0)]
+        self.pure_pursuit.run(self.pose, trajectory, direction=1)
+        arc_lengths = self.pure_pursuit.arc_lengths
+        self.pure_pursuit.run(((0.5, 0), 0), trajectory, direction=1)
+
+        self.assertIs(arc_lengths, self.pure_pursuit.arc_lengths)
+        self.assertAlmostEqual(0.5, self.pure_pursuit.progress)
+
+    def test_drives_straight_at_full_speed(self):
+        result = self.pure_pursuit.run(self.pose, [(0, 0), (2.5, 0)], direction=1)
+        self.assertEqual((100, 100), result)
+
+    def test_curves_towards_trajectory_on_the_left_within_speed_limit(self):
+        left, right = self.pure_pursuit.run(self.pose, [(0, 0), (0.4, 0), (0.4, 2)], direction=1)
+
+        self.assertEqual(100, right)
+        self.assertTrue(0 < left < right)
+
+    def test_turns_in_place_when_trajectory_is_behind(self):
+        left, right = self.pure_pursuit.run(self.pose, [(0, 0), (0, -0.1), (-2, -0.1)], direction=1)
+
+        self.assertGreater(left, 0)
+        self.assertEqual(-left, right)
+
+    def test_reaches_end_of_trajectory_forwards(self):
+        (x, y), _ = self.drive([(0, 0), (2, 0), (2, 2)], direction=1, num_steps=200)
+        self.assertLess(np.hypot(x - 2, y - 2), 0.05)
+
+    def test_reaches_end_of_trajectory_backwards(self):
+        (x, y), theta = self.drive([(0, 0), (-2, 0), (-2, -2)], direction=-1, num_steps=200)
+
+        self.assertLess(np.hypot(x + 2, y + 2), 0.05)
+        self.assertAlmostEqual(np.pi / 2, theta % (2 * np.pi), delta=0.1)
+
+
+class TestControlThread(unittest.TestCase):
+    def setUp(self):
+        self.config = Mock()
+        self.config.drive_kp = 40
+        self.config.drive_ki = 1
+        self.config.drive_kd = 1
+        self.config.heading_error_threshold = 0.2
+        self.config.max_forward_speed = 100
+        self.config.max_intake_speed = 512
+        self.config.max_outtake_speed = 512
+        self.config.drive_controller = 'pid'
+        self.config.control_rate = 50
+        self.config.drive_wheel_speed_per_unit = 0.01
+        self.config.drive_track_width = 0.6
+
+        self.comms = Mock()
+        self.comms.vehicle_commands = {'draw': ['circle']}
+        self.control_thread = ControlThread(Controls(self.config), self.config, self.comms, Lock())
+
+        self.plan_state = {
+            'pose': ((0, 0), 0),
+            'trajectory': [(0, 0), (2.5, 0)],
+            'direction': 1,
+            'tube_mode': 'INTAKE',
+        }
+
+    def test_propagate_pose_drives_along_arc(self):
+        (x, y), theta = propagate_pose(((0, 0), 0), left_speed=0, right_speed=np.pi / 2, track_width=0.5,
+                                       duration=1)
+
+        np.testing.assert_allclose((0, 0.5), (x, y), atol=1e-9)
+        self.assertAlmostEqual(np.pi, theta)
+
+    def test_step_sends_commands_without_touching_drawing(self):
+        self.control_thread.set_plan(self.plan_state, plan_time=0)
+        self.control_thread.step(now=0)
+
+        self.assertEqual(100, self.comms.vehicle_commands['leftDriveMotorSpeed'])
+        self.assertEqual(100, self.comms.vehicle_commands['rightDriveMotorSpeed'])
+        self.assertEqual(['circle'], self.comms.vehicle_commands['draw'])
+
+    def test_step_times_pids_with_given_time(self):
+        self.control_thread.set_plan(dict(self.plan_state, trajectory=[(0, 0), (0, 2.5)]), plan_time=0)
+        self.control_thread.step(now=7)
+
+        self.assertEqual(7, self.control_thread.controls.left_drive_pid.prev_timestamp)
+
+    def test_pose_is_propagated_with_commands_sent_since_plan(self):
+        self.control_thread.set_plan(self.plan_state, plan_time=0)
+        self.control_thread.step(now=0)
+        self.control_thread.step(now=0.5)
+
+        with self.control_thread.mutex:
+            (x, y), _ = self.control_thread.predict_pose(now=1)
+        np.testing.assert_allclose((1, 0), (x, y))
+
+    def test_new_plan_drops_commands_from_before_its_pose(self):
+        self.control_thread.set_plan(self.plan_state, plan_time=0)
+        for now in [0, 0.5, 1]:
+            self.control_thread.step(now)
+        self.control_thread.set_plan(dict(self.plan_state, pose=((0.5, 0), 0)), plan_time=0.6)
+
+        self.assertEqual([0.5, 1], [command[0] for command in self.control_thread.commands])
+        with self.control_thread.mutex:
+            (x, y), _ = self.control_thread.predict_pose(now=1.1)
+        np.testing.assert_allclose((1, 0), (x, y))
+
+    def test_commands_stay_bounded_while_planning_stalls(self):
+        self.control_thread.set_plan(self.plan_state, plan_time=0)
+        for i in range(200):
+            self.control_thread.step(now=i * 0.02)
+
+        self.assertEqual(50, len(self.control_thread.commands))
+        with self.control_thread.mutex:
+            (x, y), _ = self.control_thread.predict_pose(now=4)
+        np.testing.assert_allclose((4, 0), (x, y))
+
+    def test_late_loops_count_as_missed_deadlines(self):
+        deadline = self.control_thread.record_loop(now=0, deadline=0)
+        deadline = self.control_thread.record_loop(now=0.025, deadline=deadline)
+        deadline = self.control_thread.record_loop(now=0.1, deadline=deadline)
+
+        self.assertAlmostEqual(0.12, deadline)
+        metrics = self.control_thread.metrics()
+        self.assertEqual(3, metrics['rate'])
+        self.assertAlmostEqual(0.06, metrics['max_jitter'])
+        self.assertEqual(1, metrics['missed_deadlines'])
+
+    def test_thread_runs_at_fixed_rate(self):
+        clock = [0.0]
+
+        def sleep(duration):
+            clock[0] += duration
+            if clock[0] >= 0.2 - 1e-9:
+                self.control_thread.stop()
+
+        self.control_thread = ControlThread(Controls(self.config), self.config, self.comms, Lock(),
+                                            clock=lambda: clock[0], sleep=sleep)
+        self.control_thread.set_plan(self.plan_state, plan_time=0)
+        self.control_thread.run()
+
+        metrics = self.control_thread.metrics()
+        self.assertEqual(10, metrics['rate'])
+        self.assertEqual(0, metrics['missed_deadlines'])
+        self.assertEqual(100, self.comms.vehicle_commands['leftDriveMotorSpeed'])
+
+    def test_step_follows_next_waypoint_of_navigation_function(self):
+        controls = Mock()
+        controls.run.return_value = {'leftDriveMotorSpeed': 0, 'rightDriveMotorSpeed': 0, 'draw': []}
+        self.control_thread = ControlThread(controls, self.config, self.comms, Lock())
+        plan_state = dict(self.plan_state, pose=((0, 1), 0), trajectory=[(0, 0), (1, 0), (2.5, 0)],
+                          next_waypoint=lambda position: (1, 0))
+        self.control_thread.set_plan(plan_state, plan_time=0)
+        self.control_thread.step(now=0)
+
+        expected = [(0, 1), (1, 0), (2.5, 0)]
+        actual = controls.run.call_args[0][0]['trajectory']
+        self.assertEqual(expected, actual)
+
+    def test_plan_grid_is_snapshot(self):
+        occupancy_grid = OccupancyGrid(width=4, height=4, cell_resolution=1, origin=(0, 0))
+        self.control_thread.set_plan(dict(self.plan_state, grid=occupancy_grid), plan_time=0)
+        occupancy_grid.occupancy[0, 0] = 1
+        occupancy_grid.set_dynamic_obstacles([((1, 1), (1, 1))], kernel_size=1)
+
+        snapshot = self.control_thread.plan_state['grid']
+        self.assertEqual(0, snapshot.occupancy.sum())
+        self.assertEqual(0, len(snapshot.dynamic_boxes))
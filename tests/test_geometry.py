@@ -3,6 +3,8 @@
 #
 
 import numpy as np
+import os
+import tempfile
 import unittest
 from tests.test_utils import *
 import geometry as geom
@@ -118,6 +120,53 @@ class TestGridClass(unittest.TestCase):
         actual = self.occupancy_grid.occupancy.flatten(order='F')
         np.testing.assert_array_equal(expected, actual)
 
+    def test_insert_convex_polygon_with_thin_obstacle(self):
+        wall = Polygon([[0.4, -1.5], [0.45, -1.5], [0.45, 1.5], [0.4, 1.5]])
+
+        self.occupancy_grid.insert_convex_polygon(wall)
+
+        expected = np.zeros((4, 4))
+        expected[2, :] = 1
+        actual = self.occupancy_grid.occupancy
+        np.testing.assert_array_equal(expected, actual)
+
+    def test_insert_rectangular_obstacle_partially_off_grid(self):
+        rect = ((-3, -3), (-1.5, 1.5))
+
+        self.occupancy_grid.insert_rectangular_obstacle(rect)
+
+        expected = np.zeros((4, 4))
+        expected[0, :] = 1
+        actual = self.occupancy_grid.occupancy
+        np.testing.assert_array_equal(expected, actual)
+
+    def test_insert_obstacles_inserts_polygons_and_rectangles(self):
+        square = Polygon(make_square_vertices(side_length=0.5, center=(1.25, 1.25)))
+        rect = ((-2, -2), (-1.5, -1.5))
+
+        self.occupancy_grid.insert_obstacles([square, rect])
+
+        expected = [1] + [0] * 14 + [1]
+        actual = self.occupancy_grid.occupancy.flatten(order='F')
+        np.testing.assert_array_equal(expected, actual)
+
+    def test_clearance_cost_falls_off_with_distance_from_obstacles(self):
+        self.occupancy_grid.set_clearance_cost(radius=2, weight=1)
+        self.occupancy_grid.set_dynamic_obstacles([((-2, -2), (-1.5, -1.5))], kernel_size=1)
+
+        expected_clearance = np.array([[0, 1, 2, 3],
+                                       [1, np.sqrt(2), np.sqrt(5), np.sqrt(10)],
+                                       [2, np.sqrt(5), np.sqrt(8), np.sqrt(13)],
+                                       [3, np.sqrt(10), np.sqrt(13), np.sqrt(18)]])
+        expected_cost = np.clip(1 - expected_clearance / 2, 0, 1)
+        np.testing.assert_allclose(expected_clearance, self.occupancy_grid.clearance, atol=1e-3)
+        np.testing.assert_allclose(expected_cost, self.occupancy_grid.clearance_cost, atol=1e-3)
+
+    def test_clearance_cost_is_zero_when_disabled(self):
+        self.occupancy_grid.set_dynamic_obstacles([((-2, -2), (-1.5, -1.5))], kernel_size=1)
+
+        np.testing.assert_array_equal(np.zeros((4, 4)), self.occupancy_grid.clearance_cost)
+
     def test_dilation_of_empty_grid(self):
         self.occupancy_grid.dilate(kernel_size=3)
 
@@ -138,6 +187,61 @@ class TestGridClass(unittest.TestCase):
     def test_dilation_with_odd_kernel_throws(self):
         self.assertRaises(ValueError, self.occupancy_grid.dilate, kernel_size=6)
 
+    def test_static_and_dynamic_layers_match_dilating_everything_together(self):
+        square = Polygon(make_square_vertices(side_length=0.5, center=(1.25, 1.25)))
+        rect = ((-2, -2), (-1.5, -1.5))
+
+        self.occupancy_grid.set_static_obstacles([square], kernel_size=3)
+        self.occupancy_grid.set_dynamic_obstacles([rect], kernel_size=3)
+
+        expected_grid = OccupancyGrid(self.width, self.height, self.cell_resolution, self.origin)
+        expected_grid.insert_convex_polygon(square)
+        expected_grid.insert_rectangular_obstacle(rect)
+        expected_grid.dilate(kernel_size=3)
+        np.testing.assert_array_equal(expected_grid.occupancy, self.occupancy_grid.occupancy)
+
+    def test_set_dynamic_obstacles_keeps_static_layer(self):
+        square = Polygon(make_square_vertices(side_length=0.5, center=(1.25, 1.25)))
+        self.occupancy_grid.set_static_obstacles([square], kernel_size=1)
+
+        self.occupancy_grid.set_dynamic_obstacles([((-2, -2), (-1.5, -1.5))], kernel_size=1)
+        self.occupancy_grid.set_dynamic_obstacles([], kernel_size=1)
+
+        expected = [0] * 15 + [1]
+        actual = self.occupancy_grid.occupancy.flatten(order='F')
+        np.testing.assert_array_equal(expected, actual)
+
+    def test_set_dynamic_obstacles_keeps_obstacles_as_boxes(self):
+        self.occupancy_grid.set_dynamic_obstacles([((-2, -2), (-1.5, -1.5))], kernel_size=1)
+
+        np.testing.assert_array_equal([(-2, -2, -1.5, -1.5)], self.occupancy_grid.dynamic_boxes)
+        self.assertEqual(0, len(self.occupancy_grid.static_layer().dynamic_boxes))
+
+    def test_set_dynamic_obstacles_with_even_kernel_throws(self):
+        self.assertRaises(ValueError, self.occupancy_grid.set_dynamic_obstacles, [], kernel_size=6)
+
+    def test_reachable_only_includes_goals_on_the_same_side_of_wall(self):
+        self.occupancy_grid.set_dynamic_obstacles([((0.5, -2), (0.5, 1.5))], kernel_size=1)
+        goals = [(-0.5, 1.5), (1.5, 1.5), (0.5, 0.5), (5, 5)]
+
+        result = self.occupancy_grid.reachable((-1.5, -1.5), goals)
+        self.assertEqual([True, False, False, False], result.tolist())
+
+    def test_reachable_is_false_from_occupied_start(self):
+        self.occupancy_grid.set_dynamic_obstacles([((0.5, -2), (0.5, 1.5))], kernel_size=1)
+
+        result = self.occupancy_grid.reachable((0.5, -1.5), [(-1.5, 1.5), (1.5, 1.5)])
+        self.assertEqual([False, False], result.tolist())
+
+    def test_component_labels_are_reused_until_grid_changes(self):
+        self.occupancy_grid.set_dynamic_obstacles([((0.5, -2), (0.5, 1.5))], kernel_size=1)
+        labels = self.occupancy_grid.component_labels()
+        self.occupancy_grid.set_dynamic_obstacles([((0.5, -2), (0.5, 1.5))], kernel_size=1)
+        self.assertIs(labels, self.occupancy_grid.component_labels())
+
+        self.occupancy_grid.set_dynamic_obstacles([], kernel_size=1)
+        self.assertEqual(1, self.occupancy_grid.component_labels().max())
+
 
 class TestCounterclockwise(unittest.TestCase):
     def setUp(self):
@@ -288,6 +392,40 @@ class TestPolygon(unittest.TestCase):
         np.testing.assert_array_equal(expected, actual)
 
 
+class TestSpatialHash(unittest.TestCase):
+    def setUp(self):
+        self.balls = [((0, 0), 0.1), ((0.6, 0), 0.1), ((0, -1.2), 0.2), ((3, 3), 0.1)]
+        self.spatial_hash = geom.SpatialHash.from_circles(self.balls, cell_size=0.5)
+
+    def test_query_radius_returns_objects_within_radius_sorted_by_distance(self):
+        result = self.spatial_hash.query_radius((0.1, 0), radius=1.3)
+        self.assertEqual([0, 1, 2], result.tolist())
+
+    def test_query_annulus_excludes_inner_radius(self):
+        result = self.spatial_hash.query_annulus((0, 0), min_radius=0.5, max_radius=1.2)
+        self.assertEqual([1, 2], result.tolist())
+
+    def test_query_radius_spanning_more_cells_than_buckets_matches_small_query(self):
+        result = self.spatial_hash.query_radius((0, 0), radius=100)
+        self.assertEqual([0, 1, 2, 3], result.tolist())
+
+    def test_nearest_returns_k_closest_objects(self):
+        self.assertEqual([3, 1], self.spatial_hash.nearest((2, 2), k=2).tolist())
+        self.assertEqual([3, 1, 0, 2], self.spatial_hash.nearest((2, 2), k=10).tolist())
+
+    def test_insert_adds_objects_without_rebuilding(self):
+        indices = self.spatial_hash.insert([(3.1, 3)], [0.1])
+
+        self.assertEqual([4], indices.tolist())
+        self.assertEqual([3, 4], self.spatial_hash.query_radius((3, 3), radius=0.2).tolist())
+        self.assertEqual(self.balls + [((3.1, 3.0), 0.1)], self.spatial_hash.circles())
+
+    def test_empty_spatial_hash(self):
+        spatial_hash = geom.SpatialHash.from_circles([])
+        self.assertEqual([], spatial_hash.query_radius((0, 0), radius=1).tolist())
+        self.assertEqual([], spatial_hash.nearest((0, 0), k=3).tolist())
+
+
 class TestConnectedComponents(unittest.TestCase):
     def test_empty_buckets_result_in_one_empty_cc(self):
         buckets = {
@@ -356,6 +494,631 @@ class TestAStar(unittest.TestCase):
         result = geom.a_star(self.occupancy_grid, self.start, self.goal)
         self.assertIsNone(result)
 
+    def test_a_star_finds_shortest_path_around_wall(self):
+        self.occupancy_grid.occupancy[2, 0:3] = 1
+        goal = (1.5, -1.5)
+        result = geom.a_star(self.occupancy_grid, self.start, goal)
+
+        expected = 3 + 3 * np.sqrt(2)
+        actual = trajectory_length(result)
+        self.assertAlmostEqual(expected, actual)
+
+    def test_a_star_can_be_rerun_on_same_grid(self):
+        first = geom.a_star(self.occupancy_grid, self.start, self.goal)
+        second = geom.a_star(self.occupancy_grid, self.start, self.goal)
+
+        self.assertEqual(first, second)
+
+    def test_a_star_fails_when_goal_off_grid(self):
+        result = geom.a_star(self.occupancy_grid, self.start, (10, 10))
+        self.assertIsNone(result)
+
+
+class TestDijkstra(unittest.TestCase):
+    def setUp(self):
+        self.occupancy_grid = OccupancyGrid(width=4, height=4, cell_resolution=1, origin=(0,0))
+        self.start = (-1.5, -1.5)
+
+    def test_dijkstra_costs_match_a_star_path_lengths(self):
+        self.occupancy_grid.occupancy[2, 0:3] = 1
+        goals = [(1.5, -1.5), (1.5, 1.5), (-1.5, 0.5)]
+
+        costs, parents = geom.dijkstra(self.occupancy_grid, self.start, goals)
+
+        for goal, cost in zip(goals, costs):
+            self.assertAlmostEqual(trajectory_length(geom.a_star(self.occupancy_grid, self.start, goal)), cost)
+            self.assertAlmostEqual(cost, trajectory_length(
+                geom.trajectory_from_parents(self.occupancy_grid, parents, self.start, goal)))
+
+    def test_dijkstra_cost_is_infinite_for_unreachable_goals(self):
+        self.occupancy_grid.occupancy[2,3] = 1
+        self.occupancy_grid.occupancy[2,2] = 1
+        self.occupancy_grid.occupancy[3,2] = 1
+        goals = [(1.5, 1.5), (2.5, 2.5), (-1.5, 0.5)]
+
+        costs, _ = geom.dijkstra(self.occupancy_grid, self.start, goals)
+
+        expected = [np.inf, np.inf, 2]
+        actual = costs
+        self.assertEqual(expected, actual)
+
+    def test_dijkstra_stops_after_max_goals(self):
+        goals = [(1.5, 1.5), (-0.5, -1.5), (1.5, -1.5), (-1.5, -0.5)]
+
+        costs, parents = geom.dijkstra(self.occupancy_grid, self.start, goals, max_goals=2)
+
+        expected = [np.inf, 1, np.inf, 1]
+        actual = costs
+        self.assertEqual(expected, actual)
+        self.assertEqual([self.start, (-0.5, -1.5)],
+                         geom.trajectory_from_parents(self.occupancy_grid, parents, self.start, (-0.5, -1.5)))
+
+    def test_dijkstra_stops_when_out_of_expansions(self):
+        goals = [(-0.5, -1.5), (1.5, 1.5)]
+
+        costs, _ = geom.dijkstra(self.occupancy_grid, self.start, goals, max_expansions=4)
+
+        expected = [1, np.inf]
+        actual = costs
+        self.assertEqual(expected, actual)
+
+    def test_dijkstra_with_goal_at_start(self):
+        costs, parents = geom.dijkstra(self.occupancy_grid, self.start, [(-1.4, -1.4)])
+
+        self.assertEqual([0], costs)
+        self.assertEqual([self.start, (-1.4, -1.4)],
+                         geom.trajectory_from_parents(self.occupancy_grid, parents, self.start, (-1.4, -1.4)))
+
+
+class TestJumpPointSearch(unittest.TestCase):
+    def setUp(self):
+        self.occupancy_grid = OccupancyGrid(width=8, height=8, cell_resolution=0.5, origin=(0,0))
+        self.start = (-3.75, -3.75)
+        self.goal = (3.75, 3.75)
+
+    def test_jps_fails_when_start_occluded(self):
+        start_node = self.occupancy_grid.get_cell(self.start)
+        self.occupancy_grid.occupancy[start_node.indices] = 1
+        result = geom.jump_point_search(self.occupancy_grid, self.start, self.goal)
+        self.assertIsNone(result)
+
+    def test_jps_fails_when_goal_unreachable(self):
+        self.occupancy_grid.occupancy[13:16, 13] = 1
+        self.occupancy_grid.occupancy[13, 13:16] = 1
+        result = geom.jump_point_search(self.occupancy_grid, self.start, self.goal)
+        self.assertIsNone(result)
+
+    def test_jps_returns_every_cell_along_the_path(self):
+        result = geom.jump_point_search(self.occupancy_grid, self.start, self.goal)
+
+        expected = geom.a_star(self.occupancy_grid, self.start, self.goal)
+        actual = result
+        self.assertEqual(expected, actual)
+
+    def test_jps_path_lengths_match_a_star_on_random_grids(self):
+        rng = np.random.default_rng(3260)
+        for _ in range(50):
+            self.occupancy_grid.occupancy[:] = rng.random(self.occupancy_grid.occupancy.shape) < 0.3
+            self.occupancy_grid.occupancy[0, 0] = 0
+            self.occupancy_grid.occupancy[-1, -1] = 0
+
+            a_star_result = geom.a_star(self.occupancy_grid, self.start, self.goal)
+            jps_result = geom.jump_point_search(self.occupancy_grid, self.start, self.goal)
+
+            if a_star_result is None:
+                self.assertIsNone(jps_result)
+            else:
+                self.assertAlmostEqual(trajectory_length(a_star_result), trajectory_length(jps_result))
+
+
+class TestAnytimeAStar(unittest.TestCase):
+    def setUp(self):
+        self.occupancy_grid = OccupancyGrid(width=6, height=6, cell_resolution=1, origin=(0,0))
+        self.occupancy_grid.occupancy[2, 0:5] = 1
+        self.start = (-2.5, -2.5)
+        self.goal = (2.5, -2.5)
+
+    def test_anytime_a_star_without_budget_matches_a_star_path_length(self):
+        planner = geom.AnytimeAStar()
+
+        expected = trajectory_length(geom.a_star(self.occupancy_grid, self.start, self.goal))
+        actual = trajectory_length(planner.plan(self.occupancy_grid, self.start, self.goal))
+        self.assertAlmostEqual(expected, actual)
+
+    def test_anytime_a_star_returns_partial_path_when_budget_runs_out(self):
+        planner = geom.AnytimeAStar(max_expansions=5)
+        result = planner.plan(self.occupancy_grid, self.start, self.goal)
+
+        self.assertEqual(5, planner.num_expansions)
+        self.assertEqual(self.start, result[0])
+        self.assertNotEqual(self.goal, result[-1])
+        self.assertTrue(geom.trajectory_is_free(self.occupancy_grid, result))
+
+    def test_anytime_a_star_resumes_search_on_next_call(self):
+        planner = geom.AnytimeAStar(max_expansions=5)
+        result = planner.plan(self.occupancy_grid, self.start, self.goal)
+        num_calls = 1
+        while result[-1] != self.goal:
+            result = planner.plan(self.occupancy_grid, self.start, self.goal)
+            num_calls += 1
+
+        expected = trajectory_length(geom.a_star(self.occupancy_grid, self.start, self.goal))
+        self.assertAlmostEqual(expected, trajectory_length(result))
+        self.assertGreater(num_calls, 1)
+
+    def test_anytime_a_star_goes_to_closest_cell_when_goal_unreachable(self):
+        self.occupancy_grid.occupancy[2, 5] = 1
+        planner = geom.AnytimeAStar()
+
+        expected = [(-2.5, -2.5), (-1.5, -2.5)]
+        actual = planner.plan(self.occupancy_grid, self.start, self.goal)
+        self.assertEqual(expected, actual)
+
+    def test_anytime_a_star_starts_over_when_grid_changes(self):
+        planner = geom.AnytimeAStar()
+        planner.plan(self.occupancy_grid, self.start, self.goal)
+
+        self.occupancy_grid.occupancy[3, 5] = 1
+        result = planner.plan(self.occupancy_grid, self.start, self.goal)
+
+        expected = trajectory_length(geom.a_star(self.occupancy_grid, self.start, self.goal))
+        self.assertAlmostEqual(expected, trajectory_length(result))
+        self.assertTrue(geom.trajectory_is_free(self.occupancy_grid, result))
+
+
+class TestLatticePlanner(unittest.TestCase):
+    def setUp(self):
+        self.occupancy_grid = OccupancyGrid(width=10, height=10, cell_resolution=1, origin=(0,0))
+        self.start = (-3.5, -3.5)
+        self.goal = (3.5, -3.5)
+        self.lattice_planner = geom.LatticePlanner()
+
+    def test_motion_primitives_sweep_through_connected_cells_to_their_end(self):
+        for primitives in self.lattice_planner.primitives:
+            for primitive in primitives:
+                if primitive.length == 0:
+                    continue
+                cells = np.concatenate([[(0, 0)], primitive.footprint])
+                self.assertEqual(primitive.end, tuple(cells[-1]))
+                self.assertTrue(np.all(np.max(np.abs(np.diff(cells, axis=0)), axis=1) == 1))
+
+    def test_lattice_planner_starts_out_along_robot_heading(self):
+        # Turning in place is more expensive than driving a few cells on this coarse grid
+        occupancy_grid = OccupancyGrid(width=20, height=20, cell_resolution=1, origin=(0,0))
+        lattice_planner = geom.LatticePlanner(turn_cost=10)
+        result = lattice_planner.plan(occupancy_grid, (-5.5, -5.5), (0.5, 8.5), heading=np.pi / 2)
+
+        self.assertEqual((-5.5, -5.5), result[0])
+        self.assertEqual((0.5, 8.5), result[-1])
+        first_step = np.subtract(result[1], result[0])
+        self.assertGreater(first_step[1], abs(first_step[0]))
+
+    def test_lattice_planner_avoids_obstacles(self):
+        self.occupancy_grid.occupancy[4:6, 0:8] = 1
+        result = self.lattice_planner.plan(self.occupancy_grid, self.start, self.goal, heading=0)
+
+        self.assertEqual(self.goal, result[-1])
+        self.assertTrue(geom.trajectory_is_free(self.occupancy_grid, result))
+        self.assertGreater(trajectory_length(result), trajectory_length(geom.a_star(self.occupancy_grid, self.start,
+                                                                                    self.goal)) - 1)
+
+    def test_lattice_planner_fails_when_goal_unreachable(self):
+        self.occupancy_grid.occupancy[4:6, :] = 1
+        result = self.lattice_planner.plan(self.occupancy_grid, self.start, self.goal)
+        self.assertIsNone(result)
+
+
+class TestGridPyramid(unittest.TestCase):
+    def test_levels_are_max_pooled(self):
+        layer = np.zeros((5, 4), dtype=np.uint8)
+        layer[4, 0] = 1
+        pyramid = geom.GridPyramid(num_levels=2)
+        pyramid.update(layer)
+
+        np.testing.assert_array_equal([[0, 0], [0, 0], [1, 0]], pyramid.levels[1])
+        np.testing.assert_array_equal([[0], [1]], pyramid.levels[2])
+
+    def test_update_matches_rebuilding_after_cells_change(self):
+        rng = np.random.default_rng(0)
+        layer = (rng.random((9, 14)) < 0.2).astype(np.uint8)
+        pyramid = geom.GridPyramid(num_levels=3)
+        pyramid.update(layer)
+
+        for _ in range(20):
+            layer[rng.integers(9), rng.integers(14)] ^= 1
+            self.assertTrue(pyramid.update(layer))
+            expected = geom.GridPyramid(num_levels=3)
+            expected.update(layer)
+            for expected_level, actual_level in zip(expected.levels, pyramid.levels):
+                np.testing.assert_array_equal(expected_level, actual_level)
+        self.assertFalse(pyramid.update(layer))
+
+
+class TestHierarchicalPlanner(unittest.TestCase):
+    def setUp(self):
+        self.occupancy_grid = OccupancyGrid(width=16, height=16, cell_resolution=1, origin=(0,0))
+        self.start = (-7.5, -7.5)
+        self.goal = (7.5, -7.5)
+        self.hierarchical_planner = geom.HierarchicalPlanner(num_levels=2)
+
+    def test_hierarchical_planner_matches_a_star_path_length_around_wall(self):
+        self.occupancy_grid.occupancy[7:9, 0:12] = 1
+        result = self.hierarchical_planner.plan(self.occupancy_grid, self.start, self.goal)
+
+        expected = trajectory_length(geom.a_star(self.occupancy_grid, self.start, self.goal))
+        self.assertAlmostEqual(expected, trajectory_length(result))
+        self.assertTrue(geom.trajectory_is_free(self.occupancy_grid, result))
+
+    def test_hierarchical_planner_finds_gap_closed_off_on_coarse_levels(self):
+        self.occupancy_grid.occupancy[7, :] = 1
+        self.occupancy_grid.occupancy[7, 9] = 0
+        result = self.hierarchical_planner.plan(self.occupancy_grid, self.start, self.goal)
+
+        expected = trajectory_length(geom.a_star(self.occupancy_grid, self.start, self.goal))
+        self.assertAlmostEqual(expected, trajectory_length(result))
+
+    def test_hierarchical_planner_can_return_longer_path_than_a_star(self):
+        occupancy_grid = OccupancyGrid(width=8, height=8, cell_resolution=1, origin=(0,0))
+        occupancy_grid.occupancy[3, 4] = 1
+        occupancy_grid.occupancy[4, 4] = 1
+        occupancy_grid.occupancy[5, 2] = 1
+        start = (-3.5, -3.5)
+        goal = (3.5, 3.5)
+        hierarchical_planner = geom.HierarchicalPlanner(num_levels=1)
+
+        # Pooling blocks the coarse cells the shortest path cuts through, so the corridor leads around them
+        result = hierarchical_planner.plan(occupancy_grid, start, goal)
+        self.assertAlmostEqual(4 + 5 * np.sqrt(2), trajectory_length(result))
+        expected = trajectory_length(geom.a_star(occupancy_grid, start, goal))
+        self.assertAlmostEqual(2 + 6 * np.sqrt(2), expected)
+
+    def test_hierarchical_planner_fails_when_goal_unreachable(self):
+        self.occupancy_grid.occupancy[7, :] = 1
+        result = self.hierarchical_planner.plan(self.occupancy_grid, self.start, self.goal)
+        self.assertIsNone(result)
+
+
+class TestVisibilityGraph(unittest.TestCase):
+    def setUp(self):
+        self.occupancy_grid = OccupancyGrid(width=8, height=8, cell_resolution=0.5, origin=(0,0))
+        self.square = Polygon(make_square_vertices(side_length=2, center=(0,0)))
+        self.start = (-3, 0)
+        self.goal = (3, 0)
+
+    def test_segments_intersect_polygons_ignores_segments_touching_boundary(self):
+        vertices, axes = geom.pack_polygons([self.square.vertices])
+        starts = [(-2, 0), (-2, 1), (-2, 2), (0, 0)]
+        ends = [(2, 0), (2, 1), (2, -2), (0, 3)]
+        result = geom.segments_intersect_polygons(starts, ends, vertices, axes)[:, 0]
+
+        expected = [True, False, True, True]
+        self.assertEqual(expected, result.tolist())
+
+    def test_points_in_polygons_excludes_boundary(self):
+        vertices, axes = geom.pack_polygons([self.square.vertices])
+        result = geom.points_in_polygons([(0, 0), (1, 0), (2, 0)], vertices, axes)[:, 0]
+        self.assertEqual([True, False, False], result.tolist())
+
+    def test_visibility_graph_goes_straight_in_empty_world(self):
+        visibility_graph = geom.VisibilityGraph([], margin=0.5)
+        result = visibility_graph.plan(self.occupancy_grid, self.start, self.goal)
+        self.assertEqual([self.start, self.goal], result)
+
+    def test_visibility_graph_goes_around_grown_corners_of_obstacle(self):
+        visibility_graph = geom.VisibilityGraph([self.square], margin=0.5)
+        result = visibility_graph.plan(self.occupancy_grid, self.start, self.goal)
+
+        self.assertEqual(4, len(result))
+        self.assertTrue(all(np.allclose(np.abs(point), 1.5) for point in result[1:-1]))
+        self.assertAlmostEqual(2 * np.hypot(1.5, 1.5) + 3, trajectory_length(result))
+
+    def test_visibility_graph_avoids_dynamic_obstacles_of_grid(self):
+        self.occupancy_grid.set_dynamic_obstacles([((-0.25, -4), (0.25, 1))], kernel_size=1)
+        visibility_graph = geom.VisibilityGraph([], margin=0.5)
+        result = visibility_graph.plan(self.occupancy_grid, self.start, self.goal)
+
+        self.assertEqual([self.start, (-0.75, 1.5), (0.75, 1.5), self.goal], result)
+
+    def test_visibility_graph_leaves_margin_through_free_cells(self):
+        self.occupancy_grid.set_static_obstacles([self.square], kernel_size=1)
+        visibility_graph = geom.VisibilityGraph([self.square], margin=0.5)
+        result = visibility_graph.plan(self.occupancy_grid, (-1.25, 0.25), self.goal)
+
+        self.assertEqual(4, len(result))
+        self.assertTrue(geom.trajectory_is_free(self.occupancy_grid, result))
+
+    def test_visibility_graph_fails_when_goal_unreachable(self):
+        self.occupancy_grid.set_dynamic_obstacles([((-0.25, -4), (0.25, 4))], kernel_size=1)
+        visibility_graph = geom.VisibilityGraph([], margin=0.5)
+        result = visibility_graph.plan(self.occupancy_grid, self.start, self.goal)
+        self.assertIsNone(result)
+
+
+class TestDStarLite(unittest.TestCase):
+    def setUp(self):
+        self.occupancy_grid = OccupancyGrid(width=8, height=8, cell_resolution=0.5, origin=(0,0))
+        self.start = (-3.75, -3.75)
+        self.goal = (3.75, 3.75)
+        self.planner = geom.DStarLite()
+
+    def test_d_star_lite_fails_when_goal_occluded(self):
+        goal_node = self.occupancy_grid.get_cell(self.goal)
+        self.occupancy_grid.occupancy[goal_node.indices] = 1
+        result = self.planner.plan(self.occupancy_grid, self.start, self.goal)
+        self.assertIsNone(result)
+
+    def test_d_star_lite_does_no_work_when_nothing_changed(self):
+        self.planner.plan(self.occupancy_grid, self.start, self.goal)
+        result = self.planner.plan(self.occupancy_grid, self.start, self.goal)
+
+        self.assertEqual(geom.a_star(self.occupancy_grid, self.start, self.goal), result)
+        self.assertEqual(0, self.planner.num_expansions)
+
+    def test_d_star_lite_fails_when_goal_gets_sealed_off(self):
+        self.planner.plan(self.occupancy_grid, self.start, self.goal)
+
+        self.occupancy_grid.occupancy[13:16, 13] = 1
+        self.occupancy_grid.occupancy[13, 13:16] = 1
+        result = self.planner.plan(self.occupancy_grid, self.start, self.goal)
+        self.assertIsNone(result)
+
+    def test_d_star_lite_path_lengths_match_a_star_while_driving_through_changing_grid(self):
+        rng = np.random.default_rng(3260)
+        occupancy = (rng.random(self.occupancy_grid.occupancy.shape) < 0.2).astype(np.uint8)
+        start = self.start
+        for frame in range(20):
+            occupancy[0, 0] = occupancy[-1, -1] = 0
+            self.occupancy_grid.occupancy = occupancy.copy()
+            goal = self.goal if frame < 10 else (3.75, -3.75)
+
+            a_star_result = geom.a_star(self.occupancy_grid, start, goal)
+            d_star_lite_result = self.planner.plan(self.occupancy_grid, start, goal)
+
+            if a_star_result is None:
+                self.assertIsNone(d_star_lite_result)
+            else:
+                self.assertAlmostEqual(trajectory_length(a_star_result), trajectory_length(d_star_lite_result))
+                start = d_star_lite_result[1]
+
+            # Flip a few cells before the next frame
+            for cell in rng.integers(0, 16, size=(3, 2)):
+                occupancy[tuple(cell)] ^= 1
+
+
+class TestNavigationFunction(unittest.TestCase):
+    def setUp(self):
+        self.occupancy_grid = OccupancyGrid(width=4, height=4, cell_resolution=1, origin=(0,0))
+        self.start = (-1.5, -1.5)
+        self.goal = (1.5, 1.5)
+        self.navigation_function = geom.NavigationFunction()
+
+    def test_cost_to_goal_is_octile_distance_on_empty_grid(self):
+        self.navigation_function.update(self.occupancy_grid, self.goal)
+
+        expected = [[geom.octile_dist((col, row), (3, 3)) for row in range(4)] for col in range(4)]
+        actual = self.navigation_function.cost_to_goal
+        np.testing.assert_allclose(expected, actual)
+
+    def test_field_is_only_recomputed_when_goal_or_grid_changes(self):
+        self.assertTrue(self.navigation_function.update(self.occupancy_grid, self.goal))
+        self.assertFalse(self.navigation_function.update(self.occupancy_grid, self.goal))
+        self.assertTrue(self.navigation_function.update(self.occupancy_grid, self.start))
+
+        self.occupancy_grid.occupancy[2, 2] = 1
+        self.assertTrue(self.navigation_function.update(self.occupancy_grid, self.start))
+
+    def test_next_cell_descends_towards_goal(self):
+        self.navigation_function.update(self.occupancy_grid, self.goal)
+
+        expected = (1, 1)
+        actual = self.navigation_function.next_cell((0, 0))
+        self.assertEqual(expected, actual)
+
+    def test_next_waypoint_descends_towards_goal(self):
+        self.navigation_function.update(self.occupancy_grid, self.goal)
+
+        expected = (-0.5, -0.5)
+        actual = self.navigation_function.next_waypoint(self.occupancy_grid, self.start)
+        self.assertEqual(expected, actual)
+
+    def test_next_waypoint_is_none_before_field_is_computed(self):
+        self.assertIsNone(self.navigation_function.next_waypoint(self.occupancy_grid, self.start))
+
+    def test_plan_fails_when_goal_unreachable(self):
+        self.occupancy_grid.occupancy[2,3] = 1
+        self.occupancy_grid.occupancy[2,2] = 1
+        self.occupancy_grid.occupancy[3,2] = 1
+        result = self.navigation_function.plan(self.occupancy_grid, self.start, self.goal)
+        self.assertIsNone(result)
+        self.assertIsNone(self.navigation_function.next_waypoint(self.occupancy_grid, self.start))
+
+    def test_plan_matches_a_star_path_length_around_wall(self):
+        self.occupancy_grid.occupancy[2, 0:3] = 1
+        goal = (1.5, -1.5)
+        result = self.navigation_function.plan(self.occupancy_grid, self.start, goal)
+
+        expected = trajectory_length(geom.a_star(self.occupancy_grid, self.start, goal))
+        actual = trajectory_length(result)
+        self.assertAlmostEqual(expected, actual)
+
+
+class TestTrajectoryCache(unittest.TestCase):
+    def setUp(self):
+        self.occupancy_grid = OccupancyGrid(width=8, height=8, cell_resolution=1, origin=(0,0))
+        self.occupancy_grid.set_static_obstacles([], kernel_size=1)
+        self.start = (-3.5, -3.5)
+        self.goal = (-0.5, -0.5)
+        self.trajectory = geom.a_star(self.occupancy_grid, self.start, self.goal)
+        self.trajectory_cache = geom.TrajectoryCache(max_size=2)
+
+    def test_trajectory_cache_hits_from_anywhere_in_start_and_goal_cells(self):
+        self.trajectory_cache.put(self.occupancy_grid, self.start, self.goal, self.trajectory)
+        result = self.trajectory_cache.get(self.occupancy_grid, (-3.4, -3.6), self.goal)
+
+        expected = [(-3.4, -3.6)] + self.trajectory[1:]
+        self.assertEqual(expected, result)
+        self.assertEqual((1, 0), (self.trajectory_cache.hits, self.trajectory_cache.misses))
+
+    def test_trajectory_cache_misses_for_other_goal_cell(self):
+        self.trajectory_cache.put(self.occupancy_grid, self.start, self.goal, self.trajectory)
+        result = self.trajectory_cache.get(self.occupancy_grid, self.start, (0.5, -0.5))
+
+        self.assertIsNone(result)
+        self.assertEqual((0, 1), (self.trajectory_cache.hits, self.trajectory_cache.misses))
+
+    def test_trajectory_cache_evicts_when_dynamic_obstacle_appears_in_region(self):
+        self.trajectory_cache.put(self.occupancy_grid, self.start, self.goal, self.trajectory)
+        self.occupancy_grid.set_dynamic_obstacles([((-2.5, -0.5), (-2.5, -0.5))], kernel_size=1)
+
+        self.assertIsNone(self.trajectory_cache.get(self.occupancy_grid, self.start, self.goal))
+        self.assertEqual(0, len(self.trajectory_cache.entries))
+
+    def test_trajectory_cache_keeps_entry_when_dynamic_obstacle_appears_elsewhere(self):
+        self.trajectory_cache.put(self.occupancy_grid, self.start, self.goal, self.trajectory)
+        self.occupancy_grid.set_dynamic_obstacles([((2.5, 2.5), (2.5, 2.5))], kernel_size=1)
+
+        result = self.trajectory_cache.get(self.occupancy_grid, self.start, self.goal)
+        self.assertEqual(self.trajectory, result)
+
+    def test_trajectory_cache_ignores_trajectory_that_stops_short_of_goal(self):
+        self.trajectory_cache.put(self.occupancy_grid, self.start, self.goal, self.trajectory[:-2])
+
+        self.assertIsNone(self.trajectory_cache.get(self.occupancy_grid, self.start, self.goal))
+        self.assertEqual(0, len(self.trajectory_cache.entries))
+
+    def test_trajectory_cache_evicts_least_recently_used_when_full(self):
+        other_goals = [(0.5, 0.5), (1.5, 1.5)]
+        self.trajectory_cache.put(self.occupancy_grid, self.start, self.goal, self.trajectory)
+        self.trajectory_cache.put(self.occupancy_grid, self.start, other_goals[0], [self.start, other_goals[0]])
+        self.trajectory_cache.get(self.occupancy_grid, self.start, self.goal)
+        self.trajectory_cache.put(self.occupancy_grid, self.start, other_goals[1], [self.start, other_goals[1]])
+
+        self.assertIsNotNone(self.trajectory_cache.get(self.occupancy_grid, self.start, self.goal))
+        self.assertIsNone(self.trajectory_cache.get(self.occupancy_grid, self.start, other_goals[0]))
+
+
+class TestLandmarkHeuristic(unittest.TestCase):
+    def setUp(self):
+        self.occupancy_grid = OccupancyGrid(width=10, height=10, cell_resolution=1, origin=(0,0))
+        self.occupancy_grid.set_static_obstacles([((-0.5, -5), (0.5, 3))], kernel_size=1)
+        self.start = (-2.5, -2.5)
+        self.goal = (2.5, -2.5)
+
+    def test_bound_never_overestimates_cost_to_goal(self):
+        landmarks = geom.LandmarkHeuristic(self.occupancy_grid, num_landmarks=4)
+        navigation_function = geom.NavigationFunction()
+        navigation_function.update(self.occupancy_grid, self.goal)
+
+        bounds = landmarks.heuristic(self.occupancy_grid.get_cell(self.goal).indices)
+        self.assertTrue(np.all(bounds <= navigation_function.cost_to_goal))
+
+    def test_bound_accounts_for_walls_in_the_way(self):
+        landmarks = geom.LandmarkHeuristic(self.occupancy_grid, num_landmarks=4)
+
+        bound = landmarks.heuristic(self.occupancy_grid.get_cell(self.goal).indices)
+        self.assertGreater(bound[self.occupancy_grid.get_cell(self.start).indices], geom.dist(self.start, self.goal))
+
+    def test_a_star_with_landmarks_matches_a_star_path_length(self):
+        landmarks = geom.LandmarkHeuristic(self.occupancy_grid, num_landmarks=4)
+        self.occupancy_grid.set_dynamic_obstacles([((-2, 0.5), (-1, 1.5))], kernel_size=1)
+
+        expected = trajectory_length(geom.a_star(self.occupancy_grid, self.start, self.goal))
+        actual = trajectory_length(geom.a_star(self.occupancy_grid, self.start, self.goal, landmarks=landmarks))
+        self.assertAlmostEqual(expected, actual)
+
+    def test_fields_are_cached_by_static_layer(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            landmarks = geom.LandmarkHeuristic(self.occupancy_grid, num_landmarks=4, cache_dir=cache_dir)
+            cached = geom.LandmarkHeuristic(self.occupancy_grid, num_landmarks=4, cache_dir=cache_dir)
+            self.assertEqual(landmarks.cache_path, cached.cache_path)
+            np.testing.assert_array_equal(landmarks.distances, cached.distances)
+
+            self.occupancy_grid.set_static_obstacles([], kernel_size=1)
+            changed = geom.LandmarkHeuristic(self.occupancy_grid, num_landmarks=4, cache_dir=cache_dir)
+            self.assertNotEqual(landmarks.cache_path, changed.cache_path)
+            self.assertEqual(2, len(os.listdir(cache_dir)))
+
+
+class TestTrajectoryChecks(unittest.TestCase):
+    def setUp(self):
+        self.occupancy_grid = OccupancyGrid(width=6, height=6, cell_resolution=1, origin=(0,0))
+
+    def test_get_cell_indices_matches_get_cell(self):
+        points = [(-2.5, -2.5), (0.2, 1.7), (2.9, -0.1), (3, 0)]
+
+        expected = [self.occupancy_grid.get_cell(point) for point in points]
+        cols, rows = self.occupancy_grid.get_cell_indices(points)
+        for cell, col, row in zip(expected, cols, rows):
+            self.assertEqual(cell.indices if cell is not None else (-1, -1), (col, row))
+
+    def test_line_cells_steps_through_every_cell_between_waypoints(self):
+        cols, rows = geom.line_cells([0, 4, 4], [0, 2, 2])
+
+        expected = [(0, 0), (1, 0), (2, 1), (3, 2), (4, 2)]
+        self.assertEqual(expected, [(int(c), int(r)) for c, r in zip(cols, rows)])
+
+    def test_trajectory_is_free_checks_cells_between_waypoints(self):
+        trajectory = [(-2.5, -2.5), (2.5, 2.5)]
+        self.assertTrue(geom.trajectory_is_free(self.occupancy_grid, trajectory))
+
+        self.occupancy_grid.occupancy[2, 2] = 1
+        self.assertFalse(geom.trajectory_is_free(self.occupancy_grid, trajectory))
+
+    def test_trajectory_is_not_free_when_it_leaves_the_grid(self):
+        self.assertFalse(geom.trajectory_is_free(self.occupancy_grid, [(-2.5, -2.5), (3.5, -2.5)]))
+
+    def test_trim_trajectory_starts_at_position_and_skips_passed_waypoints(self):
+        trajectory = [(-2.5, -2.5), (-1.5, -2.5), (-0.5, -2.5), (-0.5, -1.5)]
+
+        trimmed, deviation = geom.trim_trajectory(trajectory, (-1.2, -2.4))
+        self.assertEqual([(-1.2, -2.4), (-0.5, -2.5), (-0.5, -1.5)], trimmed)
+        self.assertAlmostEqual(0.1, deviation)
+
+    def test_line_of_sight_is_blocked_by_occupied_cells(self):
+        self.occupancy_grid.occupancy[2, 2] = 1
+
+        expected = [True, False, False, True]
+        actual = geom.line_of_sight(self.occupancy_grid, (0, 0), [5, 4, 2, 0], [0, 4, 2, 5])
+        np.testing.assert_array_equal(expected, actual)
+
+    def test_shortcut_trajectory_keeps_only_waypoints_around_obstacles(self):
+        self.occupancy_grid.occupancy[2, 0:5] = 1
+        trajectory = geom.a_star(self.occupancy_grid, (-2.5, -2.5), (2.5, -2.5))
+
+        shortcut = geom.shortcut_trajectory(self.occupancy_grid, trajectory)
+        self.assertEqual(trajectory[0], shortcut[0])
+        self.assertEqual(trajectory[-1], shortcut[-1])
+        self.assertLess(len(shortcut), len(trajectory))
+        self.assertLessEqual(trajectory_length(shortcut), trajectory_length(trajectory))
+        self.assertTrue(geom.trajectory_is_free(self.occupancy_grid, shortcut))
+
+    def test_shortcut_trajectory_on_empty_grid_goes_straight_to_goal(self):
+        trajectory = [(-2.5, -2.5), (-1.5, -2.5), (-0.5, -1.5), (0.5, -1.5)]
+
+        expected = [(-2.5, -2.5), (0.5, -1.5)]
+        actual = geom.shortcut_trajectory(self.occupancy_grid, trajectory)
+        self.assertEqual(expected, actual)
+
+
+    def test_shortcut_trajectory_keeps_clearance_from_obstacles(self):
+        occupancy_grid = OccupancyGrid(width=8, height=8, cell_resolution=0.5, origin=(0,0))
+        occupancy_grid.set_clearance_cost(radius=1, weight=4)
+        occupancy_grid.set_static_obstacles([Polygon(make_square_vertices(side_length=1, center=(0,0)))], kernel_size=1)
+        trajectory = geom.a_star(occupancy_grid, (-3.25, -0.25), (3.25, 0.25))
+
+        shortcut = geom.shortcut_trajectory(occupancy_grid, trajectory)
+        self.assertLess(len(shortcut), len(trajectory))
+        cols, rows = geom.line_cells(*occupancy_grid.get_cell_indices(shortcut))
+        self.assertEqual(0, occupancy_grid.clearance_cost[cols, rows].max())
+
+    def test_mean_clearance_cost_includes_both_ends_of_line(self):
+        self.occupancy_grid.clearance_cost = np.zeros((6, 6))
+        self.occupancy_grid.clearance_cost[0:3, 0] = [1, 2, 3]
+
+        expected = [2, 0.25]
+        actual = geom.mean_clearance_cost(self.occupancy_grid, (0, 0), [2, 3], [0, 3])
+        np.testing.assert_allclose(expected, actual)
+
 
 class TestSmoother(unittest.TestCase):
     def test_trajectory_with_two_points_remains_unchanged(self):
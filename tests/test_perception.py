@@ -123,6 +123,7 @@ class TestClassification(unittest.TestCase):
 
         self.assertEqual(len(vehicle_state['classes']['balls']), 1)
         self.assertEqual(len(vehicle_state['classes']['others']), 0)
+        self.assertEqual(len(vehicle_state['classes']['ball_index']), 1)
 
     def test_classification_of_circular_points_wrong_size(self):
         vehicle_state = {
@@ -0,0 +1,153 @@
+#
+# Copyright (c) 2020 FRC Team 3260
+#
+
+import multiprocessing as mp
+import time
+import unittest
+import numpy as np
+from config import Config
+from pipeline import FrameRing, Pipeline, decode_world_state, encode_world_state, run_stage
+
+
+def write_frames(ring, num_frames):
+    for i in range(num_frames):
+        ring.write({'points': np.full((i + 1, 2), i)})
+    ring.stop()
+    ring.close()
+
+
+def failing_stage(config, inputs, outputs, stats, index):
+    def process(frame):
+        raise ValueError('Stage failed')
+
+    run_stage(process, inputs, outputs, stats, index)
+
+
+class TestFrameRing(unittest.TestCase):
+    def setUp(self):
+        self.ring = FrameRing({'points': ((4, 2), np.float64), 'state': ((2,), np.int32)}, num_slots=2)
+
+    def tearDown(self):
+        self.ring.close()
+
+    def test_frames_are_read_back_in_order(self):
+        self.ring.write({'points': [(1, 2)], 'state': [3, 4]})
+        self.ring.write({'points': [(5, 6), (7, 8)]})
+
+        slot, frame = self.ring.read(timeout=1)
+        np.testing.assert_array_equal([(1, 2)], frame['points'])
+        np.testing.assert_array_equal([3, 4], frame['state'])
+        self.ring.release(slot)
+
+        slot, frame = self.ring.read(timeout=1)
+        np.testing.assert_array_equal([(5, 6), (7, 8)], frame['points'])
+        self.assertEqual(0, len(frame['state']))
+        self.ring.release(slot)
+        del frame
+
+    def test_write_drops_oldest_frame_when_full(self):
+        for i in range(3):
+            self.ring.write({'points': [(i, i)]})
+
+        self.assertEqual(2, self.ring.depth())
+        slot, frame = self.ring.read(timeout=1)
+        np.testing.assert_array_equal([(1, 1)], frame['points'])
+        self.ring.release(slot)
+        del frame
+
+    def test_write_drops_rows_beyond_capacity(self):
+        self.ring.write({'points': np.zeros((6, 2))})
+
+        slot, frame = self.ring.read(timeout=1)
+        self.assertEqual((4, 2), frame['points'].shape)
+        self.ring.release(slot)
+        del frame
+
+    def test_read_returns_none_once_stopped(self):
+        self.ring.stop()
+
+        self.assertIsNone(self.ring.read(timeout=1))
+        self.assertTrue(self.ring.stopped)
+
+    def test_frames_pass_between_processes(self):
+        ring = FrameRing({'points': ((8, 2), np.float64)}, num_slots=8, context=mp.get_context('spawn'))
+        process = mp.get_context('spawn').Process(target=write_frames, args=(ring, 3))
+        process.start()
+
+        lengths = []
+        while True:
+            result = ring.read(timeout=10)
+            if result is None:
+                break
+            slot, frame = result
+            lengths.append(len(frame['points']))
+            ring.release(slot)
+            del result, frame
+        process.join()
+        ring.close()
+
+        self.assertEqual([1, 2, 3], lengths)
+
+
+class TestPipeline(unittest.TestCase):
+    def setUp(self):
+        self.config = Config('config.yml', 1)
+        self.config.landmark_heuristic_num_landmarks = 0
+
+    def test_world_state_survives_encoding(self):
+        world_state = {
+            'pose': ((1, 2), 0.5),
+            'ingestedBalls': 3,
+            'obstacles': {
+                'balls': [((0.5, 0.5), 0.1)],
+                'others': [((1, 1), (1.5, 2))]
+            }
+        }
+
+        result, capture_time = decode_world_state(encode_world_state(world_state, capture_time=7))
+        self.assertEqual(world_state, result)
+        self.assertEqual(7, capture_time)
+
+    def test_failed_stage_stops_next_stage_and_is_reported(self):
+        pipeline = Pipeline(self.config)
+        context = mp.get_context('spawn')
+        pipeline.processes[0] = context.Process(target=failing_stage,
+                                                args=(self.config, pipeline.sweeps, pipeline.worlds, pipeline.stats, 0),
+                                                daemon=True)
+        pipeline.start()
+        pipeline.submit({'x': 0, 'y': 0, 'theta': 0, 'ingestedBalls': 0, 'lidarSweep': [[0, 0, 1]]}, capture_time=0)
+
+        for process in pipeline.processes:
+            process.join(timeout=30)
+        self.assertEqual([1, 0], [process.exitcode for process in pipeline.processes])
+        self.assertRaises(RuntimeError, pipeline.poll)
+        pipeline.stop()
+
+    def test_pipeline_plans_submitted_sweeps(self):
+        pipeline = Pipeline(self.config)
+        pipeline.start()
+        azimuths = np.linspace(0, 2 * np.pi, 360, endpoint=False)
+        vehicle_state = {
+            'x': 0,
+            'y': -3,
+            'theta': 0,
+            'ingestedBalls': 0,
+            'lidarSweep': [[azimuth, 0, 3] for azimuth in azimuths]
+        }
+
+        result = None
+        start = time.time()
+        while result is None and time.time() - start < 30:
+            pipeline.submit(vehicle_state, capture_time=start)
+            result = pipeline.poll()
+            time.sleep(0.01)
+        pipeline.stop()
+
+        world_state, plan_state, capture_time = result
+        self.assertEqual(((0, -3), 0), plan_state['pose'])
+        self.assertIn('cache_hits', pipeline.metrics()['planning'])
+        self.assertEqual('INTAKE', plan_state['tube_mode'])
+        self.assertEqual(start, capture_time)
+        self.assertEqual(self.config.occupancy_grid_width / self.config.occupancy_grid_cell_resolution,
+                         len(plan_state['grid'].occupancy))
@@ -6,18 +6,28 @@ import unittest
 from unittest.mock import Mock
 from planning import Planning
 from geometry import Polygon
+import geometry as geom
 from tests.test_utils import *
 
 
 class TestBehaviorPlanning(unittest.TestCase):
     def setUp(self):
         self.config = Mock()
+        self.config.field_elements = []
         self.config.blue_goal_region = Polygon(make_square_vertices(side_length=0.5, center=(-2.5, -3.5)))
         self.config.occupancy_grid_width = 6
         self.config.occupancy_grid_height = 6
         self.config.occupancy_grid_cell_resolution = 1
         self.config.occupancy_grid_origin = (0, 0)
         self.config.occupancy_grid_dilation_kernel_size = 3
+        self.config.occupancy_grid_clearance_radius = 1
+        self.config.occupancy_grid_clearance_weight = 0
+        self.config.pickup_sequencing_max_candidates = 0
+        self.config.landmark_heuristic_num_landmarks = 0
+        self.config.trajectory_reuse_max_deviation = 0.5
+        self.config.shortcut_trajectories = False
+        self.config.trajectory_cache_size = 0
+        self.config.motion_planner = 'a_star'
         self.config.lidar_deadzone_radius = 0.85
         self.config.blue_player_station_pos = np.array([10, 10])
 
@@ -71,6 +81,85 @@ class TestBehaviorPlanning(unittest.TestCase):
         actual = {k: world_state[k] for k in ('goal', 'direction', 'tube_mode')}
         self.assertEqual(expected, actual)
 
+    def test_robot_goes_to_ball_with_shortest_path_instead_of_closest_ball(self):
+        self.config.field_elements = [Polygon([[0.2, -3], [0.8, -3], [0.8, 2], [0.2, 2]])]
+        self.config.occupancy_grid_dilation_kernel_size = 1
+        self.planning = Planning(self.config)
+
+        world_state = {
+            'pose': ((-0.5, -2.5), 0),
+            'ingestedBalls': 0,
+            'obstacles': {
+                'balls': [((1.5, -2.5), 0.1), ((-2.5, 1.5), 0.1)]
+            }
+        }
+
+        self.planning.behavior_planning(world_state)
+
+        expected = (-2.5, 1.5)
+        actual = world_state['goal']
+        self.assertEqual(expected, actual)
+        self.assertAlmostEqual(trajectory_length(geom.a_star(self.planning.occupancy_grid, (-0.5, -2.5), expected)),
+                               trajectory_length(world_state['goal_trajectory']))
+
+    def test_robot_ignores_closest_ball_when_it_is_sealed_off(self):
+        self.config.field_elements = [Polygon([[0.2, -3], [0.8, -3], [0.8, 3], [0.2, 3]])]
+        self.config.occupancy_grid_dilation_kernel_size = 1
+        self.planning = Planning(self.config)
+
+        world_state = {
+            'pose': ((-0.5, -2.5), 0),
+            'ingestedBalls': 0,
+            'obstacles': {
+                'balls': [((1.5, -2.5), 0.1), ((-2.5, 2.5), 0.1)]
+            }
+        }
+
+        self.planning.behavior_planning(world_state)
+
+        expected = (-2.5, 2.5)
+        actual = world_state['goal']
+        self.assertEqual(expected, actual)
+
+    def test_robot_picks_up_balls_in_the_order_that_makes_the_trip_to_score_shortest(self):
+        self.config.pickup_sequencing_max_candidates = 6
+        self.planning = Planning(self.config)
+
+        # The closest ball is on the way to the scoring zone, so it should be picked up last
+        world_state = {
+            'pose': ((-0.5, -0.5), 0),
+            'ingestedBalls': 3,
+            'obstacles': {
+                'balls': [((-0.5, -1.5), 0.1), ((-0.5, 1.5), 0.1)]
+            }
+        }
+
+        self.planning.behavior_planning(world_state)
+
+        expected = (-0.5, 1.5)
+        actual = world_state['goal']
+        self.assertEqual(expected, actual)
+
+    def test_robot_heads_for_closest_ball_when_anytime_search_runs_out_of_budget(self):
+        self.config.motion_planner = 'anytime_a_star'
+        self.config.motion_planning_max_expansions = 2
+        self.config.motion_planning_time_budget = 0
+        self.planning = Planning(self.config)
+
+        world_state = {
+            'pose': ((-2.5, -2.5), 0),
+            'obstacles': {
+                'balls': [((2.5, 2.5), 0.1), ((-2.5, 2.5), 0.1)],
+                'others': [],
+            },
+            'ingestedBalls': 0,
+        }
+        self.planning.update_occupancy_grid(world_state)
+        self.planning.behavior_planning(world_state)
+
+        self.assertEqual((-2.5, 2.5), world_state['goal'])
+        self.assertIsNone(world_state['goal_trajectory'])
+
     def test_robot_drives_to_goal_backwards_when_it_has_five_balls_and_is_far_from_goal(self):
         world_state = {
             'pose': ((0, 0), 0),
@@ -138,6 +227,14 @@ class TestMotionPlanning(unittest.TestCase):
         self.config.occupancy_grid_cell_resolution = 1
         self.config.occupancy_grid_origin = (0, 0)
         self.config.occupancy_grid_dilation_kernel_size = 3
+        self.config.occupancy_grid_clearance_radius = 1
+        self.config.occupancy_grid_clearance_weight = 0
+        self.config.pickup_sequencing_max_candidates = 0
+        self.config.landmark_heuristic_num_landmarks = 0
+        self.config.trajectory_reuse_max_deviation = 0.5
+        self.config.shortcut_trajectories = False
+        self.config.trajectory_cache_size = 0
+        self.config.motion_planner = 'a_star'
         self.config.blue_goal_region = Polygon(make_square_vertices(side_length=0.5, center=(-2.5, -2.5)))
         self.config.blue_player_station_pos = np.array([10, 10])
 
@@ -166,7 +263,8 @@ class TestMotionPlanning(unittest.TestCase):
         np.testing.assert_array_equal(expected_occupancy_grid, actual_occupancy_grid)
 
     def test_motion_planning_avoids_static_obstacle(self):
-        self.planning.field_elements = [Polygon(make_square_vertices(side_length=1.5, center=(0,0)))]
+        self.config.field_elements = [Polygon(make_square_vertices(side_length=1.5, center=(0,0)))]
+        self.planning = Planning(self.config)
 
         world_state = {
             'obstacles': {
@@ -207,6 +305,134 @@ class TestMotionPlanning(unittest.TestCase):
         np.testing.assert_array_equal(expected_occupancy_grid, actual_occupancy_grid)
         self.assertEqual(expected_trajectory_length, actual_trajectory_length)
 
+    def test_motion_planning_replaces_dynamic_obstacles_every_frame(self):
+        self.config.field_elements = [Polygon(make_square_vertices(side_length=0.5, center=(-0.5, -0.5)))]
+        self.planning = Planning(self.config)
+
+        world_state = {
+            'obstacles': {
+                'others': [((1.5, 1.5), (1.5, 1.5))],
+            },
+            'pose': self.pose,
+            'goal': (-2.5, 2.5),
+        }
+        self.planning.motion_planning(world_state)
+        world_state['obstacles']['others'] = []
+        self.planning.motion_planning(world_state)
+
+        expected_occupancy_grid = np.zeros(shape=(6, 6), dtype=np.uint8)
+        expected_occupancy_grid[1:4, 1:4] = np.ones(shape=(3, 3))
+        actual_occupancy_grid = world_state['grid'].occupancy
+        np.testing.assert_array_equal(expected_occupancy_grid, actual_occupancy_grid)
+
+    def test_motion_planning_reuses_trajectory_while_it_stays_collision_free(self):
+        world_state = {
+            'obstacles': {
+                'others': [],
+            },
+            'pose': self.pose,
+            'goal': self.goal,
+        }
+        self.planning.motion_planning(world_state)
+        previous_trajectory = world_state['trajectory']
+
+        world_state['pose'] = ((-1.2, -1.3), 0)
+        world_state['obstacles']['others'] = [((1.5, -2.5), (1.5, -2.5))]
+        self.planning.motion_planning(world_state)
+
+        expected_trajectory = [(-1.2, -1.3)] + previous_trajectory[2:]
+        self.assertEqual(expected_trajectory, world_state['trajectory'])
+        self.assertEqual(1, self.planning.replans_avoided_per_second())
+
+    def test_motion_planning_forgets_old_reused_trajectories(self):
+        world_state = {
+            'obstacles': {
+                'others': [],
+            },
+            'pose': self.pose,
+            'goal': self.goal,
+        }
+        self.planning.motion_planning(world_state)
+        self.planning.replans_avoided.extend([0] * 10)
+
+        self.planning.motion_planning(world_state)
+
+        self.assertEqual(1, len(self.planning.replans_avoided))
+
+    def test_motion_planning_replans_when_trajectory_is_blocked(self):
+        world_state = {
+            'obstacles': {
+                'others': [],
+            },
+            'pose': self.pose,
+            'goal': self.goal,
+        }
+        self.planning.motion_planning(world_state)
+
+        world_state['obstacles']['others'] = [((-0.5, -0.5), (0.5, 0.5))]
+        self.planning.motion_planning(world_state)
+
+        self.assertTrue(geom.trajectory_is_free(self.planning.occupancy_grid, world_state['trajectory']))
+        self.assertEqual(10, len(world_state['trajectory']))
+        self.assertEqual(0, self.planning.replans_avoided_per_second())
+
+    def test_motion_planning_replans_when_goal_changes(self):
+        world_state = {
+            'obstacles': {
+                'others': [],
+            },
+            'pose': self.pose,
+            'goal': self.goal,
+        }
+        self.planning.motion_planning(world_state)
+
+        world_state['goal'] = (-2.5, 2.5)
+        self.planning.motion_planning(world_state)
+
+        self.assertEqual((-2.5, 2.5), world_state['trajectory'][-1])
+        self.assertEqual(0, self.planning.replans_avoided_per_second())
+
+    def test_motion_planning_looks_up_trajectory_when_goal_flips_back(self):
+        self.config.trajectory_cache_size = 4
+        self.planning = Planning(self.config)
+        world_state = {
+            'obstacles': {
+                'others': [],
+            },
+            'pose': self.pose,
+            'goal': self.goal,
+        }
+        self.planning.motion_planning(world_state)
+        expected_trajectory = world_state['trajectory']
+
+        for goal in [(-2.5, 2.5), self.goal]:
+            world_state['goal'] = goal
+            self.planning.motion_planning(world_state)
+
+        self.assertEqual(expected_trajectory, world_state['trajectory'])
+        self.assertEqual((1, 2), self.planning.trajectory_cache_stats())
+
+    def test_motion_planning_shortcuts_trajectory_around_static_obstacle(self):
+        self.config.shortcut_trajectories = True
+        self.config.field_elements = [Polygon(make_square_vertices(side_length=1.5, center=(0,0)))]
+        self.planning = Planning(self.config)
+
+        world_state = {
+            'obstacles': {
+                'others': [],
+            },
+            'pose': self.pose,
+            'goal': self.goal,
+        }
+
+        self.planning.motion_planning(world_state)
+
+        trajectory = world_state['trajectory']
+        self.assertLess(len(trajectory), 10)
+        self.assertEqual(self.pose[0], trajectory[0])
+        self.assertEqual(self.goal, trajectory[-1])
+        self.assertTrue(geom.trajectory_is_free(self.planning.occupancy_grid, trajectory))
+
     def test_motion_planning_returns_none_when_no_feasible_trajectory(self):
         world_state = {
             'obstacles': {
@@ -222,6 +448,311 @@ class TestMotionPlanning(unittest.TestCase):
 
         self.assertIsNone(world_state['trajectory'])
 
+    def test_motion_planning_with_jps_matches_a_star_around_static_obstacle(self):
+        self.config.motion_planner = 'jps'
+        self.config.field_elements = [Polygon(make_square_vertices(side_length=1.5, center=(0,0)))]
+        self.planning = Planning(self.config)
+
+        world_state = {
+            'obstacles': {
+                'others': [],
+            },
+            'pose': self.pose,
+            'goal': self.goal,
+        }
+
+        self.planning.motion_planning(world_state)
+
+        expected_trajectory_length = 10
+        actual_trajectory_length = len(world_state['trajectory'])
+        self.assertEqual(expected_trajectory_length, actual_trajectory_length)
+
+    def test_motion_planning_reuses_goal_trajectory_only_with_a_star(self):
+        goal_trajectory = [self.pose[0], (-2.5, 2.5), self.goal]
+        for motion_planner, expected_trajectory_length in [('a_star', 3), ('jps', 6)]:
+            self.config.motion_planner = motion_planner
+            self.planning = Planning(self.config)
+            world_state = {
+                'obstacles': {
+                    'others': [],
+                },
+                'pose': self.pose,
+                'goal': self.goal,
+                'goal_trajectory': goal_trajectory,
+            }
+
+            self.planning.motion_planning(world_state)
+
+            self.assertEqual(expected_trajectory_length, len(world_state['trajectory']))
+
+    def test_motion_planning_with_landmarks_matches_a_star_around_static_obstacle(self):
+        self.config.landmark_heuristic_num_landmarks = 4
+        self.config.landmark_heuristic_cache_dir = None
+        self.config.field_elements = [Polygon(make_square_vertices(side_length=1.5, center=(0,0)))]
+        self.planning = Planning(self.config)
+
+        world_state = {
+            'obstacles': {
+                'others': [],
+            },
+            'pose': self.pose,
+            'goal': self.goal,
+        }
+
+        self.planning.motion_planning(world_state)
+
+        expected_trajectory_length = 10
+        actual_trajectory_length = len(world_state['trajectory'])
+        self.assertEqual(expected_trajectory_length, actual_trajectory_length)
+
+    def test_motion_planning_with_anytime_a_star_stays_within_expansion_budget(self):
+        self.config.motion_planner = 'anytime_a_star'
+        self.config.motion_planning_max_expansions = 3
+        self.config.motion_planning_time_budget = 0
+        self.config.field_elements = [Polygon(make_square_vertices(side_length=1.5, center=(0,0)))]
+        self.planning = Planning(self.config)
+
+        world_state = {
+            'obstacles': {
+                'others': [],
+            },
+            'pose': self.pose,
+            'goal': self.goal,
+        }
+
+        self.planning.motion_planning(world_state)
+        self.assertNotEqual(self.goal, world_state['trajectory'][-1])
+
+        while world_state['trajectory'][-1] != self.goal:
+            self.planning.motion_planning(world_state)
+
+        expected_trajectory_length = 10
+        actual_trajectory_length = len(world_state['trajectory'])
+        self.assertEqual(expected_trajectory_length, actual_trajectory_length)
+
+    def test_motion_planning_with_anytime_a_star_keeps_searching_when_trajectory_cache_is_enabled(self):
+        self.config.motion_planner = 'anytime_a_star'
+        self.config.motion_planning_max_expansions = 3
+        self.config.motion_planning_time_budget = 0
+        self.config.trajectory_cache_size = 4
+        self.config.field_elements = [Polygon(make_square_vertices(side_length=1.5, center=(0,0)))]
+        self.planning = Planning(self.config)
+
+        world_state = {
+            'obstacles': {
+                'others': [],
+            },
+            'pose': self.pose,
+            'goal': self.goal,
+        }
+
+        self.planning.motion_planning(world_state)
+        self.assertNotEqual(self.goal, world_state['trajectory'][-1])
+
+        for _ in range(20):
+            self.planning.motion_planning(world_state)
+            self.assertTrue(geom.trajectory_is_free(self.planning.occupancy_grid, world_state['trajectory']))
+            if world_state['trajectory'][-1] == self.goal:
+                break
+
+        self.assertEqual(self.goal, world_state['trajectory'][-1])
+        self.assertEqual(10, len(world_state['trajectory']))
+        self.assertEqual(0, self.planning.trajectory_cache_stats()[0])
+
+    def test_motion_planning_with_anytime_a_star_drives_to_closest_cell_when_goal_is_sealed_off(self):
+        self.config.motion_planner = 'anytime_a_star'
+        self.config.motion_planning_max_expansions = 0
+        self.config.motion_planning_time_budget = 0
+        self.planning = Planning(self.config)
+
+        world_state = {
+            'obstacles': {
+                'others': [((1.5, -2.5), (1.5, 2.5))],
+            },
+            'pose': self.pose,
+            'goal': self.goal,
+        }
+
+        self.planning.motion_planning(world_state)
+
+        self.assertEqual((-0.5, 2.5), world_state['trajectory'][-1])
+        self.assertTrue(geom.trajectory_is_free(self.planning.occupancy_grid, world_state['trajectory']))
+
+    def test_motion_planning_with_lattice_plans_from_robot_heading(self):
+        self.config.motion_planner = 'lattice'
+        self.config.lattice_turn_cost = 10
+        self.config.lattice_heuristic_weight = 1
+        self.planning = Planning(self.config)
+
+        world_state = {
+            'obstacles': {
+                'others': [],
+            },
+            'pose': ((-2.5, -2.5), np.pi / 2),
+            'goal': self.goal,
+        }
+
+        self.planning.motion_planning(world_state)
+
+        trajectory = world_state['trajectory']
+        self.assertEqual(self.goal, trajectory[-1])
+        first_step = np.subtract(trajectory[1], trajectory[0])
+        self.assertGreater(first_step[1], abs(first_step[0]))
+
+    def test_motion_planning_with_hierarchical_planner_matches_a_star_around_static_obstacle(self):
+        self.config.motion_planner = 'hierarchical'
+        self.config.hierarchical_planner_levels = 1
+        self.config.field_elements = [Polygon(make_square_vertices(side_length=1.5, center=(0,0)))]
+        self.planning = Planning(self.config)
+
+        world_state = {
+            'obstacles': {
+                'others': [],
+            },
+            'pose': self.pose,
+            'goal': self.goal,
+        }
+
+        self.planning.motion_planning(world_state)
+
+        expected_trajectory_length = 10
+        actual_trajectory_length = len(world_state['trajectory'])
+        self.assertEqual(expected_trajectory_length, actual_trajectory_length)
+
+    def test_motion_planning_with_visibility_graph_goes_around_static_obstacle(self):
+        self.config.motion_planner = 'visibility'
+        self.config.occupancy_grid_dilation_kernel_size = 1
+        self.config.field_elements = [Polygon(make_square_vertices(side_length=1.5, center=(0,0)))]
+        self.planning = Planning(self.config)
+
+        world_state = {
+            'obstacles': {
+                'others': [],
+            },
+            'pose': self.pose,
+            'goal': self.goal,
+        }
+
+        self.planning.motion_planning(world_state)
+
+        trajectory = world_state['trajectory']
+        self.assertEqual(3, len(trajectory))
+        self.assertTrue(np.allclose(np.abs(trajectory[1]), 1.75 + np.sqrt(2) / 2))
+        self.assertTrue(geom.trajectory_is_free(self.planning.occupancy_grid, trajectory))
+
+    def test_motion_planning_with_d_star_lite_replans_around_new_obstacle(self):
+        self.config.motion_planner = 'd_star_lite'
+        self.planning = Planning(self.config)
+
+        world_state = {
+            'obstacles': {
+                'others': [],
+            },
+            'pose': self.pose,
+            'goal': self.goal,
+        }
+        self.planning.motion_planning(world_state)
+
+        world_state['obstacles']['others'] = [((-0.5, -0.5), (0.5, 0.5))]
+        self.planning.motion_planning(world_state)
+
+        expected_trajectory_length = 10
+        actual_trajectory_length = len(world_state['trajectory'])
+        self.assertEqual(expected_trajectory_length, actual_trajectory_length)
+
+    def test_motion_planning_with_wavefront_avoids_dynamic_obstacle(self):
+        self.config.motion_planner = 'wavefront'
+        self.planning = Planning(self.config)
+
+        world_state = {
+            'obstacles': {
+                'others': [((-0.5, -0.5), (0.5, 0.5))],
+            },
+            'pose': self.pose,
+            'goal': self.goal,
+        }
+        self.planning.motion_planning(world_state)
+
+        expected_trajectory_length = 10
+        actual_trajectory_length = len(world_state['trajectory'])
+        self.assertEqual(expected_trajectory_length, actual_trajectory_length)
+
+    def test_motion_planning_with_wavefront_descends_field_from_new_start_without_recomputing_it(self):
+        self.config.motion_planner = 'wavefront'
+        self.planning = Planning(self.config)
+
+        world_state = {
+            'obstacles': {
+                'others': [],
+            },
+            'pose': self.pose,
+            'goal': self.goal,
+        }
+        self.planning.motion_planning(world_state)
+        cost_to_goal = self.planning.planner.cost_to_goal
+
+        world_state['pose'] = ((-2.5, 1.5), 0)
+        self.planning.motion_planning(world_state)
+
+        trajectory = world_state['trajectory']
+        self.assertEqual(6, len(trajectory))
+        self.assertEqual([(-2.5, 1.5), self.goal], [trajectory[0], trajectory[-1]])
+        self.assertIs(cost_to_goal, self.planning.planner.cost_to_goal)
+
+    def test_motion_planning_with_wavefront_gives_next_waypoint_from_anywhere(self):
+        self.config.motion_planner = 'wavefront'
+        self.planning = Planning(self.config)
+
+        world_state = {
+            'obstacles': {
+                'others': [],
+            },
+            'pose': self.pose,
+            'goal': self.goal,
+        }
+        self.planning.motion_planning(world_state)
+
+        self.assertEqual((-1.5, -1.5), world_state['next_waypoint'](self.pose[0]))
+        self.assertEqual((1.5, 1.5), world_state['next_waypoint']((1.4, 0.6)))
+
+    def test_motion_planning_gives_no_next_waypoint_with_other_planners(self):
+        world_state = {
+            'obstacles': {
+                'others': [],
+            },
+            'pose': self.pose,
+            'goal': self.goal,
+        }
+        self.planning.motion_planning(world_state)
+
+        self.assertIsNone(world_state['next_waypoint'])
+
+    def test_motion_planning_keeps_clearance_from_obstacles_when_there_is_room(self):
+        self.config.occupancy_grid_width = 10
+        self.config.occupancy_grid_height = 10
+        self.config.occupancy_grid_dilation_kernel_size = 1
+        self.config.occupancy_grid_clearance_radius = 3
+        self.config.occupancy_grid_clearance_weight = 5
+        self.config.field_elements = [Polygon(make_square_vertices(side_length=0.5, center=(0.5, 0.5)))]
+        self.planning = Planning(self.config)
+
+        world_state = {
+            'obstacles': {
+                'others': [],
+            },
+            'pose': ((-4.5, -4.5), 0),
+            'goal': (4.5, 4.5),
+        }
+        self.planning.motion_planning(world_state)
+
+        obstacle_cell = self.planning.occupancy_grid.get_cell((0.5, 0.5))
+        clearances = [geom.dist(point, obstacle_cell.position) for point in world_state['trajectory']]
+        self.assertGreater(min(clearances), 1.5)
+
+    def test_unknown_motion_planner_throws(self):
+        self.config.motion_planner = 'rrt'
+        self.assertRaises(ValueError, Planning, self.config)
+
     def test_motion_planning_returns_trivial_plan_when_goal_reached(self):
         world_state = {
             'obstacles': {
@@ -248,6 +779,14 @@ class TestRun(unittest.TestCase):
         self.config.occupancy_grid_cell_resolution = 1
         self.config.occupancy_grid_origin = (0, 0)
         self.config.occupancy_grid_dilation_kernel_size = 3
+        self.config.occupancy_grid_clearance_radius = 1
+        self.config.occupancy_grid_clearance_weight = 0
+        self.config.pickup_sequencing_max_candidates = 0
+        self.config.landmark_heuristic_num_landmarks = 0
+        self.config.trajectory_reuse_max_deviation = 0.5
+        self.config.shortcut_trajectories = False
+        self.config.trajectory_cache_size = 0
+        self.config.motion_planner = 'a_star'
         self.config.blue_player_station_pos = np.array([10, 10])
 
         self.planning = Planning(self.config)
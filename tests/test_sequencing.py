@@ -0,0 +1,88 @@
+#
+# Copyright (c) 2020 FRC Team 3260
+#
+
+import unittest
+from unittest.mock import Mock
+import geometry as geom
+from geometry import OccupancyGrid, Polygon
+from sequencing import PickupSequencer
+from tests.test_utils import *
+
+
+class TestPickupSequencer(unittest.TestCase):
+    def setUp(self):
+        self.config = Mock()
+        self.config.pickup_sequencing_max_candidates = 6
+        self.occupancy_grid = OccupancyGrid(width=8, height=8, cell_resolution=1, origin=(0, 0))
+        self.sequencer = PickupSequencer(self.config)
+        self.start = (-0.5, -0.5)
+        self.scoring_zone = (-3.5, -3.5)
+
+    def run_sequencer(self, balls, num_pickups):
+        costs, _ = geom.dijkstra(self.occupancy_grid, self.start, balls)
+        return self.sequencer.run(self.occupancy_grid, costs, balls, num_pickups, self.scoring_zone)
+
+    def test_sequence_ends_near_scoring_zone(self):
+        balls = [(-1.5, -1.5), (1.5, 1.5)]
+
+        expected = [1, 0]
+        actual = self.run_sequencer(balls, num_pickups=2)
+        self.assertEqual(expected, actual)
+
+    def test_sequence_only_includes_num_pickups_balls(self):
+        balls = [(-1.5, -1.5), (2.5, 2.5), (0.5, 0.5)]
+
+        expected = [0]
+        actual = self.run_sequencer(balls, num_pickups=1)
+        self.assertEqual(expected, actual)
+
+    def test_sequence_skips_unreachable_balls(self):
+        self.occupancy_grid.set_static_obstacles([Polygon(make_square_vertices(side_length=1, center=(2.5, 2.5)))],
+                                                 kernel_size=1)
+        balls = [(2.5, 2.5), (0.5, 0.5)]
+
+        expected = [1]
+        actual = self.run_sequencer(balls, num_pickups=2)
+        self.assertEqual(expected, actual)
+
+    def test_sequence_is_empty_when_no_balls_are_reachable(self):
+        self.assertEqual([], self.run_sequencer([], num_pickups=3))
+
+    def test_sequence_is_same_as_brute_force(self):
+        rng = np.random.default_rng(3260)
+        balls = [tuple(ball) for ball in rng.uniform(-3.9, 3.9, size=(5, 2))]
+
+        sequence = self.run_sequencer(balls, num_pickups=3)
+
+        def trip_cost(order):
+            points = [self.start] + [balls[i] for i in order] + [self.scoring_zone]
+            cells = [self.occupancy_grid.get_cell(point).indices for point in points]
+            return sum(geom.octile_dist(a, b) for a, b in zip(cells, cells[1:]))
+        expected = min(trip_cost((a, b, c)) for a in range(5) for b in range(5) for c in range(5)
+                       if len({a, b, c}) == 3)
+        actual = trip_cost(sequence)
+        self.assertAlmostEqual(expected, actual)
+
+    def test_costs_between_balls_are_cached(self):
+        balls = [(-1.5, -1.5), (2.5, 2.5), (0.5, 0.5)]
+        self.run_sequencer(balls, num_pickups=3)
+        self.assertEqual(4, self.sequencer.num_searches)
+
+        self.run_sequencer(balls, num_pickups=3)
+        self.assertEqual(0, self.sequencer.num_searches)
+
+        self.run_sequencer(balls[1:] + [(3.5, -3.5)], num_pickups=3)
+        self.assertEqual(1, self.sequencer.num_searches)
+
+    def test_cached_costs_are_dropped_when_static_obstacles_change(self):
+        balls = [(-1.5, -1.5), (2.5, 2.5)]
+        self.run_sequencer(balls, num_pickups=2)
+
+        self.occupancy_grid.set_static_obstacles([], kernel_size=1)
+        self.run_sequencer(balls, num_pickups=2)
+        self.assertEqual(3, self.sequencer.num_searches)
+
+
+if __name__ == '__main__':
+    unittest.main()
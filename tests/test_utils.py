@@ -56,3 +56,10 @@ def make_linear_vertices(start, end, num_pts):
         points.append(start + i*step)
 
     return points
+
+
+def trajectory_length(trajectory):
+    """
+    Helper function that returns the total length of a trajectory given as a list of points.
+    """
+    return sum(np.linalg.norm(np.subtract(p2, p1)) for p1, p2 in zip(trajectory, trajectory[1:]))